@@ -0,0 +1,235 @@
+"""
+Quarterly actuals and budget-vs-actual variance.
+
+An actuals file is a CSV with one row per calendar quarter (`year`,
+`quarter` as 1-4 or Q1-Q4) and any of `generation_mwh`, `revenue_m_cop`
+and `opex_m_cop`; blank cells keep the forecast for that line. The
+`ActualsStore` keeps each project's latest upload next to the hourly
+profiles.
+
+`actual_schedules` aligns the actuals with the engine's quarters
+(`actual_generation` / `actual_revenue` / `actual_opex`, None where there
+is no actual). The engine overwrites those lines in the historical
+quarters and re-forecasts the rest; when the previous run of the same
+inputs is at hand (the app's stage pipeline keeps it) it resumes from
+that run's checkpoint after the last actual quarter instead of replaying
+the whole history, so a monthly update only computes the new quarters.
+Portfolio runs take the actuals through the batched engine.
+"""
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from pharos_cache import atomic_write
+from pharos_engine import ACTUAL_PARAMS, QUARTER_NUMBERS
+
+
+ACTUALS_DIR = os.environ.get("PHAROS_ACTUALS_DIR", "pharos_actuals")
+
+# CSV column (case-insensitive) -> engine parameter and quarterly model column
+ACTUAL_COLUMNS = {
+    "generation_mwh": ("actual_generation", "Generation_MWh"),
+    "revenue_m_cop": ("actual_revenue", "Revenue_M_COP"),
+    "opex_m_cop": ("actual_opex", "OPEX_M_COP"),
+}
+# Lines compared in the variance report (actuals, and what they drive)
+VARIANCE_LINES = ["Generation_MWh", "Revenue_M_COP", "OPEX_M_COP", "EBITDA_M_COP", "LFCF_M_COP"]
+
+
+# ------------------------------------------------------
+# ACTUALS FILES
+# ------------------------------------------------------
+def read_actuals_csv(source):
+    """
+    Actuals as a DataFrame (Year, Quarter, then the ACTUAL_COLUMNS given,
+    NaN where blank), sorted by period. Raises ValueError for missing or
+    bad period columns, repeated quarters, non-numeric or negative values.
+    """
+    df = pd.read_csv(source, dtype=str, keep_default_na=False, skipinitialspace=True,
+                     encoding="utf-8-sig")
+    lookup = {str(c).strip().lower(): c for c in df.columns}
+    for name in ("year", "quarter"):
+        if name not in lookup:
+            raise ValueError(f"Missing {name} column")
+    values = [name for name in ACTUAL_COLUMNS if name in lookup]
+    if not values:
+        raise ValueError(f"No actuals columns (one or more of: {', '.join(ACTUAL_COLUMNS)})")
+
+    year = pd.to_numeric(df[lookup["year"]].str.strip(), errors="coerce")
+    if year.isna().any() or (year % 1 != 0).any():
+        raise ValueError("Year must be a whole number in every row")
+    quarter_text = df[lookup["quarter"]].str.strip().str.upper()
+    quarter = quarter_text.map(QUARTER_NUMBERS).fillna(pd.to_numeric(quarter_text, errors="coerce"))
+    if not quarter.isin([1, 2, 3, 4]).all():
+        raise ValueError("Quarter must be 1-4 or Q1-Q4 in every row")
+
+    out = pd.DataFrame({"Year": year.astype(np.int64), "Quarter": quarter.astype(np.int64)})
+    for name in values:
+        text = df[lookup[name]].str.strip()
+        numbers = pd.to_numeric(text, errors="coerce")
+        if (numbers.isna() & (text != "")).any():
+            raise ValueError(f"{name} has non-numeric values")
+        if (numbers < 0).any():
+            raise ValueError(f"{name} must be non-negative")
+        out[ACTUAL_COLUMNS[name][1]] = numbers.astype(np.float64)
+    if out.duplicated(["Year", "Quarter"]).any():
+        raise ValueError("Each quarter may appear only once")
+    return out.sort_values(["Year", "Quarter"], ignore_index=True)
+
+
+class ActualsStore:
+    """
+    Directory of per-project actuals (one CSV per project).
+
+    Writes go through a temporary file (atomic_write), so readers never
+    see a partial upload.
+    """
+
+    def __init__(self, directory=ACTUALS_DIR):
+        self.directory = directory
+
+    def _path(self, project):
+        digest = hashlib.sha256(project.encode("utf-8")).hexdigest()[:24]
+        return os.path.join(self.directory, f"{digest}.csv")
+
+    def __contains__(self, project):
+        return os.path.exists(self._path(project))
+
+    def signature(self, project):
+        """Changes whenever the project's actuals are saved or removed ("" if none)."""
+        try:
+            st = os.stat(self._path(project))
+        except OSError:
+            return ""
+        return f"{st.st_mtime_ns}-{st.st_size}"
+
+    def save(self, project, actuals):
+        atomic_write(self._path(project), lambda tmp_path: actuals.to_csv(tmp_path, index=False))
+
+    def load(self, project):
+        """Actuals of `project` (see read_actuals_csv), or None."""
+        try:
+            return pd.read_csv(self._path(project))
+        except (OSError, ValueError):
+            return None
+
+    def remove(self, project):
+        try:
+            os.remove(self._path(project))
+        except OSError:
+            pass
+
+
+# ------------------------------------------------------
+# ENGINE ALIGNMENT
+# ------------------------------------------------------
+def actual_periods(p, actuals):
+    """Engine period index (0-based) of each actuals row."""
+    return ((actuals["Year"].to_numpy() - p["start_year"]) * 4
+            + actuals["Quarter"].to_numpy() - p["start_q_num"])
+
+
+def check_actuals(p, actuals):
+    """Messages for actuals rows outside the operating quarters of `p` (empty if all fit)."""
+    periods = actual_periods(p, actuals)
+    first = p["construction_quarters"]
+    last = first + p["ppa_term_years"] * 4
+    errors = []
+    for (year, quarter), i in zip(actuals[["Year", "Quarter"]].itertuples(index=False), periods):
+        if i < first:
+            errors.append(f"{year} Q{quarter}: before commercial operation")
+        elif i >= last:
+            errors.append(f"{year} Q{quarter}: after the end of the PPA term")
+    return errors
+
+
+def actual_schedules(p, actuals):
+    """
+    Engine actuals parameters for `p`: one value per engine quarter, None
+    where there is no actual. Rows outside the operating quarters (see
+    check_actuals) are left out.
+    """
+    n_quarters = p["construction_quarters"] + p["ppa_term_years"] * 4
+    periods = actual_periods(p, actuals)
+    inside = (periods >= p["construction_quarters"]) & (periods < n_quarters)
+    schedules = {}
+    for param, column in ACTUAL_COLUMNS.values():
+        if column not in actuals:
+            continue
+        values = [None] * n_quarters
+        for i, v in zip(periods[inside], actuals[column].to_numpy(np.float64)[inside]):
+            if not np.isnan(v):
+                values[i] = float(v)
+        if any(v is not None for v in values):
+            schedules[param] = tuple(values)
+    return schedules
+
+
+def apply_actuals(p, project, store):
+    """`p` with the project's actuals when it has any stored."""
+    actuals = store.load(project)
+    if actuals is None:
+        return p
+    return {**p, **actual_schedules(p, actuals)}
+
+
+# ------------------------------------------------------
+# VARIANCE
+# ------------------------------------------------------
+def variance_table(p, engine, budget):
+    """
+    Budget vs actual for every quarter with an actual: one row per quarter
+    ("2027 Q1") and VARIANCE_LINES line (Period, Line, Budget, Actual,
+    Variance, Variance_%), then a "Total" row per line. `engine` is the run of `p`
+    (with actuals), `budget` the run of budget_params(p).
+    """
+    columns = ["Period", "Line", "Budget", "Actual", "Variance", "Variance_%"]
+    has_actual = np.zeros(len(engine), dtype=bool)
+    for key in ACTUAL_PARAMS:
+        values = p.get(key)
+        if values is not None:
+            has_actual[:len(values)] |= np.array([v is not None for v in values[:len(engine)]])
+    rows = np.flatnonzero(has_actual)
+    if not len(rows):
+        return pd.DataFrame(columns=columns)
+
+    abs_q = p["start_q_num"] - 1 + rows
+    periods = [f"{p['start_year'] + q // 4} Q{q % 4 + 1}" for q in abs_q]
+    frames = []
+    for line in VARIANCE_LINES:
+        frames.append(pd.DataFrame({
+            "Period": periods,
+            "Line": line,
+            "Budget": budget[line][rows],
+            "Actual": engine[line][rows],
+        }))
+    detail = pd.concat(frames, ignore_index=True)
+    totals = detail.groupby("Line", sort=False)[["Budget", "Actual"]].sum().reset_index()
+    totals["Period"] = "Total"
+    df = pd.concat([detail, totals], ignore_index=True)
+    df["Variance"] = df["Actual"] - df["Budget"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        df["Variance_%"] = np.where(
+            df["Budget"] != 0, df["Variance"] / df["Budget"].abs() * 100, np.nan
+        )
+    return df[columns]
+
+
+def reforecast_kpis(kpis, budget_kpis):
+    """Headline KPIs of the budget and the re-forecast side by side."""
+    labels = {
+        "irr_unlevered": "IRR Unlevered (%)",
+        "irr_levered": "IRR Levered (%)",
+        "npv_equity": "NPV Equity",
+        "moic_levered": "MOIC (x)",
+    }
+    df = pd.DataFrame({
+        "KPI": list(labels.values()),
+        "Budget": [budget_kpis.get(k, np.nan) for k in labels],
+        "Re-forecast": [kpis.get(k, np.nan) for k in labels],
+    })
+    df["Change"] = df["Re-forecast"] - df["Budget"]
+    return df
+
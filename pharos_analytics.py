@@ -0,0 +1,1092 @@
+"""
+Batched model analytics for the Pharos app.
+
+Built on the scenario-axis engine in pharos_batch: every analysis here
+stacks all the parameter sets it needs into one batch and evaluates them
+in a single call instead of rerunning the model once per point.
+"""
+import numpy as np
+import pandas as pd
+
+from pharos_batch import annualized_irr_pct, batch_irr, broadcast_params, run_batch, stack_params
+from pharos_engine import (
+    BASE_CASE_INPUTS,
+    DEFAULT_CURRENCY_MODE,
+    DEFAULT_US_INFLATION,
+    PROJECT_INPUT_KEYS,
+    budget_params,
+    cfads,
+    fx_path,
+    model_params_from_inputs,
+)
+from pharos_actuals import actual_schedules, apply_actuals
+from pharos_profiles import apply_profile, profile_schedules
+
+
+# ------------------------------------------------------
+# SENSITIVITIES
+# ------------------------------------------------------
+# Numeric sidebar inputs (as entered), with short display labels
+SENSITIVITY_LABELS = {
+    "start_year": "Start year",
+    "ppa_term": "PPA term (years)",
+    "tariff_val": "Client tariff ($/kWh)",
+    "inf_val": "Utility inflation (%)",
+    "disc_val": "PPA discount (%)",
+    "esc_val": "PPA escalator (%)",
+    "gen_val": "Generation (MWh/yr)",
+    "cons_val": "Client consumption (MWh/yr)",
+    "deg_val": "Degradation (%)",
+    "const_q": "Construction (quarters)",
+    "capex_val": "CAPEX (M COP)",
+    "opex_val": "OPEX (M COP/yr)",
+    "oinf_val": "OPEX inflation (%)",
+    "sga_val": "SG&A (% gross)",
+    "sga_const_val": "Construction SG&A (% CAPEX)",
+    "tax_val": "Income tax (%)",
+    "cg_val": "Capital gains tax (%)",
+    "dep_val": "Depreciation (years)",
+    "ftt_val": "FTT (per 1000)",
+    "ica_rate": "ICA (%)",
+    "dr_val": "Debt ratio (%)",
+    "int_val": "Interest rate (%)",
+    "tenor_val": "Loan tenor (years)",
+    "fee_val": "Structuring fee (%)",
+    "grace_val": "Grace (quarters)",
+    "dscr_target_val": "Target DSCR (x)",
+    "exit_yr": "Exit year",
+    "exit_mult_val": "Exit multiple (x)",
+    "exit_asset_val": "Exit value (M COP)",
+    "ke_val": "Ke (%)",
+    "fx_rate_current": "FX rate (COP/USD)",
+    "capex_benefit_years": "Ley 1715 years",
+    "capex_benefit_capex_pct": "Ley 1715 eligible CAPEX (%)",
+}
+SENSITIVITY_KEYS = [k for k in PROJECT_INPUT_KEYS if k in SENSITIVITY_LABELS]
+
+# Integer inputs move by whole steps within their widget bounds
+INTEGER_INPUT_BOUNDS = {
+    "start_year": (2020, 2050),
+    "ppa_term": (5, 20),
+    "const_q": (0, 8),
+    "dep_val": (3, 25),
+    "tenor_val": (1, 30),
+    "grace_val": (0, 40),
+    "exit_yr": (2, 20),
+    "capex_benefit_years": (1, 15),
+}
+
+# Relative step for continuous inputs (central differences)
+SENSITIVITY_REL_STEP = 1e-4
+
+
+def _bump(inputs, key, delta):
+    bumped = dict(inputs)
+    bumped[key] = inputs[key] + delta
+    return bumped
+
+
+def sensitivity_points(inputs, keys=None):
+    """
+    Input sets for central differences: the base point, then a (down, up)
+    pair per key. Returns (input dicts, [(key, down, up), ...]) where down/up
+    are the actual deltas applied (one-sided at integer bounds).
+    """
+    keys = SENSITIVITY_KEYS if keys is None else keys
+    base = {k: (BASE_CASE_INPUTS.get(k) if inputs.get(k) is None else inputs[k])
+            for k in PROJECT_INPUT_KEYS}
+    points = [base]
+    steps = []
+    for key in keys:
+        x = base[key]
+        if key in INTEGER_INPUT_BOUNDS:
+            lo, hi = INTEGER_INPUT_BOUNDS[key]
+            if key == "exit_yr":
+                hi = min(hi, int(base["ppa_term"]))
+            down = -1 if x - 1 >= lo else 0
+            up = 1 if x + 1 <= hi else 0
+        else:
+            h = SENSITIVITY_REL_STEP * max(abs(float(x)), 1.0)
+            down, up = -h, h
+        points.append(_bump(base, key, down))
+        points.append(_bump(base, key, up))
+        steps.append((key, down, up))
+    return points, steps
+
+
+def input_sensitivities(inputs, currency_mode=DEFAULT_CURRENCY_MODE,
+                        us_inflation_annual=DEFAULT_US_INFLATION, keys=None,
+                        project=None, profile_store=None, actuals_store=None):
+    """
+    ∂IRR/∂input and ∂NPV/∂input (plus elasticities) at the current inputs.
+
+    All 2K + 1 points go through one batched engine run, so the whole table
+    costs about as much as a couple of single runs. Derivatives are per unit
+    of the input as entered in the sidebar (e.g. per percentage point);
+    integer inputs use ±1 differences. IRR is the levered equity IRR in %,
+    NPV the equity NPV in display currency. Inputs that do not move the
+    KPIs (e.g. debt terms with debt disabled) get zero.
+
+    With a `project`, every point is netted against its hourly profile in
+    `profile_store` (when the profile is on) and re-forecast from its
+    actuals in `actuals_store`, as the dashboard values it.
+    """
+    points, steps = sensitivity_points(inputs, keys)
+    params = [model_params_from_inputs(p, currency_mode, us_inflation_annual) for p in points]
+    profile = None if profile_store is None or project is None else profile_store.load(project)
+    if profile is not None:
+        params = [{**p, **profile_schedules(p, profile)} if p["use_hourly_profile"] else p
+                  for p in params]
+    actuals = None if actuals_store is None or project is None else actuals_store.load(project)
+    if actuals is not None:
+        params = [{**p, **actual_schedules(p, actuals)} for p in params]
+    bp = stack_params(params)
+    _, _, kpis = run_batch(bp, currency_mode)
+    irr = kpis["irr_levered"]
+    npv = kpis["npv_equity"]
+    irr_0, npv_0 = irr[0], npv[0]
+
+    rows = []
+    for i, (key, down, up) in enumerate(steps):
+        x = points[0][key]
+        width = up - down
+        lo, hi = 1 + 2 * i, 2 + 2 * i
+        if width == 0:
+            d_irr = d_npv = np.nan
+        else:
+            d_irr = (irr[hi] - irr[lo]) / width
+            d_npv = (npv[hi] - npv[lo]) / width
+        with np.errstate(divide="ignore", invalid="ignore"):
+            el_irr = d_irr * x / irr_0 if irr_0 else np.nan
+            el_npv = d_npv * x / npv_0 if npv_0 else np.nan
+        rows.append({
+            "Input": SENSITIVITY_LABELS[key],
+            "Key": key,
+            "Value": float(x),
+            "dIRR_pp": d_irr,
+            "dNPV": d_npv,
+            "Elasticity_IRR": el_irr,
+            "Elasticity_NPV": el_npv,
+        })
+    df = pd.DataFrame(rows)
+    df.attrs["irr_levered"] = irr_0
+    df.attrs["npv_equity"] = npv_0
+    return df
+
+
+def kpi_gradient(inputs, keys, currency_mode=DEFAULT_CURRENCY_MODE,
+                 us_inflation_annual=DEFAULT_US_INFLATION, **stores):
+    """{key: (∂IRR, ∂NPV)} for `keys`, for goal-seek and optimizer steps (stores as input_sensitivities)."""
+    df = input_sensitivities(inputs, currency_mode, us_inflation_annual, keys, **stores)
+    return {row.Key: (row.dIRR_pp, row.dNPV) for row in df.itertuples()}
+
+
+# ------------------------------------------------------
+# KPIs BY EXIT YEAR
+# ------------------------------------------------------
+EXIT_METHODS = ("Fixed Asset Value", "EBITDA Multiple")
+
+
+def trailing_ebitda(engine):
+    """Trailing four-quarter EBITDA (M COP) ending at each quarter, from prefix sums."""
+    cum = np.concatenate([[0.0], np.cumsum(engine["EBITDA_M_COP"])])
+    end = np.arange(1, len(engine) + 1)
+    return cum[end] - cum[np.maximum(end - 4, 0)]
+
+
+def exit_year_curves(p, engine, methods=EXIT_METHODS, exit_prices=None):
+    """
+    Equity IRR, NPV and MOIC for every exit year inside the model horizon,
+    for each exit method, as the dashboard would report them with that
+    exit year selected.
+
+    Cash flows before the exit are shared by all exit years, so NPV and
+    MOIC come from prefix sums of the (discounted) display-currency LFCF
+    plus the exit inflow of each year, and the EBITDA-multiple exit values
+    from prefix sums of EBITDA. The IRRs of all exit years and methods are
+    solved in one batch. Returns a long frame (Method, ExitYear, ...).
+
+    model_params_from_inputs zeroes the exit price of the method not
+    selected, so `exit_prices` ({"Fixed Asset Value": M COP, "EBITDA
+    Multiple": x}, the inputs as entered) overrides the price per method.
+    """
+    n = len(engine)
+    cq = p["construction_quarters"]
+    years = np.arange(1, (n - cq) // 4 + 1)
+    exit_q = cq + years * 4
+    last = exit_q - 1
+
+    if "USD" in p["currency_mode"]:
+        factor = 1000 / fx_path(n, p["fx_rate_current"], p["utility_inflation_annual"],
+                                p["us_inflation_annual"])
+        inv_conv = 1000 / p["fx_rate_current"]
+    else:
+        factor = np.ones(n)
+        inv_conv = 1
+    equity_inv_disp = engine.equity_investment_levered_cop * inv_conv
+
+    lfcf = engine["LFCF_M_COP"] * factor
+    disc = (1 + p["investor_disc_rate"] / 4) ** -np.arange(1, n + 1)
+    cum_lfcf = np.concatenate([[0.0], np.cumsum(lfcf)])[exit_q]
+    cum_npv = np.concatenate([[0.0], np.cumsum(lfcf * disc)])[exit_q]
+
+    book = engine["Book_Value_M_COP"][last]
+    debt = engine["Debt_Balance_M_COP"][last]
+    ebitda_4q = trailing_ebitda(engine)[last]
+
+    prices = {"Fixed Asset Value": p["exit_value_cop"], "EBITDA Multiple": p["exit_multiple"],
+              **(exit_prices or {})}
+    frames, inflows = [], []
+    for method in methods:
+        if method == "Fixed Asset Value":
+            exit_value = np.full(len(years), float(prices[method]))
+        else:
+            exit_value = ebitda_4q * float(prices[method])
+        gain = exit_value - book
+        cg_tax = np.where(gain > 0, gain * p["cap_gains_rate"], 0.0)
+        inflow = (exit_value - debt - cg_tax) * factor[last]
+        inflows.append(inflow)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            moic = (cum_lfcf + inflow) / equity_inv_disp if equity_inv_disp > 0 else np.zeros(len(years))
+        frames.append(pd.DataFrame({
+            "Method": method,
+            "ExitYear": years,
+            "Exit_Value_M_COP": exit_value,
+            "NPV": cum_npv + inflow * disc[last],
+            "MOIC": moic,
+        }))
+
+    # One IRR batch: a row per (method, exit year), zero after the exit quarter
+    t = np.arange(n)
+    flows = np.where(t[None, :] < exit_q[:, None], lfcf[None, :], 0.0)
+    flows = np.tile(flows, (len(methods), 1))
+    rows = np.arange(len(flows))
+    flows[rows, np.tile(last, len(methods))] += np.concatenate(inflows)
+
+    curves = pd.concat(frames, ignore_index=True)
+    curves.insert(3, "IRR", annualized_irr_pct(batch_irr(flows)))
+    return curves
+
+
+# ------------------------------------------------------
+# EXIT-VALUE SIMULATION GRIDS
+# ------------------------------------------------------
+def exit_value_irr(engine, construction_quarters, cap_gains_rate, years, values):
+    """
+    Equity IRR (annual %) for each (exit year, exit value COP) pair, as the
+    app's calculate_sim_irr but solved for all pairs in one batch. Pairs
+    past the model horizon get 0.
+    """
+    years = np.asarray(years, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    n_q = len(engine)
+    exit_q = construction_quarters + years * 4
+    inside = exit_q <= n_q
+    irr = np.zeros(len(years))
+    if not inside.any():
+        return irr
+
+    exit_q = exit_q[inside]
+    v = values[inside]
+    width = int(exit_q.max())
+    lfcf = np.asarray(engine["LFCF_M_COP"][:width], dtype=np.float64)
+    # Trailing zeros after the exit quarter leave the IRR unchanged
+    t = np.arange(width)
+    flows = np.where(t[None, :] < exit_q[:, None], lfcf[None, :], 0.0)
+
+    last = exit_q - 1
+    gain = v - np.asarray(engine["Book_Value_M_COP"])[last]
+    tax = np.where(gain > 0, gain * cap_gains_rate, 0.0)
+    flows[np.arange(len(v)), last] += v - np.asarray(engine["Debt_Balance_M_COP"])[last] - tax
+
+    irr[inside] = annualized_irr_pct(batch_irr(flows))
+    return irr
+
+
+def exit_multiple_irr(engine, construction_quarters, cap_gains_rate, years, multiples):
+    """
+    Equity IRR (annual %) for each (exit year, EBITDA multiple) pair, with
+    the exit value priced as in compute_exit: trailing four-quarter EBITDA
+    at the exit quarter times the multiple. Returns (irr, exit values M COP).
+    """
+    years = np.asarray(years, dtype=np.int64)
+    last = np.clip(construction_quarters + years * 4, 1, len(engine)) - 1
+    values = trailing_ebitda(engine)[last] * np.asarray(multiples, dtype=np.float64)
+    return exit_value_irr(engine, construction_quarters, cap_gains_rate, years, values), values
+
+
+def adaptive_exit_grid(engine, construction_quarters, cap_gains_rate, years, min_v, max_v,
+                       hurdles, coarse_points=9, tol=1.0, max_levels=30):
+    """
+    Exit-value x exit-year IRR map refined only where IRR crosses a hurdle.
+
+    Each exit year starts from `coarse_points` evenly spaced values in
+    [min_v, max_v]. Every value interval whose end-point IRRs straddle one
+    of `hurdles` (annual %) is bisected, all midpoints of a level solved in
+    one batch, until the bracket is narrower than `tol` (M COP); the
+    iso-IRR value is then interpolated inside the final bracket.
+
+    Returns (points, contours): every evaluated (ExitYear, ExitValue, IRR,
+    Level) point, Level 0 being the coarse lattice, and one row per
+    (Hurdle, ExitYear, ExitValue) crossing.
+    """
+    years = np.asarray(list(years), dtype=np.int64)
+    grid = np.linspace(float(min_v), float(max_v), max(int(coarse_points), 2))
+    yy, vv = np.repeat(years, len(grid)), np.tile(grid, len(years))
+    irr = exit_value_irr(engine, construction_quarters, cap_gains_rate, yy, vv)
+    points = [pd.DataFrame({"ExitYear": yy, "ExitValue": vv, "IRR": irr, "Level": 0})]
+
+    # Brackets (year, v_lo, v_hi, irr_lo, irr_hi, hurdle) straddling a hurdle
+    irr_grid = irr.reshape(len(years), len(grid))
+    brackets = []
+    for h in hurdles:
+        side = irr_grid - h
+        yi, vi = np.nonzero(np.isfinite(side[:, :-1]) & np.isfinite(side[:, 1:])
+                            & (side[:, :-1] * side[:, 1:] <= 0))
+        brackets.append(np.column_stack([
+            years[yi], grid[vi], grid[vi + 1],
+            irr_grid[yi, vi], irr_grid[yi, vi + 1], np.full(len(yi), h),
+        ]))
+    brackets = np.vstack(brackets) if brackets else np.empty((0, 6))
+
+    level = 0
+    while len(brackets) and level < max_levels:
+        open_ = brackets[:, 2] - brackets[:, 1] > tol
+        if not open_.any():
+            break
+        level += 1
+        work = brackets[open_]
+        mids = 0.5 * (work[:, 1] + work[:, 2])
+        # Brackets of different hurdles can share an interval: solve each midpoint once
+        pairs, inverse = np.unique(np.column_stack([work[:, 0], mids]), axis=0, return_inverse=True)
+        irr_pairs = exit_value_irr(engine, construction_quarters, cap_gains_rate,
+                                   pairs[:, 0], pairs[:, 1])
+        points.append(pd.DataFrame({
+            "ExitYear": pairs[:, 0].astype(np.int64), "ExitValue": pairs[:, 1],
+            "IRR": irr_pairs, "Level": level,
+        }))
+        irr_mid = irr_pairs[inverse.ravel()]
+
+        lower = (work[:, 3] - work[:, 5]) * (irr_mid - work[:, 5]) <= 0
+        work[:, 2] = np.where(lower, mids, work[:, 2])
+        work[:, 4] = np.where(lower, irr_mid, work[:, 4])
+        work[:, 1] = np.where(lower, work[:, 1], mids)
+        work[:, 3] = np.where(lower, work[:, 3], irr_mid)
+        # A NaN midpoint loses the crossing
+        brackets = np.vstack([brackets[~open_], work[np.isfinite(irr_mid)]])
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        frac = (brackets[:, 5] - brackets[:, 3]) / (brackets[:, 4] - brackets[:, 3])
+    frac = np.where(np.isfinite(frac), np.clip(frac, 0.0, 1.0), 0.5)
+    contours = pd.DataFrame({
+        "Hurdle": brackets[:, 5],
+        "ExitYear": brackets[:, 0].astype(np.int64),
+        "ExitValue": brackets[:, 1] + frac * (brackets[:, 2] - brackets[:, 1]),
+    }).sort_values(["Hurdle", "ExitYear", "ExitValue"]).reset_index(drop=True)
+
+    points = pd.concat(points, ignore_index=True)
+    return points, contours
+
+
+# ------------------------------------------------------
+# COVERAGE & PAYBACK
+# ------------------------------------------------------
+FINANCIAL_METRIC_LABELS = {
+    "min_dscr": "Min DSCR (x)",
+    "avg_dscr": "Avg DSCR (x)",
+    "llcr": "LLCR (x)",
+    "min_llcr": "Min LLCR (x)",
+    "payback_years": "Equity payback (years)",
+    "discounted_payback_years": "Discounted payback (years)",
+    "cash_yield_pct": "Cash-on-cash yield (%/yr)",
+}
+
+
+def _rows(values):
+    """(S, Q) float view of a single-run (Q,) or batch (S, Q) array."""
+    return np.atleast_2d(np.asarray(values, dtype=np.float64))
+
+
+def _col(values):
+    return np.asarray(values, dtype=np.float64).reshape(-1, 1)
+
+
+def coverage_ratios(engine):
+    """
+    Per-quarter CFADS, debt service, DSCR and LLCR as (S, Q) arrays, for an
+    EngineResult (S = 1) or a BatchResult.
+
+    DSCR = CFADS / (interest + principal), NaN without debt service.
+    LLCR = PV at the loan rate of CFADS over the remaining loan life (up to
+    the last debt service payment), at the start of the quarter, over the
+    opening balance; NaN without debt outstanding.
+    """
+    cf = _rows(cfads(engine))
+    interest = _rows(engine["Interest_M_COP"])
+    debt_service = interest + _rows(engine["Principal_M_COP"])
+    opening = _rows(engine["Opening_Debt_M_COP"])
+    n_periods = cf.shape[1]
+    t = np.arange(n_periods)[None, :]
+
+    serviced = debt_service > 1e-9
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dscr = np.where(serviced, cf / debt_service, np.nan)
+
+    last = np.where(serviced.any(axis=1), n_periods - 1 - np.argmax(serviced[:, ::-1], axis=1), -1)
+    in_life = t <= last[:, None]
+    rate_q = _col(engine.params["interest_rate_annual"]) / 4
+    growth = (1 + rate_q) ** t
+    # Suffix sums of CFADS discounted to t = 0, brought forward to each quarter's start
+    pv = np.where(in_life, cf / (growth * (1 + rate_q)), 0.0)
+    remaining = np.cumsum(pv[:, ::-1], axis=1)[:, ::-1] * growth
+    outstanding = in_life & (opening > 1e-9)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        llcr = np.where(outstanding, remaining / opening, np.nan)
+    return {"cfads": cf, "debt_service": debt_service, "dscr": dscr, "llcr": llcr}
+
+
+def _payback_years(flows):
+    """Years until cumulative `flows` (S, Q) first turn non-negative (interpolated), NaN if never."""
+    cum = np.cumsum(flows, axis=1)
+    reached = cum >= 0
+    # Ignore quarters before the cumulative position first goes negative
+    started = np.maximum.accumulate(cum < 0, axis=1)
+    hit = reached & started
+    k = np.argmax(hit, axis=1)
+    rows = np.arange(len(flows))
+    prev = np.where(k > 0, cum[rows, np.maximum(k - 1, 0)], 0.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        frac = np.where(flows[rows, k] != 0, -prev / flows[rows, k], 0.0)
+    years = (k + np.clip(frac, 0.0, 1.0)) / 4
+    return np.where(hit.any(axis=1), years, np.nan)
+
+
+def financial_metrics(engine, exit_info, investor_disc_rate):
+    """
+    Coverage and payback KPIs as (S,) arrays, for an EngineResult with
+    compute_exit output (S = 1) or a BatchResult with batch_exit output.
+
+    DSCR/LLCR summaries cover the operating quarters (after construction).
+    Payback periods use the dashboard levered flows (M COP, up to the exit
+    quarter, exit inflow included), counted from the first construction
+    quarter; the discounted one at Ke. Cash-on-cash is the average annual
+    operating LFCF (exit inflow excluded) up to the exit over the levered
+    equity investment.
+    """
+    ratios = coverage_ratios(engine)
+    n_periods = ratios["dscr"].shape[1]
+    t = np.arange(n_periods)[None, :]
+    operating = t >= _col(engine.params["construction_quarters"])
+
+    dscr = np.where(operating, ratios["dscr"], np.nan)
+    llcr = np.where(operating, ratios["llcr"], np.nan)
+    has_dscr = ~np.isnan(dscr).all(axis=1)
+    has_llcr = ~np.isnan(llcr).all(axis=1)
+    with np.errstate(invalid="ignore"):
+        min_dscr = np.where(has_dscr, np.nanmin(np.where(has_dscr[:, None], dscr, 0.0), axis=1), np.nan)
+        avg_dscr = np.where(has_dscr, np.nanmean(np.where(has_dscr[:, None], dscr, 0.0), axis=1), np.nan)
+        min_llcr = np.where(has_llcr, np.nanmin(np.where(has_llcr[:, None], llcr, 0.0), axis=1), np.nan)
+    first_llcr = np.argmax(~np.isnan(llcr), axis=1)
+    llcr_start = np.where(has_llcr, llcr[np.arange(len(llcr)), first_llcr], np.nan)
+
+    lfcf = _rows(engine["LFCF_M_COP"])
+    dash_q = _col(exit_info["dash_exit_q"])
+    flows = np.where(t < dash_q, lfcf, 0.0)
+    flows = flows + (t == dash_q - 1) * _col(exit_info["exit_inflow_levered_cop"])
+    disc = (1 + _col(investor_disc_rate) / 4) ** -(t + 1)
+
+    equity = np.asarray(engine.equity_investment_levered_cop, dtype=np.float64).reshape(-1)
+    ops = operating & (t < dash_q)
+    op_years = ops.sum(axis=1) / 4
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cash_yield = np.where(
+            (equity > 0) & (op_years > 0),
+            (lfcf * ops).sum(axis=1) / op_years / equity * 100,
+            np.nan
+        )
+    return {
+        "min_dscr": min_dscr,
+        "avg_dscr": avg_dscr,
+        "llcr": llcr_start,
+        "min_llcr": min_llcr,
+        "payback_years": _payback_years(flows),
+        "discounted_payback_years": _payback_years(flows * disc),
+        "cash_yield_pct": cash_yield,
+    }
+
+
+def coverage_table(engine):
+    """Quarterly CFADS / debt service / DSCR / LLCR table for one EngineResult."""
+    ratios = coverage_ratios(engine)
+    return pd.DataFrame({
+        "Calendar_Year": engine["Calendar_Year"].astype(np.int64),
+        "Quarter": engine["Quarter"].astype(np.int64),
+        "CFADS_M_COP": ratios["cfads"][0],
+        "Debt_Service_M_COP": ratios["debt_service"][0],
+        "Opening_Debt_M_COP": engine["Opening_Debt_M_COP"],
+        "DSCR": ratios["dscr"][0],
+        "LLCR": ratios["llcr"][0],
+    })
+
+
+# ------------------------------------------------------
+# PORTFOLIO KPIs
+# ------------------------------------------------------
+# Projects per batched engine call (bounds the (S, Q) working set)
+PORTFOLIO_CHUNK_SIZE = 256
+
+
+def portfolio_kpis(inputs_by_project, currency_mode=DEFAULT_CURRENCY_MODE,
+                   us_inflation_annual=DEFAULT_US_INFLATION, chunk_size=PORTFOLIO_CHUNK_SIZE,
+                   profile_store=None, profile_projects=None, actuals_store=None):
+    """
+    Headline, coverage and payback KPIs for many projects: one row per
+    project from batched engine runs of `chunk_size` projects each.
+    Projects using an hourly profile in `profile_store` are netted first
+    and projects with actuals in `actuals_store` are re-forecast from them;
+    `profile_projects` maps keys that are not project names (e.g. saved
+    scenarios) to the project whose profile and actuals they use.
+    """
+    names = list(inputs_by_project)
+    frames = []
+    for start in range(0, len(names), chunk_size):
+        part = names[start:start + chunk_size]
+        params = [
+            model_params_from_inputs(inputs_by_project[name], currency_mode, us_inflation_annual)
+            for name in part
+        ]
+        owners = [name if profile_projects is None else profile_projects[name] for name in part]
+        if profile_store is not None:
+            params = [apply_profile(p, owner, profile_store) for p, owner in zip(params, owners)]
+        if actuals_store is not None:
+            params = [apply_actuals(p, owner, actuals_store) for p, owner in zip(params, owners)]
+        bp = stack_params(params)
+        batch, exit_info, kpis = run_batch(bp, currency_mode)
+        metrics = financial_metrics(batch, exit_info, bp["investor_disc_rate"])
+        frames.append(pd.DataFrame({
+            "Project": part,
+            "Equity_Investment": kpis["equity_inv_disp"],
+            "IRR_Unlevered_%": kpis["irr_unlevered"],
+            "IRR_Levered_%": kpis["irr_levered"],
+            "NPV_Equity": kpis["npv_equity"],
+            "MOIC_x": kpis["moic_levered"],
+            "Min_DSCR_x": metrics["min_dscr"],
+            "LLCR_x": metrics["llcr"],
+            "Payback_Years": metrics["payback_years"],
+            "Cash_Yield_%": metrics["cash_yield_pct"],
+        }))
+    if not frames:
+        return pd.DataFrame(columns=[
+            "Project", "Equity_Investment", "IRR_Unlevered_%", "IRR_Levered_%", "NPV_Equity",
+            "MOIC_x", "Min_DSCR_x", "LLCR_x", "Payback_Years", "Cash_Yield_%",
+        ])
+    return pd.concat(frames, ignore_index=True)
+
+
+# ------------------------------------------------------
+# PORTFOLIO STRESS TESTS
+# ------------------------------------------------------
+# Shock operations on inputs as entered: "add" (percentages move in points),
+# "multiply" and "set"
+STRESS_OPERATIONS = ("add", "multiply", "set")
+
+# Named shock sets: {shock name: [(input key, operation, value), ...]}
+STRESS_SHOCKS = {
+    "Income tax +5 pp": [("tax_val", "add", 5.0)],
+    "FTT (4x1000) doubled": [("ftt_val", "multiply", 2.0)],
+    "Ley 1715 benefit withdrawn": [("capex_benefit_on", "set", False)],
+    "Ley 1715 window 5 years": [("capex_benefit_years", "set", 5)],
+    "Inflation +2 pp": [("inf_val", "add", 2.0), ("oinf_val", "add", 2.0)],
+    "Inflation -2 pp": [("inf_val", "add", -2.0), ("oinf_val", "add", -2.0)],
+    "COP depreciates 20%": [("fx_rate_current", "multiply", 1.25)],
+    "Interest rate +3 pp": [("int_val", "add", 3.0)],
+    "CAPEX +15%": [("capex_val", "multiply", 1.15)],
+    "Tariff -10%": [("tariff_val", "multiply", 0.9)],
+    "Generation -10%": [("gen_val", "multiply", 0.9)],
+    "Exit multiple -1x": [("exit_mult_val", "add", -1.0)],
+}
+
+# Label of the unshocked valuation in stress-test tables
+STRESS_BASE = "Base"
+
+
+def apply_shock(inputs, shock):
+    """
+    Shocked copy of an input dict (missing keys take the base case).
+    Integer inputs are rounded and kept within their widget bounds.
+    """
+    shocked = {k: (BASE_CASE_INPUTS.get(k) if inputs.get(k) is None else inputs[k])
+               for k in PROJECT_INPUT_KEYS}
+    for key, operation, value in shock:
+        if key not in shocked:
+            raise ValueError(f"Unknown input {key!r} in shock")
+        if operation == "set":
+            new = type(BASE_CASE_INPUTS[key])(value) if key in BASE_CASE_INPUTS else value
+        elif operation == "add":
+            new = shocked[key] + value
+        elif operation == "multiply":
+            new = shocked[key] * value
+        else:
+            raise ValueError(f"Unknown shock operation {operation!r}")
+        if key in INTEGER_INPUT_BOUNDS:
+            lo, hi = INTEGER_INPUT_BOUNDS[key]
+            new = int(min(max(round(new), lo), hi))
+        shocked[key] = new
+    shocked["exit_yr"] = min(shocked["exit_yr"], shocked["ppa_term"])
+    return shocked
+
+
+def stress_test(inputs_by_project, shocks=None, currency_mode=DEFAULT_CURRENCY_MODE,
+                us_inflation_annual=DEFAULT_US_INFLATION, chunk_size=PORTFOLIO_CHUNK_SIZE,
+                profile_store=None, actuals_store=None):
+    """
+    Value every project unshocked and under every shock set.
+
+    All projects x (shocks + base) input sets go through portfolio_kpis,
+    i.e. batched engine runs of `chunk_size`. Returns (summary, detail):
+    `detail` has one row per project and shock with levered IRR, NPV and
+    their change vs the base; `summary` one row per shock with portfolio
+    NPV, equity-weighted IRR and their impact, and the worst-hit project.
+    """
+    shocks = STRESS_SHOCKS if shocks is None else shocks
+    names = list(inputs_by_project)
+    cases = {STRESS_BASE: (), **shocks}
+    variants = {
+        (name, case): apply_shock(inputs_by_project[name], shock)
+        for case, shock in cases.items()
+        for name in names
+    }
+    kpis = portfolio_kpis(
+        {i: inputs for i, inputs in enumerate(variants.values())},
+        currency_mode, us_inflation_annual, chunk_size,
+        profile_store=profile_store,
+        profile_projects={i: name for i, (name, _) in enumerate(variants)},
+        actuals_store=actuals_store,
+    )
+
+    n = len(names)
+    shape = (len(cases), n)
+    irr = kpis["IRR_Levered_%"].to_numpy(np.float64).reshape(shape)
+    npv = kpis["NPV_Equity"].to_numpy(np.float64).reshape(shape)
+    equity = kpis["Equity_Investment"].to_numpy(np.float64).reshape(shape)
+    d_irr = irr - irr[0]
+    d_npv = npv - npv[0]
+
+    detail = pd.DataFrame({
+        "Shock": np.repeat(list(cases), n),
+        "Project": np.tile(np.array(names, dtype=object), len(cases)),
+        "Equity_Investment": equity.ravel(),
+        "IRR_Levered_%": irr.ravel(),
+        "ΔIRR_pp": d_irr.ravel(),
+        "NPV_Equity": npv.ravel(),
+        "ΔNPV": d_npv.ravel(),
+    })
+
+    # Equity-weighted IRR over the projects with a defined IRR (as the Excel portfolio sheet)
+    valid = np.isfinite(irr)
+    weights = np.where(valid, equity, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        wtd_irr = np.where(valid, irr * equity, 0.0).sum(axis=1) / weights.sum(axis=1)
+        portfolio_npv = npv.sum(axis=1)
+        d_pct = (portfolio_npv - portfolio_npv[0]) / np.abs(portfolio_npv[0]) * 100
+    worst = np.where(np.isfinite(d_irr), d_irr, np.inf)
+    worst_idx = worst.argmin(axis=1) if n else np.zeros(len(cases), dtype=np.int64)
+    summary = pd.DataFrame({
+        "Shock": list(cases),
+        "Portfolio_NPV": portfolio_npv,
+        "ΔNPV": portfolio_npv - portfolio_npv[0],
+        "ΔNPV_%": d_pct,
+        "Wtd_IRR_%": wtd_irr,
+        "ΔIRR_pp": wtd_irr - wtd_irr[0],
+        "Projects_Worse": (d_irr < -1e-9).sum(axis=1),
+        "Worst_Project": [
+            names[i] if n and d_irr[c, i] < -1e-9 else "" for c, i in enumerate(worst_idx)
+        ],
+        "Worst_ΔIRR_pp": d_irr[np.arange(len(cases)), worst_idx] if n else np.full(len(cases), np.nan),
+    })
+    return summary, detail
+
+
+# ------------------------------------------------------
+# DEAL OPTIMIZER
+# ------------------------------------------------------
+# Deal terms the optimizer can move (inputs as entered): label, model parameter,
+# input -> parameter scale and whether the input is whole-numbered
+DEAL_VARIABLES = {
+    "disc_val": ("PPA discount (%)", "discount_rate", 0.01, False),
+    "dr_val": ("Debt ratio (%)", "debt_ratio", 0.01, True),
+    "tenor_val": ("Loan tenor (years)", "loan_tenor_years", 1, True),
+    "exit_yr": ("Exit year", "exit_year", 1, True),
+    "exit_mult_val": ("Exit multiple (x)", "exit_multiple", 1, False),
+    "exit_asset_val": ("Buy-back price (M COP)", "exit_value_cop", 1, False),
+}
+DEAL_OBJECTIVES = {"npv_equity": "Equity NPV", "irr_levered": "Equity IRR (%)"}
+# Constraint -> (label, metric, sense)
+DEAL_CONSTRAINTS = {
+    "min_savings_pct": ("Client savings (%)", "savings_pct", ">="),
+    "min_dscr": ("Min DSCR (x)", "min_dscr", ">="),
+    "max_buyback": ("Buy-back price (M COP)", "buyback_m_cop", "<="),
+}
+# Slack (relative to max(1, |limit|)) under which a constraint is reported as binding
+DEAL_BINDING_TOL = 5e-3
+
+
+def deal_variables(p):
+    """Deal terms that move the KPIs of `p`: debt terms only with debt, the exit value of the exit method."""
+    keys = ["disc_val"]
+    if p["enable_debt"]:
+        keys += ["dr_val", "tenor_val"]
+    keys.append("exit_yr")
+    keys.append("exit_asset_val" if p["exit_method"] == "Fixed Asset Value" else "exit_mult_val")
+    return keys
+
+
+def deal_values(p, keys):
+    """Current value (as entered) of each deal variable of `p`."""
+    return {key: p[DEAL_VARIABLES[key][1]] / DEAL_VARIABLES[key][2] for key in keys}
+
+
+def default_deal_bounds(p, keys):
+    """Search range per deal variable: widget bounds, the PPA term for the exit, ±3x the current value otherwise."""
+    current = deal_values(p, keys)
+    bounds = {
+        "disc_val": (0.0, 60.0),
+        "dr_val": (0.0, 90.0),
+        "tenor_val": (max(1, p["grace_period_quarters"] // 4 + 1), INTEGER_INPUT_BOUNDS["tenor_val"][1]),
+        "exit_yr": (INTEGER_INPUT_BOUNDS["exit_yr"][0], p["ppa_term_years"]),
+        "exit_mult_val": (1.0, max(10.0, 2 * current.get("exit_mult_val", 0.0))),
+        "exit_asset_val": (0.0, max(3 * current.get("exit_asset_val", 0.0), 2 * p["capex_million_cop"])),
+    }
+    return {key: bounds[key] for key in keys}
+
+
+def client_savings_pct(bp, batch, exit_info):
+    """
+    Client savings (%) over the operating quarters up to the exit: 1 - PPA
+    payments / what the billed energy would cost at the utility tariff
+    (growing at utility inflation), as (S,).
+    """
+    n_periods = batch.n_periods
+    t_op = (np.arange(1, n_periods + 1)[None, :] - bp["construction_quarters"] - 1) / 4
+    ppa_factor = (1 - bp["discount_rate"]) * (1 + bp["pcp_escalator_annual"]) ** t_op
+    utility_factor = (1 + bp["utility_inflation_annual"]) ** t_op
+    held = np.arange(n_periods)[None, :] < exit_info["dash_exit_q"].reshape(-1, 1)
+    revenue = np.where(held, batch["Revenue_M_COP"], 0.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        utility_cost = (revenue * np.where(ppa_factor > 0, utility_factor / ppa_factor, 0.0)).sum(axis=1)
+        return np.where(utility_cost > 0, (1 - revenue.sum(axis=1) / utility_cost) * 100, np.nan)
+
+
+def deal_metrics(p, values, currency_mode=None):
+    """
+    KPIs and constraint metrics for candidate deals: `values` maps deal
+    variables (as entered) to (S,) arrays; everything else comes from `p`.
+    All S candidates go through one batched engine run.
+    """
+    currency_mode = currency_mode or p.get("currency_mode", DEFAULT_CURRENCY_MODE)
+    overrides = {
+        DEAL_VARIABLES[key][1]: np.asarray(v, dtype=np.float64) * DEAL_VARIABLES[key][2]
+        for key, v in values.items()
+    }
+    bp = broadcast_params(p, **overrides)
+    batch, exit_info, kpis = run_batch(bp, currency_mode)
+    metrics = financial_metrics(batch, exit_info, bp["investor_disc_rate"])
+    return {
+        "npv_equity": kpis["npv_equity"],
+        "irr_levered": kpis["irr_levered"],
+        "savings_pct": client_savings_pct(bp, batch, exit_info),
+        "min_dscr": metrics["min_dscr"],
+        "buyback_m_cop": exit_info["final_exit_val_cop"],
+    }
+
+
+def _violation(metrics, constraints):
+    """Total constraint violation per candidate, each relative to max(1, |limit|)."""
+    total = np.zeros(len(metrics["npv_equity"]))
+    for name, limit in constraints.items():
+        _, metric, sense = DEAL_CONSTRAINTS[name]
+        value = metrics[metric]
+        if metric == "min_dscr":
+            # No debt service: nothing to cover
+            value = np.where(np.isnan(value), np.inf, value)
+        short = limit - value if sense == ">=" else value - limit
+        total += np.maximum(np.nan_to_num(short, nan=np.inf), 0.0) / max(1.0, abs(limit))
+    return total
+
+
+def _rank(objective, violation):
+    """Candidate order: feasible by objective (descending), then infeasible by violation."""
+    score = np.where(np.isnan(objective), -np.inf, objective)
+    return np.lexsort((-score, violation))
+
+
+def optimize_deal(p, objective="npv_equity", constraints=None, bounds=None, keys=None,
+                  population=96, generations=12, polish_rounds=40, seed=0):
+    """
+    Deal terms (DEAL_VARIABLES) maximizing `objective` subject to
+    `constraints` ({DEAL_CONSTRAINTS name: limit}; DSCR only binds with
+    debt service).
+
+    Cross-entropy search: each generation samples `population` deals around
+    the current mean and spread, values them in one batched engine run and
+    refits mean and spread to the best eighth (feasible deals first, the
+    least infeasible otherwise); the best deal so far is carried over. A
+    compass search then moves each variable around the best deal, shrinking
+    the step when no move helps (up to `polish_rounds` batches), to settle
+    on the constraint edges. Whole-numbered inputs are rounded.
+
+    Returns a dict with the best `values` (as entered) and its `metrics`,
+    the `current` deal and metrics, `feasible`, a `variables` table,
+    a `constraints` table flagging the binding ones, the per-generation
+    `history` and the number of deals valued.
+    """
+    constraints = {k: float(v) for k, v in (constraints or {}).items() if v is not None}
+    keys = deal_variables(p) if keys is None else list(keys)
+    bounds = {**default_deal_bounds(p, keys), **(bounds or {})}
+    lo = np.array([bounds[k][0] for k in keys], dtype=np.float64)
+    hi = np.array([bounds[k][1] for k in keys], dtype=np.float64)
+    integer = np.array([DEAL_VARIABLES[k][3] for k in keys])
+    current = deal_values(p, keys)
+    rng = np.random.default_rng(seed)
+
+    def clean(x):
+        x = np.clip(x, lo, hi)
+        return np.where(integer, np.round(x), x)
+
+    def evaluate(x):
+        metrics = deal_metrics(p, {k: x[:, j] for j, k in enumerate(keys)})
+        return metrics, _violation(metrics, constraints)
+
+    evaluations = 0
+    best_x, best_metrics, best_v = None, None, None
+
+    def keep_best(x, metrics, violation):
+        nonlocal best_x, best_metrics, best_v, evaluations
+        evaluations += len(x)
+        i = _rank(metrics[objective], violation)[0]
+        challenger = (violation[i], -np.nan_to_num(metrics[objective][i], nan=-np.inf))
+        if best_x is None or challenger < (best_v, -np.nan_to_num(best_metrics[objective], nan=-np.inf)):
+            best_x = x[i].copy()
+            best_metrics = {name: values[i] for name, values in metrics.items()}
+            best_v = violation[i]
+
+    mean = clean(np.array([current[k] for k in keys], dtype=np.float64))
+    spread = (hi - lo) / 2
+    n_elite = max(4, population // 8)
+    history = []
+    for generation in range(generations):
+        x = clean(rng.normal(mean, spread, size=(population, len(keys))))
+        x[0] = mean if best_x is None else best_x
+        metrics, violation = evaluate(x)
+        keep_best(x, metrics, violation)
+        elite = x[_rank(metrics[objective], violation)[:n_elite]]
+        mean = 0.7 * elite.mean(axis=0) + 0.3 * mean
+        spread = np.maximum(0.7 * elite.std(axis=0) + 0.3 * spread, np.where(integer, 0.5, 0.0))
+        history.append({
+            "Generation": generation + 1,
+            "Evaluations": evaluations,
+            "Best_Objective": best_metrics[objective],
+            "Feasible_Share_%": (violation == 0).mean() * 100,
+        })
+        if (spread <= np.maximum((hi - lo) * 1e-3, np.where(integer, 0.5, 0.0))).all():
+            break
+
+    # Compass search around the best deal: every variable and every pair of
+    # variables moved (pairs slide along a binding constraint), one batch per
+    # round; the step shrinks whenever a round finds nothing better
+    step = (hi - lo) / 20
+    scales = np.array([-4.0, -2.0, -1.0, -0.5, 0.5, 1.0, 2.0, 4.0])
+    signs = np.array([[1, 1], [1, -1], [-1, 1], [-1, -1]], dtype=np.float64)
+    for _ in range(polish_rounds):
+        start = best_x.copy()
+        unit = np.where(integer, 1.0, step)
+        candidates = []
+        for j in range(len(keys)):
+            deltas = np.array([-2.0, -1.0, 1.0, 2.0]) if integer[j] else scales * step[j]
+            moved = np.repeat(best_x[None, :], len(deltas), axis=0)
+            moved[:, j] += deltas
+            candidates.append(moved)
+            for k in range(j + 1, len(keys)):
+                for scale in (0.5, 1.0, 2.0):
+                    moved = np.repeat(best_x[None, :], len(signs), axis=0)
+                    moved[:, j] += signs[:, 0] * unit[j] * (1.0 if integer[j] else scale)
+                    moved[:, k] += signs[:, 1] * unit[k] * (1.0 if integer[k] else scale)
+                    candidates.append(moved)
+        x = clean(np.vstack(candidates))
+        metrics, violation = evaluate(x)
+        keep_best(x, metrics, violation)
+        if np.array_equal(best_x, start):
+            step = step / 4
+            if (step <= (hi - lo) * 1e-6).all():
+                break
+    history.append({
+        "Generation": "polish",
+        "Evaluations": evaluations,
+        "Best_Objective": best_metrics[objective],
+        "Feasible_Share_%": np.nan,
+    })
+
+    current_metrics = {
+        name: values[0]
+        for name, values in deal_metrics(p, {k: [current[k]] for k in keys}).items()
+    }
+    values = {k: (int(v) if DEAL_VARIABLES[k][3] else float(v)) for k, v in zip(keys, best_x)}
+    edge = np.maximum(hi - lo, 1.0) * 1e-6
+    variables = pd.DataFrame({
+        "Input": [DEAL_VARIABLES[k][0] for k in keys],
+        "Key": keys,
+        "Current": [current[k] for k in keys],
+        "Optimal": [values[k] for k in keys],
+        "Lower": lo,
+        "Upper": hi,
+        "At_Bound": np.where(best_x <= lo + edge, "lower", np.where(best_x >= hi - edge, "upper", "")),
+    })
+    rows = []
+    for name, limit in constraints.items():
+        label, metric, sense = DEAL_CONSTRAINTS[name]
+        value = best_metrics[metric]
+        slack = value - limit if sense == ">=" else limit - value
+        rows.append({
+            "Constraint": f"{label} {sense} {limit:g}",
+            "Limit": limit,
+            "Value": value,
+            "Slack": slack,
+            "Binding": bool(np.isfinite(slack) and abs(slack) <= DEAL_BINDING_TOL * max(1.0, abs(limit))),
+        })
+    return {
+        "objective": objective,
+        "values": values,
+        "metrics": best_metrics,
+        "current": current,
+        "current_metrics": current_metrics,
+        "feasible": bool(best_v == 0),
+        "variables": variables,
+        "constraints": pd.DataFrame(rows, columns=["Constraint", "Limit", "Value", "Slack", "Binding"]),
+        "history": pd.DataFrame(history),
+        "evaluations": evaluations,
+    }
+
+
+# ------------------------------------------------------
+# SYSTEM SIZING
+# ------------------------------------------------------
+SIZING_OBJECTIVES = {
+    "npv_equity": "Equity NPV",
+    "irr_levered": "Equity IRR (%)",
+    "irr_unlevered": "Project IRR (%)",
+}
+# Cost scaling with size s (generation / reference generation, the
+# current one unless it is zero): CAPEX x s ** capex exponent, OPEX x s ** opex exponent
+DEFAULT_CAPEX_EXPONENT = 0.9
+DEFAULT_OPEX_EXPONENT = 0.8
+DEFAULT_MAX_COVERAGE_PCT = 100.0
+
+
+def default_size_range(p, max_coverage_pct=DEFAULT_MAX_COVERAGE_PCT):
+    """
+    Generation range (MWh/yr) to sweep: a quarter of the current size (of
+    the size at the coverage cap when the current one is zero) up to past
+    the cap.
+    """
+    gen = p["initial_gen_mwh_annual"]
+    cap = p["client_consumption"] * max_coverage_pct / 100
+    ref = gen if gen > 0 else cap
+    return 0.25 * ref, max(2 * ref, 1.25 * cap)
+
+
+def size_sweep(p, sizes, capex_exponent=DEFAULT_CAPEX_EXPONENT,
+               opex_exponent=DEFAULT_OPEX_EXPONENT, profile=None, currency_mode=None,
+               reference_mwh=None):
+    """
+    KPIs of `p` rebuilt at each first-year generation in `sizes` (MWh/yr),
+    with CAPEX and OPEX following the size curves from `reference_mwh`, the
+    generation the entered costs are for (default: the current one; must be
+    positive, else ValueError). With an hourly `profile`
+    (and the profile switched on) every size is netted against the same
+    load, so oversized systems export more; without one all generation is
+    billed. Actuals are dropped (sizing is a pre-build decision). All sizes
+    go through one batched engine run.
+    """
+    currency_mode = currency_mode or p.get("currency_mode", DEFAULT_CURRENCY_MODE)
+    sizes = np.asarray(sizes, dtype=np.float64)
+    base = {**budget_params(p), "generation_schedule": None, "billed_schedule": None}
+    reference_mwh = p["initial_gen_mwh_annual"] if reference_mwh is None else reference_mwh
+    if not reference_mwh > 0:
+        raise ValueError("size_sweep needs a positive reference generation to scale costs from")
+    scale = sizes / reference_mwh
+    params = []
+    for gen, s in zip(sizes, scale):
+        sized = {
+            **base,
+            "initial_gen_mwh_annual": float(gen),
+            "capex_million_cop": p["capex_million_cop"] * s ** capex_exponent,
+            "opex_million_cop_annual": p["opex_million_cop_annual"] * s ** opex_exponent,
+        }
+        if profile is not None and p.get("use_hourly_profile"):
+            sized.update(profile_schedules(sized, profile))
+        params.append(sized)
+    bp = stack_params(params)
+    batch, exit_info, kpis = run_batch(bp, currency_mode)
+    metrics = financial_metrics(batch, exit_info, bp["investor_disc_rate"])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        coverage = np.where(
+            p["client_consumption"] > 0, sizes / p["client_consumption"] * 100, np.nan
+        )
+    return pd.DataFrame({
+        "Generation_MWh": sizes,
+        "Size_x": scale,
+        "Coverage_%": coverage,
+        "CAPEX_M_COP": bp["capex_million_cop"][:, 0],
+        "OPEX_M_COP": bp["opex_million_cop_annual"][:, 0],
+        "NPV_Equity": kpis["npv_equity"],
+        "IRR_Levered_%": kpis["irr_levered"],
+        "IRR_Unlevered_%": kpis["irr_unlevered"],
+        "Min_DSCR_x": metrics["min_dscr"],
+    })
+
+
+def optimize_size(p, objective="npv_equity", max_coverage_pct=DEFAULT_MAX_COVERAGE_PCT,
+                  size_range=None, n_sizes=41, capex_exponent=DEFAULT_CAPEX_EXPONENT,
+                  opex_exponent=DEFAULT_OPEX_EXPONENT, profile=None, currency_mode=None):
+    """
+    System size maximizing `objective` (SIZING_OBJECTIVES) with coverage
+    (first-year generation / client consumption) at most `max_coverage_pct`.
+
+    Sweeps `n_sizes` sizes across `size_range` (default_size_range) plus
+    the current size and the size at the cap in one size_sweep. Returns a dict with the sweep
+    `table` (Feasible and Current columns added), the `best` and `current`
+    rows, `reference_mwh` (the size the entered CAPEX and OPEX are scaled
+    from) and `feasible` (False when no size meets the cap; `best` is then
+    None).
+
+    A project with zero generation has no current size: `current` is None
+    and costs scale from the size at the cap (the top of the range when
+    there is no consumption to cap).
+    """
+    lo, hi = size_range or default_size_range(p, max_coverage_pct)
+    gen = p["initial_gen_mwh_annual"]
+    at_cap = p["client_consumption"] * max_coverage_pct / 100
+    sizes = np.linspace(lo, hi, n_sizes)
+    if gen > 0:
+        sizes = np.union1d(sizes, [gen])
+    if lo <= at_cap <= hi:
+        sizes = np.union1d(sizes, [at_cap])
+    sizes = sizes[sizes > 0]
+    reference_mwh = gen if gen > 0 else (at_cap if at_cap > 0 else hi)
+    table = size_sweep(p, sizes, capex_exponent, opex_exponent, profile, currency_mode, reference_mwh)
+    table["Feasible"] = ~(table["Coverage_%"] > max_coverage_pct * (1 + 1e-9))
+    table["Current"] = np.isclose(table["Generation_MWh"], gen) if gen > 0 else False
+    column = {"npv_equity": "NPV_Equity", "irr_levered": "IRR_Levered_%",
+              "irr_unlevered": "IRR_Unlevered_%"}[objective]
+    score = table[column].where(table["Feasible"])
+    best = None if score.isna().all() else table.loc[score.idxmax()]
+    return {
+        "objective": objective,
+        "column": column,
+        "max_coverage_pct": max_coverage_pct,
+        "table": table,
+        "best": best,
+        "current": table[table["Current"]].iloc[0] if gen > 0 else None,
+        "reference_mwh": reference_mwh,
+        "feasible": best is not None,
+    }
@@ -0,0 +1,527 @@
+"""
+Local HTTP/JSON valuation API for the Pharos BTM model.
+
+    python pharos_api.py --port 8765 --workers 2
+
+Endpoints (JSON in, JSON out; inputs use the PROJECT_INPUT_KEYS of the
+sidebar, as entered, and missing keys take the base case):
+
+    GET  /v1/health      service status
+    GET  /v1/inputs      input keys, base case values and (min, max) bounds
+    POST /v1/kpis        {"inputs": {...}} or {"batch": [{...}, ...]}
+    POST /v1/cashflows   {"inputs": {...}}: KPIs + annual dashboard cash flows
+    POST /v1/buyback     {"inputs", "years": [from, to], "min_value", "max_value",
+                          "step", "hurdles": [IRR %, ...]}: IRR grid and hurdle
+                          buy-back prices (M COP) per exit year
+    POST /v1/sweep       {"inputs", "key", "values": [...]}: KPIs per value
+
+Every request may also carry "currency_mode" and "us_inflation". Inputs
+are checked with the site-list rules (pharos_import): a value of the wrong
+type or outside its bounds (e.g. a debt ratio above 100%) answers 400 with
+per-field details rather than KPIs of a model the app cannot open.
+
+KPI requests from all connections are queued and coalesced: a batcher
+thread collects up to `max_batch` of them within `max_wait_ms` and values
+each group in one batched engine call (pharos_batch) on a pool of warm
+worker processes (`workers=0` runs them on one in-process thread).
+Set PHAROS_API_TOKEN to require `Authorization: Bearer <token>`.
+
+`PharosClient` is a small keep-alive client for scripts and tests.
+"""
+import argparse
+import http.client
+import json
+import math
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from pharos_analytics import adaptive_exit_grid, exit_value_irr, financial_metrics
+from pharos_batch import run_batch, stack_params
+from pharos_engine import (
+    BASE_CASE_INPUTS,
+    DEFAULT_CURRENCY_MODE,
+    DEFAULT_US_INFLATION,
+    PROJECT_INPUT_KEYS,
+    model_params_from_inputs,
+    run_model,
+)
+from pharos_import import INPUT_BOUNDS, coerce_input_rows
+
+
+API_HOST = os.environ.get("PHAROS_API_HOST", "127.0.0.1")
+API_PORT = int(os.environ.get("PHAROS_API_PORT", "8765"))
+API_TOKEN = os.environ.get("PHAROS_API_TOKEN", "")
+
+# Request coalescing for /v1/kpis
+MAX_BATCH = 256
+MAX_WAIT_MS = 2.0
+# Largest batch accepted in one request / sweep, and largest buy-back grid
+MAX_REQUEST_BATCH = 5000
+MAX_GRID_POINTS = 20000
+REQUEST_TIMEOUT_S = 60
+
+
+class RequestError(ValueError):
+    """Invalid request (HTTP 400); `details` lists per-field messages."""
+
+    def __init__(self, message, details=None):
+        super().__init__(message)
+        self.details = details or []
+
+
+# ------------------------------------------------------
+# VALUATION (runs in the workers)
+# ------------------------------------------------------
+def _number(value):
+    value = float(value)
+    return value if math.isfinite(value) else None
+
+
+def _params(inputs, currency_mode, us_inflation):
+    return model_params_from_inputs(inputs, currency_mode, us_inflation)
+
+
+def value_batch(inputs_list, currency_mode=DEFAULT_CURRENCY_MODE, us_inflation=DEFAULT_US_INFLATION):
+    """KPI dicts for validated input dicts, from one batched engine run."""
+    bp = stack_params([_params(inputs, currency_mode, us_inflation) for inputs in inputs_list])
+    batch, exit_info, kpis = run_batch(bp, currency_mode)
+    metrics = financial_metrics(batch, exit_info, bp["investor_disc_rate"])
+    columns = {
+        "equity_investment": kpis["equity_inv_disp"],
+        "irr_unlevered_pct": kpis["irr_unlevered"],
+        "irr_levered_pct": kpis["irr_levered"],
+        "npv_equity": kpis["npv_equity"],
+        "moic": kpis["moic_levered"],
+        "exit_value_m_cop": exit_info["final_exit_val_cop"],
+        "debt_m_cop": batch.total_debt_principal,
+        **metrics,
+    }
+    columns = {name: np.ravel(values) for name, values in columns.items()}
+    return [
+        {name: _number(values[i]) for name, values in columns.items()}
+        for i in range(len(inputs_list))
+    ]
+
+
+def cash_flows(inputs, currency_mode=DEFAULT_CURRENCY_MODE, us_inflation=DEFAULT_US_INFLATION):
+    """Annual dashboard cash flows (display currency, exit included) plus KPIs."""
+    p = _params(inputs, currency_mode, us_inflation)
+    annual = run_model(p)["aggregation"]["df_annual_dash"]
+    return {
+        "kpis": value_batch([inputs], currency_mode, us_inflation)[0],
+        "annual": [
+            {col: (int(v) if col == "Calendar_Year" else _number(v)) for col, v in row.items()}
+            for row in annual.to_dict("records")
+        ],
+    }
+
+
+def buyback(inputs, years, min_value, max_value, step, hurdles=(),
+            currency_mode=DEFAULT_CURRENCY_MODE, us_inflation=DEFAULT_US_INFLATION):
+    """
+    Buy-back matrix: equity IRR (%) per exit year and asset value (M COP),
+    and, for each hurdle IRR, the buy-back value reaching it per exit year.
+    """
+    p = _params(inputs, currency_mode, us_inflation)
+    engine = run_model(p)["engine"]
+    year_axis = np.arange(years[0], years[1] + 1)
+    value_axis = np.arange(min_value, max_value + step / 2, step)
+    yy, vv = np.meshgrid(year_axis, value_axis, indexing="ij")
+    irr = exit_value_irr(
+        engine, p["construction_quarters"], p["cap_gains_rate"], yy.ravel(), vv.ravel()
+    ).reshape(yy.shape)
+    result = {
+        "exit_years": year_axis.tolist(),
+        "exit_values": value_axis.tolist(),
+        "irr_pct": [[_number(v) for v in row] for row in irr],
+    }
+    if hurdles:
+        _, contours = adaptive_exit_grid(
+            engine, p["construction_quarters"], p["cap_gains_rate"],
+            year_axis, min_value, max_value, list(hurdles), tol=step / 10
+        )
+        result["hurdles"] = [
+            {"hurdle_pct": float(h), "exit_year": int(y), "exit_value": _number(v)}
+            for h, y, v in contours[["Hurdle", "ExitYear", "ExitValue"]].itertuples(index=False)
+        ]
+    return result
+
+
+def _warm_worker():
+    """Process initializer: import and exercise the engine once."""
+    value_batch([{}])
+
+
+# ------------------------------------------------------
+# SERVICE
+# ------------------------------------------------------
+class ValuationService:
+    """
+    Worker pool plus the KPI request batcher.
+
+    `kpis(inputs_list, ...)` returns a Future per input dict; requests
+    arriving within `max_wait_ms` of each other (up to `max_batch`) share
+    one batched engine run. Heavier requests (`call`) go straight to the
+    pool.
+    """
+
+    def __init__(self, workers=None, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS):
+        workers = (os.cpu_count() or 1) if workers is None else workers
+        self.workers = workers
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        if workers > 0:
+            # spawn: workers must not inherit the server's threads and sockets
+            self.pool = ProcessPoolExecutor(
+                workers, mp_context=multiprocessing.get_context("spawn"), initializer=_warm_worker
+            )
+        else:
+            _warm_worker()
+            self.pool = ThreadPoolExecutor(1)
+        self.stats = {"requests": 0, "valuations": 0, "batches": 0}
+        self._queue = queue.Queue()
+        self._batcher = threading.Thread(target=self._batch_loop, name="pharos-batcher", daemon=True)
+        self._batcher.start()
+
+    def kpis(self, inputs_list, currency_mode, us_inflation):
+        futures = []
+        for inputs in inputs_list:
+            future = Future()
+            self._queue.put((inputs, (currency_mode, us_inflation), future))
+            futures.append(future)
+        return futures
+
+    def call(self, func, *args, **kwargs):
+        return self.pool.submit(func, *args, **kwargs)
+
+    def _batch_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            items = [item]
+            deadline = time.monotonic() + self.max_wait
+            while len(items) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)
+                    break
+                items.append(item)
+
+            groups = {}
+            for inputs, settings, future in items:
+                groups.setdefault(settings, []).append((inputs, future))
+            for (currency_mode, us_inflation), group in groups.items():
+                self._dispatch(group, currency_mode, us_inflation)
+
+    def _dispatch(self, group, currency_mode, us_inflation):
+        self.stats["batches"] += 1
+        self.stats["valuations"] += len(group)
+        try:
+            job = self.pool.submit(value_batch, [inputs for inputs, _ in group], currency_mode, us_inflation)
+        except RuntimeError as e:  # pool shut down
+            for _, future in group:
+                future.set_exception(e)
+            return
+
+        def resolve(job):
+            try:
+                results = job.result()
+            except Exception as e:
+                for _, future in group:
+                    future.set_exception(e)
+                return
+            for (_, future), result in zip(group, results):
+                future.set_result(result)
+
+        job.add_done_callback(resolve)
+
+    def close(self):
+        self._queue.put(None)
+        self._batcher.join()
+        self.pool.shutdown()
+
+
+# ------------------------------------------------------
+# HTTP
+# ------------------------------------------------------
+def _settings(body):
+    currency_mode = body.get("currency_mode", DEFAULT_CURRENCY_MODE)
+    if currency_mode not in (DEFAULT_CURRENCY_MODE, "USD (Thousands)"):
+        raise RequestError(f"Unknown currency_mode {currency_mode!r}")
+    try:
+        us_inflation = float(body.get("us_inflation", DEFAULT_US_INFLATION))
+    except (TypeError, ValueError):
+        raise RequestError("us_inflation must be a number") from None
+    return currency_mode, us_inflation
+
+
+def _validated(rows):
+    if not isinstance(rows, list) or not all(isinstance(r, dict) for r in rows):
+        raise RequestError("inputs must be a JSON object (batch: a list of objects)")
+    if len(rows) > MAX_REQUEST_BATCH:
+        raise RequestError(f"At most {MAX_REQUEST_BATCH} input sets per request")
+    inputs, errors = coerce_input_rows(rows)
+    details = [{"index": i, "errors": errs} for i, errs in enumerate(errors) if errs]
+    if details:
+        raise RequestError("Invalid inputs", details)
+    return inputs
+
+
+def _single_inputs(body):
+    return _validated([body.get("inputs", {})])[0]
+
+
+def _number_field(body, key, default=None):
+    value = body.get(key, default)
+    if value is None:
+        raise RequestError(f"{key} is required")
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise RequestError(f"{key} must be a number") from None
+
+
+class PharosAPIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "PharosAPI/1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status, payload):
+        data = json.dumps(payload, allow_nan=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _authorized(self):
+        token = self.server.token
+        if token and self.headers.get("Authorization") != f"Bearer {token}":
+            self._send(401, {"error": "Unauthorized"})
+            return False
+        return True
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        path = urlsplit(self.path).path
+        if path == "/v1/health":
+            service = self.server.service
+            self._send(200, {"status": "ok", "workers": service.workers, **service.stats})
+        elif path == "/v1/inputs":
+            self._send(200, {"keys": PROJECT_INPUT_KEYS, "base_case": BASE_CASE_INPUTS,
+                             "bounds": INPUT_BOUNDS})
+        else:
+            self._send(404, {"error": f"Unknown endpoint {path}"})
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        path = urlsplit(self.path).path
+        route = {
+            "/v1/kpis": self._kpis,
+            "/v1/cashflows": self._cashflows,
+            "/v1/buyback": self._buyback,
+            "/v1/sweep": self._sweep,
+        }.get(path)
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if route is None:
+                self._send(404, {"error": f"Unknown endpoint {path}"})
+                return
+            if not isinstance(body, dict):
+                raise RequestError("Request body must be a JSON object")
+            self.server.service.stats["requests"] += 1
+            self._send(200, route(body))
+        except RequestError as e:
+            self._send(400, {"error": str(e), "details": e.details})
+        except json.JSONDecodeError as e:
+            self._send(400, {"error": f"Invalid JSON: {e}"})
+        except Exception as e:
+            self._send(500, {"error": f"{type(e).__name__}: {e}"})
+
+    def _wait(self, futures):
+        return [f.result(timeout=REQUEST_TIMEOUT_S) for f in futures]
+
+    def _kpis(self, body):
+        currency_mode, us_inflation = _settings(body)
+        service = self.server.service
+        if "batch" in body:
+            inputs = _validated(body["batch"])
+            # Large client batches are already vectorized: one engine call
+            if len(inputs) > service.max_batch:
+                return {"results": service.call(value_batch, inputs, currency_mode, us_inflation)
+                        .result(timeout=REQUEST_TIMEOUT_S)}
+            return {"results": self._wait(service.kpis(inputs, currency_mode, us_inflation))}
+        inputs = _single_inputs(body)
+        return {"kpis": self._wait(service.kpis([inputs], currency_mode, us_inflation))[0]}
+
+    def _cashflows(self, body):
+        currency_mode, us_inflation = _settings(body)
+        inputs = _single_inputs(body)
+        return self.server.service.call(cash_flows, inputs, currency_mode, us_inflation).result(
+            timeout=REQUEST_TIMEOUT_S
+        )
+
+    def _buyback(self, body):
+        currency_mode, us_inflation = _settings(body)
+        inputs = _single_inputs(body)
+        ppa_term = inputs.get("ppa_term", BASE_CASE_INPUTS["ppa_term"])
+        years = body.get("years", [2, ppa_term])
+        if not (isinstance(years, list) and len(years) == 2 and all(isinstance(y, int) for y in years)):
+            raise RequestError("years must be [from, to] (whole years)")
+        if not 1 <= years[0] <= years[1] <= ppa_term:
+            raise RequestError(f"years must lie within 1..{ppa_term}")
+        min_value = _number_field(body, "min_value")
+        max_value = _number_field(body, "max_value")
+        step = _number_field(body, "step", 10)
+        if step <= 0 or max_value < min_value:
+            raise RequestError("Need step > 0 and max_value >= min_value")
+        n_points = (years[1] - years[0] + 1) * (int((max_value - min_value) / step) + 1)
+        if n_points > MAX_GRID_POINTS:
+            raise RequestError(f"Grid too large ({n_points} points, max {MAX_GRID_POINTS})")
+        hurdles = body.get("hurdles", [])
+        if not isinstance(hurdles, list):
+            raise RequestError("hurdles must be a list of IRR percentages")
+        hurdles = [_number_field({"hurdle": h}, "hurdle") for h in hurdles]
+        return self.server.service.call(
+            buyback, inputs, years, min_value, max_value, step, hurdles, currency_mode, us_inflation
+        ).result(timeout=REQUEST_TIMEOUT_S)
+
+    def _sweep(self, body):
+        currency_mode, us_inflation = _settings(body)
+        base = body.get("inputs", {})
+        key = body.get("key")
+        values = body.get("values")
+        if key not in PROJECT_INPUT_KEYS:
+            raise RequestError(f"Unknown input key {key!r}")
+        if not isinstance(values, list) or not values:
+            raise RequestError("values must be a non-empty list")
+        if not isinstance(base, dict):
+            raise RequestError("inputs must be a JSON object")
+        inputs = _validated([{**base, key: v} for v in values])
+        results = self.server.service.call(value_batch, inputs, currency_mode, us_inflation).result(
+            timeout=REQUEST_TIMEOUT_S
+        )
+        return {"key": key, "results": [{"value": v, **r} for v, r in zip(values, results)]}
+
+
+class PharosAPIServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Many short keep-alive connections from pricing tools
+    request_queue_size = 128
+
+    def __init__(self, address, service, token=API_TOKEN, verbose=False):
+        super().__init__(address, PharosAPIHandler)
+        self.service = service
+        self.token = token
+        self.verbose = verbose
+
+
+def serve(host=API_HOST, port=API_PORT, workers=None, verbose=True):
+    service = ValuationService(workers)
+    server = PharosAPIServer((host, port), service, verbose=verbose)
+    print(f"Pharos valuation API on http://{host}:{server.server_address[1]} ({service.workers} workers)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+# ------------------------------------------------------
+# CLIENT
+# ------------------------------------------------------
+class PharosAPIError(RuntimeError):
+    def __init__(self, status, payload):
+        super().__init__(f"HTTP {status}: {payload.get('error')}")
+        self.status = status
+        self.payload = payload
+
+
+class PharosClient:
+    """Keep-alive JSON client for the valuation API (one connection per client)."""
+
+    def __init__(self, base_url=f"http://{API_HOST}:{API_PORT}", token=API_TOKEN, timeout=REQUEST_TIMEOUT_S):
+        url = urlsplit(base_url)
+        self._conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=timeout)
+        self._headers = {"Content-Type": "application/json"}
+        if token:
+            self._headers["Authorization"] = f"Bearer {token}"
+
+    def request(self, method, path, payload=None):
+        body = None if payload is None else json.dumps(payload).encode("utf-8")
+        try:
+            self._conn.request(method, path, body=body, headers=self._headers)
+            response = self._conn.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            # Server closed the idle keep-alive connection: retry once on a new one
+            self._conn.close()
+            self._conn.request(method, path, body=body, headers=self._headers)
+            response = self._conn.getresponse()
+        data = json.loads(response.read() or b"{}")
+        if response.status != 200:
+            raise PharosAPIError(response.status, data)
+        return data
+
+    def health(self):
+        return self.request("GET", "/v1/health")
+
+    def kpis(self, inputs, **settings):
+        return self.request("POST", "/v1/kpis", {"inputs": inputs, **settings})["kpis"]
+
+    def kpis_batch(self, inputs_list, **settings):
+        return self.request("POST", "/v1/kpis", {"batch": list(inputs_list), **settings})["results"]
+
+    def cash_flows(self, inputs, **settings):
+        return self.request("POST", "/v1/cashflows", {"inputs": inputs, **settings})
+
+    def buyback(self, inputs, min_value, max_value, step=10, years=None, hurdles=(), **settings):
+        payload = {"inputs": inputs, "min_value": min_value, "max_value": max_value,
+                   "step": step, "hurdles": list(hurdles), **settings}
+        if years is not None:
+            payload["years"] = list(years)
+        return self.request("POST", "/v1/buyback", payload)
+
+    def sweep(self, inputs, key, values, **settings):
+        return self.request("POST", "/v1/sweep", {"inputs": inputs, "key": key, "values": list(values),
+                                                   **settings})["results"]
+
+    def close(self):
+        self._conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pharos BTM valuation API")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="engine worker processes (default: CPU count; 0 = in-process)")
+    parser.add_argument("--quiet", action="store_true", help="do not log requests")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers, verbose=not args.quiet)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,110 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import numpy_financial as npf
 import altair as alt
 import os
 import json
-import matplotlib.pyplot as plt
-import tempfile
 import io  # NEW: for in-memory Excel
 
-from fpdf import FPDF
 from datetime import datetime
 
+from pharos_actuals import (
+    VARIANCE_LINES,
+    ActualsStore,
+    apply_actuals,
+    check_actuals,
+    read_actuals_csv,
+    reforecast_kpis,
+    variance_table,
+)
+from pharos_analytics import (
+    DEAL_CONSTRAINTS,
+    DEAL_OBJECTIVES,
+    DEAL_VARIABLES,
+    DEFAULT_CAPEX_EXPONENT,
+    DEFAULT_MAX_COVERAGE_PCT,
+    DEFAULT_OPEX_EXPONENT,
+    FINANCIAL_METRIC_LABELS,
+    SIZING_OBJECTIVES,
+    STRESS_OPERATIONS,
+    STRESS_SHOCKS,
+    adaptive_exit_grid,
+    coverage_table,
+    deal_metrics,
+    deal_values,
+    deal_variables,
+    default_deal_bounds,
+    default_size_range,
+    exit_multiple_irr,
+    exit_value_irr,
+    exit_year_curves,
+    financial_metrics,
+    input_sensitivities,
+    optimize_deal,
+    optimize_size,
+    portfolio_kpis,
+    stress_test,
+)
+from pharos_cache import (
+    SESSION_MEMORY_BUDGET_MB,
+    SessionArtifacts,
+    SimulationCache,
+    inputs_hash,
+    simulation_key,
+)
+from pharos_engine import (
+    DEBT_SIZING_METHODS,
+    PROJECT_INPUT_KEYS,
+    BASE_CASE_INPUTS,
+    budget_params,
+    build_model_pipeline,
+    model_params_from_inputs,
+    pnl_annual,
+    run_model,
+)
+from pharos_index import KPIIndex
+from pharos_import import (
+    merge_sites,
+    read_site_chunks,
+    site_template,
+    validate_sites,
+    write_projects_file,
+)
+from pharos_profiles import (
+    ProfileStore,
+    apply_profile,
+    netting_table,
+    profile_totals,
+    read_profile_csv,
+)
+from pharos_profiler import (
+    PROFILER_DIR,
+    PROFILER_MODE,
+    PROFILER_MODES,
+    RERUN,
+    flame_rects,
+    list_captures,
+    profiled,
+    start_capture,
+    top_functions,
+)
+from pharos_reports import (
+    REPORT_FORMATS,
+    build_report_book,
+    create_pdf,
+    report_context,
+    report_jobs,
+)
+from pharos_scenarios import (
+    OVERLAY_SERIES,
+    build_scenario,
+    has_snapshot,
+    scenario_delta,
+    scenario_overlay,
+    scenario_summary,
+    scenario_table,
+)
+
 # Choose an Excel writer engine that actually exists in the environment
 try:
     import xlsxwriter  # noqa: F401
@@ -28,20 +121,10 @@ st.set_page_config(layout="wide", page_title="Pharos Capital: BTM Model", page_i
 PROJECTS_FILE = "pharos_projects.json"
 ATTACHMENTS_DIR = "pharos_attachments"
 
-# Keys we want to persist per project
-PROJECT_INPUT_KEYS = [
-    "project_name", "client_name", "project_loc",
-    "start_year", "start_q_str",
-    "ppa_term", "link_inf", "tariff_val", "inf_val", "disc_val", "esc_val",
-    "gen_val", "cons_val", "deg_val",
-    "const_q", "capex_val", "opex_val", "oinf_val", "sga_val", "sga_const_val",
-    "tax_val", "cg_val", "dep_val", "ftt_val", "ica_on", "ica_rate",
-    "debt_on", "dr_val", "int_val", "tenor_val", "fee_val", "grace_val",
-    "exit_method", "exit_yr", "exit_mult_val", "exit_asset_val", "ke_val",
-    "fx_rate_current",
-    "capex_benefit_on", "capex_benefit_years", "capex_benefit_capex_pct"
-]
-
+# Hourly generation / load profiles per project (memory-mapped float32 files)
+profile_store = ProfileStore()
+# Quarterly actuals per project (latest upload)
+actuals_store = ActualsStore()
 
 # ------------------------------------------------------
 # PASSWORD PROTECTION
@@ -79,44 +162,39 @@ if not check_password():
     st.stop()
 
 
+# ------------------------------------------------------
+# PROFILER (OPT-IN)
+# ------------------------------------------------------
+# Off unless PHAROS_PROFILER or the toggle under "Profiler" selects a mode;
+# when off no profiler is created. A rerun cut short by st.rerun / st.stop
+# never reaches its stop(), so its capture is dropped here.
+if "profiler_mode" not in st.session_state:
+    st.session_state["profiler_mode"] = PROFILER_MODE
+profiler_mode = st.session_state["profiler_mode"]
+stale_capture = st.session_state.pop("rerun_capture", None)
+if stale_capture is not None:
+    stale_capture.discard()
+rerun_capture = start_capture(RERUN, "", profiler_mode)
+if rerun_capture is not None:
+    st.session_state["rerun_capture"] = rerun_capture
+
+
+def current_inputs_hash():
+    """Hash of the sidebar inputs (names profiler captures)."""
+    return inputs_hash({key: st.session_state.get(key) for key in PROJECT_INPUT_KEYS})
+
+
 # ------------------------------------------------------
 # SESSION STATE & RESET LOGIC
 # ------------------------------------------------------
 def set_base_case():
-    st.session_state.ppa_term = 10
-    st.session_state.link_inf = True
-    st.session_state.tariff_val = 881.6
-    st.session_state.inf_val = 5.0
-    st.session_state.disc_val = 25.0
-    st.session_state.esc_val = 3.5
-    st.session_state.gen_val = 44.9
-    st.session_state.cons_val = 560.8
-    st.session_state.deg_val = 0.6
-    st.session_state.const_q = 3
-    st.session_state.capex_val = 120.0
-    st.session_state.opex_val = 7.0
-    st.session_state.oinf_val = 5.0
-    st.session_state.sga_val = 10.0
-    st.session_state.sga_const_val = 2.0
-    st.session_state.tax_val = 35.0
-    st.session_state.cg_val = 20.0
-    st.session_state.dep_val = 5
-    st.session_state.ftt_val = 0.4
-    st.session_state.ica_on = False
-    st.session_state.ica_rate = 2.0
-    st.session_state.debt_on = False
-    st.session_state.dr_val = 70.0
-    st.session_state.int_val = 12.1
-    st.session_state.tenor_val = 9
-    st.session_state.fee_val = 2.0
-    st.session_state.grace_val = 3
-    st.session_state.exit_method = "EBITDA Multiple"
-    st.session_state.exit_yr = 4
-    st.session_state.exit_mult_val = 5.0
-    st.session_state.exit_asset_val = 10.0
-    st.session_state.ke_val = 12.0
+    for key, value in BASE_CASE_INPUTS.items():
+        # Timeline and Ley 1715 widgets carry their own defaults
+        if key in ("start_year", "start_q_str", "capex_benefit_on",
+                   "capex_benefit_years", "capex_benefit_capex_pct"):
+            continue
+        st.session_state[key] = value
     st.session_state.uploaded_files = []
-    st.session_state.fx_rate_current = 4100.0
     # Default project identifiers
     if "project_name" not in st.session_state:
         st.session_state.project_name = "Hampton Inn Bogota - Aeropuerto"
@@ -155,8 +233,7 @@ def load_projects_from_disk():
 
 def save_projects_to_disk():
     try:
-        with open(PROJECTS_FILE, "w", encoding="utf-8") as f:
-            json.dump(st.session_state["projects"], f, ensure_ascii=False, indent=2)
+        write_projects_file(PROJECTS_FILE, st.session_state["projects"])
     except Exception as e:
         st.warning(f"Could not save projects to disk: {e}")
 
@@ -203,6 +280,12 @@ if "projects_loaded" not in st.session_state:
     apply_project_inputs(st.session_state["active_project"])
     st.session_state["projects_loaded"] = True
 
+# Inputs queued by tools further down the page (e.g. the deal optimizer) are
+# applied here, before the sidebar widgets exist
+if "pending_inputs" in st.session_state:
+    st.session_state.update(st.session_state.pop("pending_inputs"))
+    save_current_inputs_to_project()
+
 # ------------------------------------------------------
 # CUSTOM STYLING
 # ------------------------------------------------------
@@ -456,6 +539,8 @@ if len(st.session_state["projects"]) > 1:
             if project_to_delete in st.session_state["projects"]:
                 # Remove project
                 del st.session_state["projects"][project_to_delete]
+                profile_store.remove(project_to_delete)
+                actuals_store.remove(project_to_delete)
 
                 # If we deleted the active project, move active to another remaining one
                 if st.session_state["active_project"] == project_to_delete:
@@ -597,6 +682,38 @@ with st.sidebar.expander(T["s1_title"], expanded=False):
                                          step=0.1,
                                          format="%.1f") / 100
 
+    st.markdown("**Hourly profile (8760 h)**")
+    use_hourly_profile = st.checkbox("Net generation against hourly load", key="profile_on")
+    if use_hourly_profile:
+        profile_project = st.session_state["active_project"]
+        profile_file = st.file_uploader(
+            "Profile CSV (generation_kwh, load_kwh per hour)", type=["csv"], key="profile_file"
+        )
+        if profile_file is not None and st.session_state.get("profile_file_id") != profile_file.file_id:
+            try:
+                profile_store.save(profile_project, read_profile_csv(profile_file))
+                st.session_state["profile_file_id"] = profile_file.file_id
+            except ValueError as e:
+                st.error(f"Profile not loaded: {e}")
+        site_profile = profile_store.load(profile_project)
+        if site_profile is None:
+            st.caption("No profile stored for this project: flat generation is used.")
+        else:
+            recorded = profile_totals(site_profile)
+
+            def use_profile_totals(totals=recorded):
+                st.session_state["gen_val"] = round(totals["generation_mwh"], 1)
+                st.session_state["cons_val"] = round(totals["load_mwh"], 1)
+
+            st.caption(
+                f"Stored profile: {recorded['generation_mwh']:,.1f} MWh generation, "
+                f"{recorded['load_mwh']:,.1f} MWh load per year. The hourly shape is scaled "
+                "to the generation and consumption above."
+            )
+            st.button("Use profile totals", on_click=use_profile_totals, key="profile_totals_btn")
+        st.number_input("Export credit (% of PPA price)", key="export_val",
+                        min_value=0.0, max_value=100.0, step=5.0, format="%.1f")
+
 
 # ------------------------------------------------------
 # 2. COSTS
@@ -708,6 +825,17 @@ with st.sidebar.expander(T["s4_title"], expanded=False):
         grace_period_quarters = st.number_input(T["s4_grace"],
                                                 key="grace_val",
                                                 step=1)
+        debt_sizing = st.radio("Debt sizing", DEBT_SIZING_METHODS,
+                               horizontal=True, key="debt_sizing")
+        if debt_sizing == "Target DSCR":
+            st.number_input("Target DSCR (x)", key="dscr_target_val",
+                            min_value=1.0, step=0.05, format="%.2f")
+            st.checkbox("Sculpted repayment", key="sculpt_on")
+            st.caption(
+                "Debt is the largest amount whose debt service keeps CFADS / "
+                "(interest + principal) at or above the target in every repayment "
+                "quarter, capped at the debt ratio above."
+            )
     else:
         debt_ratio = 0.0
         interest_rate_annual = 0.0
@@ -751,474 +879,255 @@ save_current_inputs_to_project()
 # ------------------------------------------------------
 # 6. DOCUMENT AUDIT TRAIL (per project)
 # ------------------------------------------------------
-with st.sidebar.expander(T["s6_title"], expanded=False):
-    uploaded_files = st.file_uploader(
-        "Upload Source Documents (PDFs, Images, CSVs)",
-        type=['pdf', 'png', 'jpg', 'jpeg', 'csv'],
-        accept_multiple_files=True
-    )
+# A fragment: uploading or deleting files reruns only this expander
+@st.fragment
+def document_audit_trail():
+    with st.expander(T["s6_title"], expanded=False):
+        uploaded_files = st.file_uploader(
+            "Upload Source Documents (PDFs, Images, CSVs)",
+            type=['pdf', 'png', 'jpg', 'jpeg', 'csv'],
+            accept_multiple_files=True
+        )
 
-    # Ensure current project record has a 'files' list
-    active_proj = st.session_state["active_project"]
-    proj_entry = st.session_state["projects"].setdefault(
-        active_proj,
-        {"inputs": {}, "scenarios": {}, "files": []}
-    )
-    files_list = proj_entry.setdefault("files", [])
-
-    # Handle new uploads
-    if uploaded_files:
-        os.makedirs(ATTACHMENTS_DIR, exist_ok=True)
-        proj_folder = os.path.join(
-            ATTACHMENTS_DIR,
-            active_proj.replace(" ", "_")
+        # Ensure current project record has a 'files' list
+        active_proj = st.session_state["active_project"]
+        proj_entry = st.session_state["projects"].setdefault(
+            active_proj,
+            {"inputs": {}, "scenarios": {}, "files": []}
         )
-        os.makedirs(proj_folder, exist_ok=True)
-
-        for file in uploaded_files:
-            raw_data = file.read()
-
-            # Build a safe, non-colliding path
-            base_name, ext = os.path.splitext(file.name)
-            save_path = os.path.join(proj_folder, file.name)
-            counter = 1
-            while os.path.exists(save_path):
-                save_path = os.path.join(
-                    proj_folder,
-                    f"{base_name}_{counter}{ext}"
-                )
-                counter += 1
-
-            # Write to disk
-            with open(save_path, "wb") as f:
-                f.write(raw_data)
-
-            # Add metadata if not already there
-            if not any(fm.get("path") == save_path for fm in files_list):
-                files_list.append({
-                    "name": file.name,
-                    "type": file.type,
-                    "path": save_path
-                })
-
-        save_projects_to_disk()
-        st.success(f"Uploaded {len(uploaded_files)} file(s) to project '{active_proj}'.")
-
-    # List existing files for this project
-    if files_list:
-        st.markdown("##### Files stored for this project")
-
-        # We iterate with index so we can safely delete entries
-        for idx, fm in enumerate(list(files_list)):  # list() to avoid mutation issues
-            fname = fm.get("name", "Unnamed")
-            ftype = fm.get("type", "unknown")
-            fpath = fm.get("path")
-
-            c1, c2, c3 = st.columns([4, 1, 1])
-
-            with c1:
-                st.write(f"📄 **{fname}**  _({ftype})_")
-
-            # Download button — key uses idx so duplicates are allowed
-            with c2:
-                if fpath and os.path.exists(fpath):
-                    with open(fpath, "rb") as f:
-                        st.download_button(
-                            label="⬇️",
-                            data=f.read(),
-                            file_name=fname,
-                            mime=ftype or "application/octet-stream",
-                            key=f"download_{active_proj}_{idx}"
-                        )
-                else:
-                    st.caption("Missing")
+        files_list = proj_entry.setdefault("files", [])
+
+        # Handle new uploads
+        if uploaded_files:
+            os.makedirs(ATTACHMENTS_DIR, exist_ok=True)
+            proj_folder = os.path.join(
+                ATTACHMENTS_DIR,
+                active_proj.replace(" ", "_")
+            )
+            os.makedirs(proj_folder, exist_ok=True)
+
+            for file in uploaded_files:
+                raw_data = file.read()
+
+                # Build a safe, non-colliding path
+                base_name, ext = os.path.splitext(file.name)
+                save_path = os.path.join(proj_folder, file.name)
+                counter = 1
+                while os.path.exists(save_path):
+                    save_path = os.path.join(
+                        proj_folder,
+                        f"{base_name}_{counter}{ext}"
+                    )
+                    counter += 1
 
-            # Delete button
-            with c3:
-                if st.button("🗑️", key=f"delete_{active_proj}_{idx}"):
-                    # Remove file from disk if still present
-                    if fpath and os.path.exists(fpath):
-                        try:
-                            os.remove(fpath)
-                        except Exception as e:
-                            st.warning(f"Could not delete file from disk: {e}")
+                # Write to disk
+                with open(save_path, "wb") as f:
+                    f.write(raw_data)
 
-                    # Remove from metadata list
-                    try:
-                        del files_list[idx]
-                        save_projects_to_disk()
-                    except Exception as e:
-                        st.warning(f"Error updating file list: {e}")
+                # Add metadata if not already there
+                if not any(fm.get("path") == save_path for fm in files_list):
+                    files_list.append({
+                        "name": file.name,
+                        "type": file.type,
+                        "path": save_path
+                    })
 
-                    st.success(f"File '{fname}' deleted from project '{active_proj}'.")
-                    st.rerun()
-    else:
-        st.caption("No files uploaded yet for this project.")
+            save_projects_to_disk()
+            st.success(f"Uploaded {len(uploaded_files)} file(s) to project '{active_proj}'.")
 
+        # List existing files for this project
+        if files_list:
+            st.markdown("##### Files stored for this project")
 
-# ------------------------------------------------------
-# ENGINE
-# ------------------------------------------------------
-full_quarters = construction_quarters + (ppa_term_years * 4)
-quarters_range = list(range(1, full_quarters + 1))
-
-if enable_debt:
-    structuring_fee = (capex_million_cop * debt_ratio) * structuring_fee_pct
-    total_debt_principal = capex_million_cop * debt_ratio
-    interest_rate_quarterly = interest_rate_annual / 4
-    loan_tenor_quarters = loan_tenor_years * 4
-    quarterly_debt_pmt = -npf.pmt(
-        interest_rate_quarterly,
-        loan_tenor_quarters - grace_period_quarters,
-        total_debt_principal
-    ) if (loan_tenor_quarters - grace_period_quarters) > 0 else 0
-else:
-    structuring_fee = 0
-    total_debt_principal = 0
-    interest_rate_quarterly = 0.0
-    quarterly_debt_pmt = 0
-
-sga_const_cost_cop = capex_million_cop * sga_const_pct
-total_capex_cost = capex_million_cop + structuring_fee + sga_const_cost_cop
-equity_investment_levered_cop = total_capex_cost - total_debt_principal
-equity_investment_unlevered_cop = total_capex_cost
-
-# CAPEX tax benefit pool (Ley 1715)
-if enable_capex_benefit and capex_benefit_years > 0:
-    eligible_capex = capex_million_cop * capex_benefit_capex_pct
-    capex_benefit_total = 0.5 * eligible_capex
-    capex_benefit_remaining = capex_benefit_total
-else:
-    eligible_capex = 0.0
-    capex_benefit_total = 0.0
-    capex_benefit_remaining = 0.0
-
-q_list, gy_list, cal_list = [], [], []
-gen_list, rev_list, ebitda_list = [], [], []
-opex_list, sga_list, gross_list = [], [], []
-dep_list, int_list, tax_list, ftt_list, ica_list = [], [], [], [], []
-ufcf_list, lfcf_list, debt_bal_list, book_val_list, fx_rate_list = [], [], [], [], []
-
-# NEW: detailed debt schedule tracking
-opening_debt_list = []
-principal_list = []
-
-# Tax base tracking
-base_unlev_list, base_lev_list = [], []
-base_lev_pre_list = []
-cum_base_unlev_list, cum_base_lev_list = [], []
-cum_tax_unlev_list, cum_tax_lev_list = [], []
-capex_benefit_q_list = []
-
-debt_balance = total_debt_principal
-accumulated_dep = 0
-
-cum_base_unlev = 0.0
-cum_base_lev = 0.0
-cum_tax_unlev = 0.0
-cum_tax_lev = 0.0
-cum_base_lev_pre = 0.0
-
-op_start_calendar_year = None
-
-for i, q in enumerate(quarters_range):
-    abs_q = (start_q_num - 1) + i
-    cal_year = start_year + (abs_q // 4)
-    t_years = i / 4
-    fx_rate_q = fx_rate_current * ((1 + utility_inflation_annual) / (1 + us_inflation_annual)) ** t_years
-
-    if q <= construction_quarters:
-        phase = "Construction"
-        q_op_index = 0
-        op_year = 0
-    else:
-        phase = "Operation"
-        q_op_index = q - construction_quarters
-        op_year = (q_op_index - 1) // 4 + 1
-        if op_start_calendar_year is None:
-            op_start_calendar_year = cal_year
-
-    global_year = (q - 1) // 4 + 1
-
-    if phase == "Operation":
-        esc_factor = (1 + pcp_escalator_annual) ** ((q_op_index - 1) / 4)
-        deg_factor = (1 - degradation_annual) ** ((q_op_index - 1) / 4)
-        opex_fac = (1 + opex_inflation_annual) ** ((q_op_index - 1) / 4)
-
-        p_price = current_tariff * (1 - discount_rate) * esc_factor
-        gen_quarterly = (initial_gen_mwh_annual / 4) * deg_factor
-        rev = (gen_quarterly * p_price) / 1000
-        opex = (opex_million_cop_annual / 4) * opex_fac
-        gross = rev - opex
-        sga = gross * sga_percent
-        ica_cost = rev * ica_rate if enable_ica else 0.0
-        ebitda = gross - sga - ica_cost
-        dep = (capex_million_cop / depreciation_years) / 4 if op_year <= depreciation_years else 0
-    else:
-        gen_quarterly = rev = opex = gross = sga = ica_cost = ebitda = dep = 0
-
-    if phase == "Construction" and construction_quarters > 0:
-        capex_unlevered = capex_million_cop / construction_quarters
-        capex_levered = equity_investment_levered_cop / construction_quarters
-        sga_const_outflow = sga_const_cost_cop / construction_quarters
-        capex_levered += sga_const_outflow
-    else:
-        capex_unlevered = capex_levered = sga_const_outflow = 0
-
-    # NEW: store opening balance for this quarter
-    opening_debt = debt_balance
+            # We iterate with index so we can safely delete entries
+            for idx, fm in enumerate(list(files_list)):  # list() to avoid mutation issues
+                fname = fm.get("name", "Unnamed")
+                ftype = fm.get("type", "unknown")
+                fpath = fm.get("path")
 
-    if debt_balance > 0:
-        interest = debt_balance * interest_rate_quarterly
-        if q > grace_period_quarters:
-            principal = quarterly_debt_pmt - interest
-            if principal > debt_balance:
-                principal = debt_balance
-        else:
-            principal = 0
-        debt_balance -= principal
-    else:
-        interest = principal = 0
-
-    # Tax base before benefit
-    base_lev_pre = ebitda - interest - dep
+                c1, c2, c3 = st.columns([4, 1, 1])
 
-    prev_cum_base_lev_pre = cum_base_lev_pre
-    cum_base_lev_pre += base_lev_pre
+                with c1:
+                    st.write(f"📄 **{fname}**  _({ftype})_")
 
-    eff_base_q = max(cum_base_lev_pre, 0) - max(prev_cum_base_lev_pre, 0)
+                # Download button — key uses idx so duplicates are allowed
+                with c2:
+                    if fpath and os.path.exists(fpath):
+                        with open(fpath, "rb") as f:
+                            st.download_button(
+                                label="⬇️",
+                                data=f.read(),
+                                file_name=fname,
+                                mime=ftype or "application/octet-stream",
+                                key=f"download_{active_proj}_{idx}"
+                            )
+                    else:
+                        st.caption("Missing")
+
+                # Delete button
+                with c3:
+                    if st.button("🗑️", key=f"delete_{active_proj}_{idx}"):
+                        # Remove file from disk if still present
+                        if fpath and os.path.exists(fpath):
+                            try:
+                                os.remove(fpath)
+                            except Exception as e:
+                                st.warning(f"Could not delete file from disk: {e}")
+
+                        # Remove from metadata list
+                        try:
+                            del files_list[idx]
+                            save_projects_to_disk()
+                        except Exception as e:
+                            st.warning(f"Error updating file list: {e}")
 
-    capex_tax_benefit_q = 0.0
+                        st.success(f"File '{fname}' deleted from project '{active_proj}'.")
+                        st.rerun(scope="fragment")
+        else:
+            st.caption("No files uploaded yet for this project.")
 
-    if (
-        enable_capex_benefit
-        and phase == "Operation"
-        and op_start_calendar_year is not None
-        and cal_year >= op_start_calendar_year + 1
-        and cal_year < op_start_calendar_year + 1 + capex_benefit_years
-        and capex_benefit_remaining > 0
-        and eff_base_q > 0
-    ):
-        max_allowed_this_q = 0.5 * eff_base_q
-        capex_tax_benefit_q = min(capex_benefit_remaining, max_allowed_this_q)
-        capex_benefit_remaining -= capex_tax_benefit_q
 
-    base_unlev = ebitda - dep - capex_tax_benefit_q
-    base_lev = base_lev_pre - capex_tax_benefit_q
+with st.sidebar:
+    document_audit_trail()
 
-    cum_base_unlev += base_unlev
-    cum_base_lev += base_lev
 
-    theor_tax_unlev = tax_rate * max(cum_base_unlev, 0)
-    theor_tax_lev = tax_rate * max(cum_base_lev, 0)
+# ------------------------------------------------------
+# ENGINE (STAGE PIPELINE)
+# ------------------------------------------------------
+# Stages (engine -> exit / display -> aggregation -> KPIs -> views) are
+# memoized per session and only re-execute when one of their declared
+# inputs changed, e.g. moving the exit-year slider skips the engine.
+if "model_pipeline" not in st.session_state:
+    st.session_state["model_pipeline"] = build_model_pipeline()
+model_pipeline = st.session_state["model_pipeline"]
+model_pipeline.reset_log()
+
+model_params = model_params_from_inputs(
+    {key: st.session_state.get(key) for key in PROJECT_INPUT_KEYS},
+    currency_mode=currency_mode,
+    us_inflation_annual=us_inflation_annual,
+)
+# Hourly netting replaces the flat generation when the project has a profile
+model_params = apply_profile(model_params, st.session_state["active_project"], profile_store)
+# Uploaded actuals overwrite the historical quarters; the engine re-forecasts the rest
+model_params = apply_actuals(model_params, st.session_state["active_project"], actuals_store)
 
-    tax_unlevered = max(0, theor_tax_unlev - cum_tax_unlev)
-    tax_levered = max(0, theor_tax_lev - cum_tax_lev)
+# Large per-session artifacts (simulation results, ...) under a memory budget
+if "artifacts" not in st.session_state:
+    st.session_state["artifacts"] = SessionArtifacts(SESSION_MEMORY_BUDGET_MB * 1024 ** 2)
+artifacts = st.session_state["artifacts"]
 
-    cum_tax_unlev += tax_unlevered
-    cum_tax_lev += tax_levered
+# Simulation grids persisted on disk, keyed by inputs + grid, shared across sessions
+sim_cache = SimulationCache()
 
-    if enable_debt:
-        total_disbursements = capex_levered + opex + sga + principal + interest + tax_levered
-    else:
-        total_disbursements = capex_unlevered + opex + sga + tax_unlevered
+# Headline KPIs of every project and saved scenario, persisted across sessions
+kpi_index = KPIIndex()
 
-    ftt_cost = total_disbursements * ftt_rate
 
-    accumulated_dep += dep
-    book_val = max(0, capex_million_cop - accumulated_dep)
+def sim_close_matches(sim_df, target_irr):
+    """Simulation points with IRR within ±10% of `target_irr`, closest first (None if none)."""
+    close_df = sim_df[
+        (sim_df["IRR"] >= target_irr * 0.9) &
+        (sim_df["IRR"] <= target_irr * 1.1)
+    ].copy()
+    if close_df.empty:
+        return None
 
-    ufcf = ebitda - tax_unlevered - capex_unlevered - ftt_cost
-    if enable_debt:
-        lfcf = ebitda - tax_levered - interest - principal - capex_levered - ftt_cost
-    else:
-        lfcf = ufcf
-
-    q_list.append(q)
-    gy_list.append(global_year)
-    cal_list.append(cal_year)
-    gen_list.append(gen_quarterly)
-    rev_list.append(rev)
-    opex_list.append(opex)
-    gross_list.append(gross)
-    sga_list.append(sga)
-    ica_list.append(ica_cost)
-    ebitda_list.append(ebitda)
-    dep_list.append(dep)
-    int_list.append(interest)
-    tax_list.append(tax_levered)
-    ftt_list.append(ftt_cost)
-
-    ufcf_list.append(ufcf)
-    lfcf_list.append(lfcf)
-
-    # NEW: debt schedule tracking
-    opening_debt_list.append(opening_debt)
-    principal_list.append(principal)
-    debt_bal_list.append(debt_balance)
-    book_val_list.append(book_val)
-    fx_rate_list.append(fx_rate_q)
-
-    base_unlev_list.append(base_unlev)
-    base_lev_list.append(base_lev)
-    base_lev_pre_list.append(base_lev_pre)
-    cum_base_unlev_list.append(cum_base_unlev)
-    cum_base_lev_list.append(cum_base_lev)
-    cum_tax_unlev_list.append(cum_tax_unlev)
-    cum_tax_lev_list.append(cum_tax_lev)
-    capex_benefit_q_list.append(capex_tax_benefit_q)
-
-df_full = pd.DataFrame({
-    "Quarter": q_list, "Global_Year": gy_list, "Calendar_Year": cal_list,
-    "FX_Rate": fx_rate_list, "Generation_MWh": gen_list,
-    "Revenue_M_COP": rev_list, "OPEX_M_COP": opex_list, "Gross_M_COP": gross_list,
-    "SGA_M_COP": sga_list, "ICA_M_COP": ica_list, "EBITDA_M_COP": ebitda_list,
-    "Depreciation_M_COP": dep_list, "Interest_M_COP": int_list, "Tax_M_COP": tax_list,
-    "FTT_M_COP": ftt_list, "UFCF_M_COP": ufcf_list, "LFCF_M_COP": lfcf_list,
-    "Opening_Debt_M_COP": opening_debt_list,
-    "Principal_M_COP": principal_list,
-    "Debt_Balance_M_COP": debt_bal_list,
-    "Book_Value_M_COP": book_val_list,
-    "Tax_Base_Unlev_M_COP": base_unlev_list,
-    "Tax_Base_Lev_PreBenefit_M_COP": base_lev_pre_list,
-    "Tax_Base_Lev_M_COP": base_lev_list,
-    "Tax_Base_Unlev_Cum_M_COP": cum_base_unlev_list,
-    "Tax_Base_Lev_Cum_M_COP": cum_base_lev_list,
-    "Tax_Unlev_Cum_M_COP": cum_tax_unlev_list,
-    "Tax_Lev_Cum_M_COP": cum_tax_lev_list,
-    "Capex_Tax_Benefit_M_COP": capex_benefit_q_list
-})
-
-conversion_factor = 1000 / df_full["FX_Rate"] if "USD" in currency_mode else 1
-for col in ["Revenue", "OPEX", "Gross", "SGA", "ICA", "EBITDA",
-            "Depreciation", "Interest", "Tax", "FTT", "UFCF", "LFCF"]:
-    df_full[f"{col}_Disp"] = df_full[f"{col}_M_COP"] * conversion_factor
-
-
-# Exit logic
-if dash_exit_strategy == "Fixed Asset Value":
-    final_exit_val_cop = dash_exit_val_cop
-else:
-    exit_q_idx = construction_quarters + (dash_exit_year * 4) - 1
-    start_idx = max(0, exit_q_idx - 3)
-    annual_ebitda = df_full.iloc[start_idx:exit_q_idx + 1]["EBITDA_M_COP"].sum()
-    final_exit_val_cop = annual_ebitda * dash_exit_mult
-
-dash_exit_q = construction_quarters + (dash_exit_year * 4)
-df_dash = df_full.iloc[:dash_exit_q].copy()
-
-last_idx = len(df_dash) - 1
-book_v_final = df_dash.iloc[last_idx]["Book_Value_M_COP"]
-debt_b_final = df_dash.iloc[last_idx]["Debt_Balance_M_COP"]
-gain = final_exit_val_cop - book_v_final
-cg_tax = gain * cap_gains_rate if gain > 0 else 0
-
-final_fx = df_dash.iloc[last_idx]["FX_Rate"]
-conv_factor_final = 1000 / final_fx if "USD" in currency_mode else 1
-
-exit_inflow_unlevered_disp = (final_exit_val_cop - cg_tax) * conv_factor_final
-exit_inflow_levered_disp = (final_exit_val_cop - debt_b_final - cg_tax) * conv_factor_final
-
-df_dash.at[last_idx, "UFCF_Disp"] += exit_inflow_unlevered_disp
-df_dash.at[last_idx, "LFCF_Disp"] += exit_inflow_levered_disp
-
-agg_cols = ["Generation_MWh", "Revenue_Disp", "OPEX_Disp", "Gross_Disp",
-            "SGA_Disp", "ICA_Disp", "EBITDA_Disp", "Depreciation_Disp",
-            "Interest_Disp", "Tax_Disp", "FTT_Disp",
-            "UFCF_Disp", "LFCF_Disp"]
-df_annual_dash = df_dash.groupby("Calendar_Year")[agg_cols].sum().reset_index()
-df_annual_full = df_full.groupby("Calendar_Year")[agg_cols].sum().reset_index()
-
-df_annual_dash["Implied_Price_Unit"] = 0.0
-mask = df_annual_dash["Generation_MWh"] > 0
-if "USD" in currency_mode:
-    df_annual_dash.loc[mask, "Implied_Price_Unit"] = (
-        df_annual_dash.loc[mask, "Revenue_Disp"] / df_annual_dash.loc[mask, "Generation_MWh"]
+    close_df["ΔIRR_vs_Base"] = (close_df["IRR"] - target_irr).round(1)
+    close_df = close_df.sort_values(
+        by="ΔIRR_vs_Base",
+        key=lambda s: s.abs()
     )
-else:
-    df_annual_dash.loc[mask, "Implied_Price_Unit"] = (
-        df_annual_dash.loc[mask, "Revenue_Disp"] / df_annual_dash.loc[mask, "Generation_MWh"]
-    ) * 1000
-
-
-def get_irr(stream):
-    try:
-        q_irr = npf.irr(stream)
-        return ((1 + q_irr) ** 4 - 1) * 100
-    except Exception:
-        return 0
-
-
-inv_conv = 1000 / fx_rate_current if "USD" in currency_mode else 1
-equity_inv_disp = equity_investment_levered_cop * inv_conv
-irr_unlevered = get_irr(df_dash["UFCF_Disp"])
-irr_levered = get_irr(df_dash["LFCF_Disp"])
-moic_levered = df_dash["LFCF_Disp"].sum() / equity_inv_disp if equity_inv_disp > 0 else 0
-npv_equity = npf.npv(investor_disc_rate / 4, [0] + df_dash["LFCF_Disp"].tolist())
-symbol = "$" if "USD" in currency_mode else ""
+    # Rename to human-readable labels for display
+    close_df = close_df.rename(columns={
+        "ExitYear": "Exit Year",
+        "ExitValue": "Exit Value (M COP)"
+    })
+    return close_df[[
+        "Exit Year", "Exit Value (M COP)", "IRR", "ΔIRR_vs_Base"
+    ]].head(15)
 
 
 # ------------------------------------------------------
-# SCENARIO MANAGEMENT (PER PROJECT)
+# TABLE VIEWS
 # ------------------------------------------------------
-st.markdown("### Scenario Management")
-
-active_proj = st.session_state["active_project"]
-proj_entry = st.session_state["projects"].setdefault(
-    active_proj,
-    {"inputs": {}, "scenarios": {}, "files": []}
-)
-scenarios_dict = proj_entry.setdefault("scenarios", {})
+# Rows per page offered by paged tables
+TABLE_PAGE_SIZES = [40, 100, 250, 1000]
+# Period columns shown as plain integers
+PERIOD_COLUMN_FORMATS = {"Quarter": "%d", "Global_Year": "%d", "Calendar_Year": "%d", "Year": "%d"}
+
+
+def number_columns(df, default="%.1f", formats=None):
+    """column_config formatting every numeric column in the browser (no Styler HTML per cell)."""
+    formats = {**PERIOD_COLUMN_FORMATS, **(formats or {})}
+    return {
+        col: st.column_config.NumberColumn(format=formats.get(col, default))
+        for col in df.columns
+        if pd.api.types.is_numeric_dtype(df[col]) and not pd.api.types.is_bool_dtype(df[col])
+    }
 
-# --- Save scenario ---
-scenario_name = st.text_input(
-    "Scenario name (e.g. 'Base COP with debt 70%')",
-    value="",
-    key="scenario_name"
-)
 
-if st.button("💾 Save current scenario"):
-    if not scenario_name.strip():
-        st.warning("Please enter a scenario name before saving.")
-    else:
-        # 1st-year PPA price to client (COP $/kWh)
-        ppa_price_year1_cop = current_tariff * (1 - discount_rate)
-
-        scenarios_dict[scenario_name] = {
-            "Equity_Investment": equity_inv_disp,
-            "IRR_Levered_%": irr_levered,
-            "MOIC_x": moic_levered,
-            "Exit_Method": dash_exit_strategy,
-            "Exit_Year": dash_exit_year,
-            "Exit_Value_M_COP": final_exit_val_cop,
-            "Client_Tariff_$perkWh": current_tariff,
-            "PPA_Year1_$perkWh": ppa_price_year1_cop,
-            "PPA_Years": ppa_term_years,
-        }
-        save_projects_to_disk()
-        st.success(f"Scenario '{scenario_name}' saved for project '{active_proj}'.")
-
-# --- Delete scenario (per project) ---
-if scenarios_dict:
-    st.markdown("#### Delete saved scenario (current project)")
-    col_del1, col_del2 = st.columns([3, 1])
-
-    with col_del1:
-        scenario_to_delete = st.selectbox(
-            "Select scenario to delete",
-            list(scenarios_dict.keys()),
-            key="scenario_to_delete"
+@st.fragment
+def paged_table(df, key, default_columns=None, formats=None, default="%.1f"):
+    """
+    Column picker and pager over `df`: only the selected page and columns
+    are sent to the browser. A fragment, so paging reruns only the table.
+    """
+    c_cols, c_size, c_page = st.columns([4, 1, 1])
+    with c_cols:
+        columns = st.multiselect(
+            "Columns", list(df.columns), default=default_columns or list(df.columns),
+            key=f"{key}_columns"
         )
-
-    with col_del2:
-        if st.button("🗑️ Delete selected scenario"):
-            if scenario_to_delete in scenarios_dict:
-                del scenarios_dict[scenario_to_delete]
-                save_projects_to_disk()
-                st.success(f"Scenario '{scenario_to_delete}' deleted from project '{active_proj}'.")
-                st.rerun()
-else:
-    st.caption("No saved scenarios for this project.")
+    with c_size:
+        page_size = st.selectbox("Rows per page", TABLE_PAGE_SIZES, key=f"{key}_page_size")
+    n_pages = max(1, -(-len(df) // page_size))
+    # A smaller table or larger pages can leave the stored page out of range
+    if st.session_state.get(f"{key}_page", 1) > n_pages:
+        st.session_state[f"{key}_page"] = n_pages
+    with c_page:
+        page = st.number_input("Page", min_value=1, max_value=n_pages, value=1, step=1, key=f"{key}_page")
+    start = (page - 1) * page_size
+    window = df.iloc[start:start + page_size][columns or list(df.columns)]
+    st.dataframe(
+        window,
+        column_config=number_columns(window, default, formats),
+        use_container_width=True,
+        hide_index=True
+    )
+    st.caption(f"Rows {min(start + 1, len(df))}–{start + len(window)} of {len(df)} · page {page} of {n_pages}")
+
+
+engine_result = model_pipeline.get("engine", model_params)
+exit_out = model_pipeline.get("exit", model_params)
+agg_out = model_pipeline.get("aggregation", model_params)
+kpi_out = model_pipeline.get("kpis", model_params)
+
+# Compact M COP engine result; *_Disp columns are converted on access by the
+# view and quarterly frames are only built for tables and exports
+model_display = model_pipeline.get("display", model_params)
+currency_view = agg_out["view"]
+df_annual_dash = agg_out["df_annual_dash"]
+df_annual_full = agg_out["df_annual_full"]
+
+total_debt_principal = engine_result.total_debt_principal
+# Target-DSCR sizing replaces the debt ratio with the sized one
+debt_ratio = engine_result.params["debt_ratio"]
+equity_investment_levered_cop = engine_result.equity_investment_levered_cop
+final_exit_val_cop = exit_out["final_exit_val_cop"]
+
+inv_conv = kpi_out["inv_conv"]
+equity_inv_disp = kpi_out["equity_inv_disp"]
+irr_unlevered = kpi_out["irr_unlevered"]
+irr_levered = kpi_out["irr_levered"]
+moic_levered = kpi_out["moic_levered"]
+npv_equity = kpi_out["npv_equity"]
+# DSCR / LLCR / payback / cash yield straight from the engine arrays
+fin_metrics = {
+    key: float(values[0])
+    for key, values in financial_metrics(engine_result, exit_out, investor_disc_rate).items()
+}
+symbol = "$" if "USD" in currency_mode else ""
 
 
 # ------------------------------------------------------
@@ -1235,7 +1144,7 @@ def excel_col(col_idx: int) -> str:
         col = chr(65 + rem) + col
     return col
 
-def generate_excel_file():
+def generate_excel_file(inputs, projects, active_proj, sim_df=None, sim_multiple_df=None):
     """
     Build a multi-sheet Excel workbook with:
     - Inputs
@@ -1243,14 +1152,17 @@ def generate_excel_file():
     - Annual summary
     - P&L (annual)
     - Tax diagnostics (levered)
-    - Debt schedule
+    - Debt schedule (with CFADS, DSCR and LLCR)
     - Scenarios (per project)
     - Portfolio consolidation (across projects)
     - Simulation matrix (if run)
+    - EBITDA-multiple simulation matrix (if run)
     - Documentation sheet
-    - Summary sheet with Excel IRR/NPV formulas + Scenario switcher (if xlsxwriter)
+    - Summary sheet with Excel IRR/NPV formulas, coverage/payback KPIs + Scenario switcher (if xlsxwriter)
 
     Numbers are rounded and, when using xlsxwriter, formatted with basic accounting/percent styles.
+    Session values are passed in as snapshots so the workbook can be built
+    on demand (when the download button is clicked) outside the script run.
     """
     def rounded(df, ndigits=1):
         df2 = df.copy()
@@ -1262,19 +1174,21 @@ def generate_excel_file():
     engine = DEFAULT_EXCEL_ENGINE
 
     with pd.ExcelWriter(output, engine=engine) as writer:
-        # 1) Inputs sheet from session_state
+        # 1) Inputs sheet from the session inputs snapshot
         inputs_rows = []
         for key in PROJECT_INPUT_KEYS:
             inputs_rows.append({
                 "Input": key,
-                "Value": st.session_state.get(key, None)
+                "Value": inputs.get(key, None)
             })
         df_inputs = pd.DataFrame(inputs_rows)
         df_inputs = rounded(df_inputs, 2)
         df_inputs.to_excel(writer, sheet_name="Inputs", index=False)
 
         # 2) Full quarterly model
-        df_full_xls = rounded(df_full, 1)
+        df_quarterly = currency_view.frame()
+        df_full = model_display.frame()
+        df_full_xls = rounded(df_quarterly, 1)
         df_full_xls.to_excel(writer, sheet_name="Quarterly_Model", index=False)
 
         # 3) Annual summary
@@ -1282,11 +1196,7 @@ def generate_excel_file():
         df_annual_full_xls.to_excel(writer, sheet_name="Annual_Summary", index=False)
 
         # 4) P&L (annual)
-        pnl_data = df_annual_full.copy()
-        pnl_data["EBIT_Disp"] = pnl_data["EBITDA_Disp"] - pnl_data["Depreciation_Disp"]
-        pnl_data["EBT_Disp"] = pnl_data["EBIT_Disp"] - pnl_data["Interest_Disp"]
-        pnl_data["Net_Income_Disp"] = pnl_data["EBT_Disp"] - pnl_data["Tax_Disp"]
-        pnl_data = rounded(pnl_data, 1)
+        pnl_data = rounded(pnl_annual(df_annual_full), 1)
         pnl_data.to_excel(writer, sheet_name="P&L_Annual", index=False)
 
         # 5) Tax diagnostics (levered)
@@ -1324,18 +1234,22 @@ def generate_excel_file():
             "Debt_Balance_M_COP"
         ]]
         debt_sched = rounded(debt_sched, 1)
+        coverage = coverage_table(engine_result)
+        debt_sched["CFADS_M_COP"] = coverage["CFADS_M_COP"].round(1).to_numpy()
+        debt_sched["DSCR_x"] = coverage["DSCR"].round(3).to_numpy()
+        debt_sched["LLCR_x"] = coverage["LLCR"].round(3).to_numpy()
         debt_sched.to_excel(writer, sheet_name="Debt_Schedule", index=False)
 
         # 7) Scenarios (for active project), if any
-        active_proj = st.session_state["active_project"]
-        proj_entry = st.session_state["projects"].setdefault(
-            active_proj, {"inputs": {}, "scenarios": {}, "files": []}
-        )
+        proj_entry = projects.get(active_proj, {})
         scenarios_dict = proj_entry.get("scenarios", {})
 
         scen_df = None
         if scenarios_dict:
-            scen_df = pd.DataFrame.from_dict(scenarios_dict, orient="index")
+            scen_df = pd.DataFrame.from_dict(
+                {name: scenario_summary(s) for name, s in scenarios_dict.items()},
+                orient="index"
+            )
             scen_df.index.name = "Scenario"
             scen_df.reset_index(inplace=True)
             scen_df = rounded(scen_df, 2)
@@ -1343,7 +1257,7 @@ def generate_excel_file():
 
         # 8) Portfolio consolidation (all projects, first scenario per project)
         portfolio_rows = []
-        for proj_name, pdata in st.session_state["projects"].items():
+        for proj_name, pdata in projects.items():
             scen = pdata.get("scenarios", {})
             if not scen:
                 continue
@@ -1364,10 +1278,11 @@ def generate_excel_file():
             portfolio_df.to_excel(writer, sheet_name="Portfolio", index=False)
 
         # 9) Simulation matrix, if user has run it
-        sim_df = st.session_state.get("sim_df", None)
         if sim_df is not None:
             sim_df_xls = rounded(sim_df, 2)
             sim_df_xls.to_excel(writer, sheet_name="Simulation", index=False)
+        if sim_multiple_df is not None:
+            rounded(sim_multiple_df, 2).to_excel(writer, sheet_name="Simulation (Multiple)", index=False)
 
         # 10) Documentation sheet
         doc_rows = [
@@ -1378,6 +1293,12 @@ def generate_excel_file():
             {"Section": "Assumptions", "Item": "CAPEX Benefit Law 1715", "Detail": "Yes" if enable_capex_benefit else "No"},
             {"Section": "Assumptions", "Item": "Debt Enabled", "Detail": "Yes" if enable_debt else "No"},
             {"Section": "Assumptions", "Item": "Investor Ke", "Detail": f"{investor_disc_rate*100:.1f}%"},
+            {"Section": "Coverage", "Item": "DSCR / LLCR",
+             "Detail": "DSCR = CFADS / (interest + principal); LLCR = PV of CFADS to loan end at the loan rate / opening debt. "
+                       "CFADS = EBITDA - taxes - FTT. Min/avg over operating quarters."},
+            {"Section": "Coverage", "Item": "Payback / Cash yield",
+             "Detail": "Payback on dashboard levered flows (exit included) from construction start; discounted at Ke. "
+                       "Cash yield = average annual operating LFCF / equity."},
             {"Section": "Notes", "Item": "Units", "Detail": "Most monetary figures in M COP; IRR/NPV based on quarterly cash flows."},
         ]
         df_doc = pd.DataFrame(doc_rows)
@@ -1413,9 +1334,9 @@ def generate_excel_file():
             writer.sheets["Summary"] = ws_sum
 
             # IRR ranges from Quarterly_Model (UFCF / LFCF in M COP)
-            q_rows = len(df_full)
-            ufcf_idx = df_full.columns.get_loc("UFCF_M_COP")
-            lfcf_idx = df_full.columns.get_loc("LFCF_M_COP")
+            q_rows = len(df_quarterly)
+            ufcf_idx = df_quarterly.columns.get_loc("UFCF_M_COP")
+            lfcf_idx = df_quarterly.columns.get_loc("LFCF_M_COP")
             ufcf_col_letter = excel_col(ufcf_idx)
             lfcf_col_letter = excel_col(lfcf_idx)
             ufcf_range = f"Quarterly_Model!{ufcf_col_letter}2:{ufcf_col_letter}{q_rows+1}"
@@ -1443,6 +1364,18 @@ def generate_excel_file():
             ws_sum.write("B8", "Equity NPV (M COP)", label_fmt)
             ws_sum.write_formula("C8", f"=NPV(C7/4,{lfcf_range})-C4", money_fmt)
 
+            # Coverage & payback (engine arrays; NaN = no debt / never paid back)
+            ws_sum.write("E3", "Coverage & Payback", label_fmt)
+            ratio_fmt = workbook.add_format({"num_format": "0.00"})
+            for row, (key, label) in enumerate(FINANCIAL_METRIC_LABELS.items(), start=4):
+                ws_sum.write(f"E{row}", label, label_fmt)
+                value = fin_metrics[key]
+                if np.isnan(value):
+                    ws_sum.write(f"F{row}", "n/a", text_fmt)
+                else:
+                    ws_sum.write_number(f"F{row}", value, ratio_fmt)
+            ws_sum.set_column(4, 4, 28)
+
             # 12) Scenario switcher (if scenarios exist)
             if scen_df is not None and not scen_df.empty:
                 ws_sum.write("B10", "Selected Scenario", label_fmt)
@@ -1537,627 +1470,1447 @@ def generate_excel_file():
 
 
 # ------------------------------------------------------
-# PDF HELPER FUNCTIONS (CHARTS)
+# DASHBOARD VIEW
 # ------------------------------------------------------
-def make_fcf_chart_image(df_annual_dash_local, currency_mode_local):
-    unit_label = currency_mode_local
-    years = df_annual_dash_local["Calendar_Year"].astype(int)
-    fig, ax = plt.subplots(figsize=(6, 3))
-    ax.bar(years - 0.15, df_annual_dash_local["UFCF_Disp"],
-           width=0.3, label="UFCF")
-    ax.bar(years + 0.15, df_annual_dash_local["LFCF_Disp"],
-           width=0.3, label="LFCF")
-    ax.set_title(f"Free Cash Flows by Year ({unit_label})")
-    ax.set_xlabel("Year")
-    ax.set_ylabel(unit_label)
-    ax.legend()
-    fig.tight_layout()
-    tmpfile = tempfile.NamedTemporaryFile(delete=False, suffix=".png")
-    fig.savefig(tmpfile.name, dpi=150)
-    plt.close(fig)
-    return tmpfile.name
-
-
-def make_sim_heatmap_image(sim_df_local, T_local, currency_mode_local):
-    if sim_df_local is None or sim_df_local.empty:
-        return None
+def dashboard_view():
+    # ------------------------------------------------------
+    # SCENARIO MANAGEMENT (PER PROJECT)
+    # ------------------------------------------------------
+    st.markdown("### Scenario Management")
+
+    active_proj = st.session_state["active_project"]
+    proj_entry = st.session_state["projects"].setdefault(
+        active_proj,
+        {"inputs": {}, "scenarios": {}, "files": []}
+    )
+    scenarios_dict = proj_entry.setdefault("scenarios", {})
+
+    # --- Save scenario ---
+    # A fragment: typing the name reruns only this box, not the charts below
+    @st.fragment
+    def save_scenario_panel():
+        scenario_name = st.text_input(
+            "Scenario name (e.g. 'Base COP with debt 70%')",
+            value="",
+            key="scenario_name"
+        )
+
+        if st.button("💾 Save current scenario"):
+            if not scenario_name.strip():
+                st.warning("Please enter a scenario name before saving.")
+            else:
+                # 1st-year PPA price to client (COP $/kWh)
+                ppa_price_year1_cop = current_tariff * (1 - discount_rate)
+
+                scenario_kpis = {
+                    "Equity_Investment": equity_inv_disp,
+                    "IRR_Levered_%": irr_levered,
+                    "MOIC_x": moic_levered,
+                    "Exit_Method": dash_exit_strategy,
+                    "Exit_Year": dash_exit_year,
+                    "Exit_Value_M_COP": final_exit_val_cop,
+                    "Client_Tariff_$perkWh": current_tariff,
+                    "PPA_Year1_$perkWh": ppa_price_year1_cop,
+                    "PPA_Years": ppa_term_years,
+                }
+                scenario_snapshot = {k: st.session_state[k] for k in PROJECT_INPUT_KEYS if k in st.session_state}
+                scenarios_dict[scenario_name] = build_scenario(
+                    scenario_kpis, scenario_snapshot, engine_result, exit_out
+                )
+                save_projects_to_disk()
+                st.toast(f"Scenario '{scenario_name}' saved for project '{active_proj}'.")
+                # Full rerun: the comparison and the portfolio pick the scenario up
+                st.rerun()
 
-    # sim_df_local must have ExitYear, ExitValue, IRR
-    pivot = sim_df_local.pivot(index="ExitYear", columns="ExitValue", values="IRR")
-    years = pivot.index.values
-    vals = pivot.columns.values
-
-    fig, ax = plt.subplots(figsize=(6, 4))
-    c = ax.imshow(pivot.values, aspect="auto", origin="lower")
-    ax.set_xticks(np.arange(len(vals)))
-    ax.set_xticklabels(vals, rotation=45, ha="right")
-    ax.set_yticks(np.arange(len(years)))
-    ax.set_yticklabels(years)
-    ax.set_xlabel(T_local["s5_val"])
-    ax.set_ylabel(T_local["s5_year"])
-    ax.set_title(f"{T_local['sim_chart']} ({currency_mode_local})")
-    fig.colorbar(c, ax=ax, label="IRR %")
-    fig.tight_layout()
-    tmpfile = tempfile.NamedTemporaryFile(delete=False, suffix=".png")
-    fig.savefig(tmpfile.name, dpi=150)
-    plt.close(fig)
-    return tmpfile.name
+    save_scenario_panel()
+
+    # --- Restore / delete scenario (per project) ---
+    def restore_scenario(proj_name: str, scen_name: str):
+        """Load a saved scenario's input snapshot into the sidebar (runs before the rerun)."""
+        scen = st.session_state["projects"][proj_name]["scenarios"].get(scen_name, {})
+        for k, v in scen.get("inputs", {}).items():
+            st.session_state[k] = v
+        save_current_inputs_to_project()
+
+    restorable = [name for name, scen in scenarios_dict.items() if has_snapshot(scen)]
+    if restorable:
+        col_rs1, col_rs2 = st.columns([3, 1])
+        with col_rs1:
+            scenario_to_restore = st.selectbox(
+                "Restore saved scenario into the sidebar",
+                restorable,
+                key="scenario_to_restore"
+            )
+        with col_rs2:
+            st.button(
+                "↩️ Restore scenario",
+                on_click=restore_scenario,
+                args=(active_proj, scenario_to_restore)
+            )
 
+    if scenarios_dict:
+        st.markdown("#### Delete saved scenario (current project)")
+        col_del1, col_del2 = st.columns([3, 1])
 
-# ------------------------------------------------------
-# PDF GENERATION
-# ------------------------------------------------------
-class PDF(FPDF):
-    def header(self):
-        if os.path.exists("logo.jpg"):
-            self.image("logo.jpg", 10, 8, 33)
-        self.set_font('Arial', 'B', 15)
-        self.cell(80)
-        self.cell(30, 10, 'Pharos Capital: BTM Model', 0, 0, 'C')
-        self.ln(20)
-
-    def footer(self):
-        self.set_y(-15)
-        self.set_font('Arial', 'I', 8)
-        self.cell(0, 10, f'Page {self.page_no()}', 0, 0, 'C')
-
-
-def create_pdf(df_agg, df_annual_dash_local, proj_name, cli_name, loc,
-               curr_sym, currency_mode_local, fx_rate_current_local,
-               sim_df_local=None, close_df_local=None):
-    pdf = PDF()
-    pdf.add_page()
-    pdf.set_font("Arial", size=12)
-
-    # Units note
-    pdf.set_font("Arial", 'I', 9)
-    pdf.set_text_color(100, 100, 100)
-    pdf.cell(0, 6, f"All monetary figures in {currency_mode_local}", 0, 1, 'R')
-    pdf.ln(2)
-    pdf.set_text_color(0, 0, 0)
-    pdf.set_font("Arial", size=12)
-
-    # Compute Year-1 PPA price to client
-    ppa_price_year1_cop = current_tariff * (1 - discount_rate)
-    if "USD" in currency_mode_local:
-        ppa_price_year1_disp = ppa_price_year1_cop / fx_rate_current_local
+        with col_del1:
+            scenario_to_delete = st.selectbox(
+                "Select scenario to delete",
+                list(scenarios_dict.keys()),
+                key="scenario_to_delete"
+            )
+
+        with col_del2:
+            if st.button("🗑️ Delete selected scenario"):
+                if scenario_to_delete in scenarios_dict:
+                    del scenarios_dict[scenario_to_delete]
+                    save_projects_to_disk()
+                    st.success(f"Scenario '{scenario_to_delete}' deleted from project '{active_proj}'.")
+                    st.rerun()
     else:
-        ppa_price_year1_disp = ppa_price_year1_cop
-
-    # 1. Project Overview
-    pdf.set_fill_color(14, 47, 68)
-    pdf.set_text_color(255, 255, 255)
-    pdf.cell(0, 10, "1. Project Overview", 0, 1, 'L', 1)
-    pdf.set_text_color(0, 0, 0)
-    pdf.ln(2)
-    pdf.cell(90, 7, f"Project: {proj_name}", 0, 0)
-    pdf.cell(90, 7, f"Client: {cli_name}", 0, 1)
-    pdf.cell(90, 7, f"Location: {loc}", 0, 1)
-    pdf.ln(5)
-
-    # 2. Key Assumptions
-    pdf.set_fill_color(14, 47, 68)
-    pdf.set_text_color(255, 255, 255)
-    pdf.cell(0, 10, "2. Key Assumptions", 0, 1, 'L', 1)
-    pdf.set_text_color(0, 0, 0)
-    pdf.ln(2)
-
-    # Row 1: timing
-    pdf.cell(60, 7, f"Start: {start_year} {start_q_str}", 0, 0)
-    pdf.cell(60, 7, f"Term: {ppa_term_years} Years", 0, 1)
-
-    # Row 2: tariffs
-    pdf.cell(60, 7, f"Client Tariff: ${current_tariff:,.1f}/kWh", 0, 0)
-    pdf.cell(60, 7, f"Discount Offered: {discount_rate*100:.1f}%", 0, 0)
-    pdf.cell(60, 7, f"Year 1 PPA Price: ${ppa_price_year1_disp:,.2f}/kWh", 0, 1)
-
-    # Row 3: energy & capex
-    pdf.cell(60, 7, f"Energy: {initial_gen_mwh_annual:,.1f} MWh", 0, 0)
-    pdf.cell(
-        60, 7,
-        f"CAPEX: {curr_sym}{capex_million_cop*inv_conv:,.1f} {currency_mode_local.split()[0]}",
-        0, 0
-    )
-    pdf.cell(60, 7, f"Leverage: {debt_ratio*100:.0f}%", 0, 1)
-    pdf.ln(5)
-
-    # 3. Executive Summary
-    pdf.set_fill_color(14, 47, 68)
-    pdf.set_text_color(255, 255, 255)
-    pdf.cell(0, 10, "3. Executive Summary", 0, 1, 'L', 1)
-    pdf.set_text_color(0, 0, 0)
-    pdf.ln(2)
-    pdf.set_font("Arial", 'B', 12)
-    pdf.cell(45, 10, f"Eq Inv: {curr_sym}{equity_inv_disp:,.1f}", 1, 0, 'C')
-    pdf.cell(45, 10, f"IRR: {irr_levered:.1f}%", 1, 0, 'C')
-    pdf.cell(45, 10, f"NPV: {curr_sym}{npv_equity:,.1f}", 1, 0, 'C')
-    pdf.cell(45, 10, f"MOIC: {moic_levered:,.1f}x", 1, 1, 'C')
-    pdf.set_font("Arial", size=12)
-    pdf.ln(5)
-
-    # 4. FCF Overview (Chart)
-    pdf.set_fill_color(14, 47, 68)
-    pdf.set_text_color(255, 255, 255)
-    pdf.cell(0, 10, "4. Free Cash Flow Overview", 0, 1, 'L', 1)
-    pdf.set_text_color(0, 0, 0)
-    pdf.ln(2)
-    try:
-        fcf_img = make_fcf_chart_image(df_annual_dash_local, currency_mode_local)
-        pdf.image(fcf_img, x=10, y=None, w=180)
-    except Exception as e:
-        pdf.set_font("Arial", '', 10)
-        pdf.cell(0, 6, f"(Could not render FCF chart: {e})", 0, 1)
-    pdf.ln(5)
-
-    # 5. Simulation Matrix - IRR Sensitivity
-    if sim_df_local is not None and not sim_df_local.empty:
-        pdf.set_fill_color(14, 47, 68)
-        pdf.set_text_color(255, 255, 255)
-        pdf.cell(
-            0, 10,
-            "5. Simulation Matrix - Equity IRR Sensitivity for Client Asset Buy-Back",
-            0, 1, 'L', 1
+        st.caption("No saved scenarios for this project.")
+
+    # ------------------------------------------------------
+    # TOP KPIs, PDF & EXCEL BUTTONS
+    # ------------------------------------------------------
+    col_head1, col_head2 = st.columns([3, 1])
+    with col_head1:
+        st.subheader(f"📊 {currency_mode}")
+    with col_head2:
+        sim_df_for_pdf = artifacts.get("sim_df")
+        close_df_for_pdf = artifacts.get("sim_close_df")
+        if sim_df_for_pdf is None and "sim_cache_key" in st.session_state:
+            # Evicted from session memory: reload the last grid from the disk cache
+            sim_df_for_pdf = sim_cache.get(st.session_state["sim_cache_key"])
+            if sim_df_for_pdf is not None:
+                close_df_for_pdf = sim_close_matches(sim_df_for_pdf, irr_levered)
+
+        # Reports are generated on click rather than on every rerun, so their
+        # bytes are never held in the session.
+        pdf_report = report_context(
+            model_params,
+            {"kpis": kpi_out, "aggregation": agg_out, "engine": engine_result, "exit": exit_out},
+            project_name,
+            client_name,
+            project_loc,
         )
-        pdf.set_text_color(0, 0, 0)
-        pdf.ln(2)
-        try:
-            sim_img = make_sim_heatmap_image(sim_df_local, T, currency_mode_local)
-            if sim_img:
-                pdf.image(sim_img, x=10, y=None, w=180)
-        except Exception as e:
-            pdf.set_font("Arial", '', 10)
-            pdf.cell(0, 6, f"(Could not render sensitivity heatmap: {e})", 0, 1)
-        pdf.ln(5)
-
-        # 5a. Simulation Table (excerpt)
-        pdf.set_fill_color(14, 47, 68)
-        pdf.set_text_color(255, 255, 255)
-        pdf.cell(0, 10, "5a. Simulation Table (Exit Year vs Asset Value)", 0, 1, 'L', 1)
-        pdf.set_text_color(0, 0, 0)
-        pdf.ln(2)
-        pdf.set_font("Arial", size=9)
-
-        sim_tbl = sim_df_local.copy()
-
-        # Normalize column names regardless of language / history
-        if "ExitYear" in sim_tbl.columns and "ExitValue" in sim_tbl.columns:
-            pass
-        elif T["s5_year"] in sim_tbl.columns and T["s5_val"] in sim_tbl.columns:
-            sim_tbl = sim_tbl.rename(columns={
-                T["s5_year"]: "ExitYear",
-                T["s5_val"]: "ExitValue"
-            })
-        elif "Exit Year" in sim_tbl.columns and "Exit Value (M COP)" in sim_tbl.columns:
-            sim_tbl = sim_tbl.rename(columns={
-                "Exit Year": "ExitYear",
-                "Exit Value (M COP)": "ExitValue"
+
+        pdf_inputs_hash = current_inputs_hash()
+
+        def pdf_bytes():
+            with profiled("PDF report", pdf_inputs_hash, profiler_mode):
+                return create_pdf(
+                    pdf_report,
+                    T,
+                    sim_df_local=sim_df_for_pdf,
+                    close_df_local=close_df_for_pdf
+                )
+
+        # Use scenario name (if any) for the file names
+        project_label = st.session_state.get("active_project", "").strip()
+        project_label = project_label.replace(" ", "_") or "Project"
+
+        scen_label = st.session_state.get("scenario_name", "").strip()
+        scen_label = scen_label.replace(" ", "_") or "memo"
+
+        pdf_file_name = f"{project_label}__{scen_label}.pdf"
+
+        st.download_button(
+            label="📄 Download PDF Report",
+            data=pdf_bytes,
+            file_name=pdf_file_name,
+            mime="application/pdf"
+        )
+
+        # NEW: Excel export
+        excel_inputs = {key: st.session_state.get(key, None) for key in PROJECT_INPUT_KEYS}
+        projects_snapshot = dict(st.session_state["projects"])
+        excel_project = st.session_state["active_project"]
+
+        sim_multiple_df_for_xls = artifacts.get("sim_multiple_df")
+
+        def excel_bytes():
+            with profiled("Excel export", inputs_hash(excel_inputs), profiler_mode):
+                return generate_excel_file(
+                    excel_inputs, projects_snapshot, excel_project, sim_df=sim_df_for_pdf,
+                    sim_multiple_df=sim_multiple_df_for_xls
+                )
+        excel_file_name = f"{project_label}__{scen_label}.xlsx"
+
+        st.download_button(
+            label="📊 Download Excel Model",
+            data=excel_bytes,
+            file_name=excel_file_name,
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        )
+
+    k1, k2, k3, k4 = st.columns(4)
+    k1.metric(T["kpi_eq"], f"{symbol}{equity_inv_disp:,.1f}")
+    start_p = current_tariff * (1 - discount_rate)
+    if "USD" in currency_mode:
+        start_p /= fx_rate_current
+    k2.metric(T["kpi_tar"], f"${start_p:,.2f} /kWh")
+    k3.metric(T["kpi_irr"], f"{irr_levered:.1f}%")
+    k4.metric(T["kpi_npv"], f"{symbol}{npv_equity:,.1f}")
+
+    st.divider()
+
+    # Saved scenarios comparison (per project); its selectors rerun only this fragment
+    @st.fragment
+    def scenario_comparison():
+        if scenarios_dict:
+            st.markdown("### Saved Scenarios Comparison (current project)")
+            df_scen = scenario_table(scenarios_dict)
+
+            st.dataframe(
+                df_scen.style.format({
+                    "PPA_Years": "{:.0f}",
+                    "Equity_Investment": "{:,.1f}",
+                    "IRR_Levered_%": "{:,.1f}",
+                    "MOIC_x": "{:,.2f}",
+                    "Exit_Year": "{:.0f}",
+                    "Exit_Value_M_COP": "{:,.1f}",
+                    "PPA_Year1_$perkWh": "{:,.1f}",
+                    "Client_Tariff_$perkWh": "{:,.1f}",
+                }),
+                use_container_width=True
+            )
+
+            snap_names = [name for name, scen in scenarios_dict.items() if has_snapshot(scen)]
+            if snap_names:
+                st.markdown("#### Cash-flow overlay (M COP, stored arrays)")
+                overlay_series = st.selectbox("Series", list(OVERLAY_SERIES), key="scenario_overlay_series")
+                df_overlay = scenario_overlay(
+                    {name: scenarios_dict[name] for name in snap_names}, overlay_series
+                )
+                overlay_chart = alt.Chart(df_overlay).mark_line().encode(
+                    x=alt.X("Period:Q", title="Year", axis=alt.Axis(format="d")),
+                    y=alt.Y("Value:Q", title=f"{overlay_series} (M COP)"),
+                    color=alt.Color("Scenario:N"),
+                    tooltip=["Scenario", alt.Tooltip("Period:Q", format=".2f"), alt.Tooltip("Value:Q", format=",.1f")]
+                )
+                st.altair_chart(overlay_chart, use_container_width=True)
+
+            if len(scenarios_dict) > 1:
+                st.markdown("#### Scenario vs scenario")
+                scen_names = list(scenarios_dict)
+                col_sa, col_sb = st.columns(2)
+                with col_sa:
+                    scen_a = st.selectbox("Scenario A", scen_names, index=0, key="scenario_delta_a")
+                with col_sb:
+                    scen_b = st.selectbox("Scenario B", scen_names, index=1, key="scenario_delta_b")
+
+                delta_kpis, delta_inputs, delta_annual = scenario_delta(
+                    scenarios_dict[scen_a], scenarios_dict[scen_b]
+                )
+                st.dataframe(delta_kpis.astype({"A": str, "B": str}), use_container_width=True, hide_index=True)
+                if delta_inputs is None:
+                    st.caption("Input and cash-flow deltas need both scenarios saved with a snapshot (re-save older scenarios).")
+                else:
+                    if delta_inputs.empty:
+                        st.caption("Both scenarios were saved with identical inputs.")
+                    else:
+                        st.markdown("**Changed inputs**")
+                        st.dataframe(delta_inputs.astype({"A": str, "B": str}), use_container_width=True, hide_index=True)
+                    st.markdown("**Annual cash flows, B − A (M COP)**")
+                    st.dataframe(
+                        delta_annual.style.format(
+                            {c: "{:,.1f}" for c in delta_annual.columns if c != "Calendar_Year"}
+                        ),
+                        use_container_width=True,
+                        hide_index=True
+                    )
+        else:
+            st.markdown("_No scenarios saved yet for this project. Use **'Save current scenario'** above to store one._")
+
+    scenario_comparison()
+
+    c1, c2, c3 = st.columns(3)
+    with c1:
+        st.markdown(f"### {T['card_proj']}")
+        st.metric("TIR", f"{irr_unlevered:.1f}%")
+    with c2:
+        st.markdown(f"### {T['card_eq']}")
+        st.metric(T["kpi_moic"], f"{moic_levered:.1f}x")
+        st.caption(f"{T['lbl_lev']}: {debt_ratio * 100:.0f}%" if enable_debt else T["lbl_nodebt"])
+        if enable_debt and model_params["debt_sizing"] == "Target DSCR":
+            st.caption(
+                f"Sized at DSCR {model_params['target_dscr']:.2f}x"
+                f"{' (sculpted)' if model_params['debt_sculpting'] else ''}: "
+                f"{total_debt_principal:,.1f} M COP"
+            )
+    with c3:
+        st.markdown("### ⚖️ Leverage Boost")
+        st.metric("Delta", f"{irr_levered - irr_unlevered:+.1f}%", delta_color="normal")
+
+    st.divider()
+
+    # Revenue proof
+    with st.expander(T["rev_proof"], expanded=False):
+        st.write("Revenue Proof: **Generation (MWh) × Price ($/kWh) = Revenue (M)**")
+        proof_df = df_annual_dash[["Calendar_Year", "Generation_MWh", "Revenue_Disp"]].copy()
+        proof_df.columns = ["Year", T["col_gen"], T["col_rev"]]
+        st.dataframe(
+            proof_df.style.format({
+                "Year": "{:.0f}",
+                T["col_gen"]: "{:,.1f}",
+                T["col_rev"]: "{:,.1f}"
             })
+        )
+
+    # Tax diagnostics (levered)
+    with st.expander("Tax Base & Loss Carryforward (Levered view)", expanded=False):
+        tax_view = model_display.frame()[[
+            "Calendar_Year",
+            "Quarter",
+            "EBITDA_M_COP",
+            "Interest_M_COP",
+            "Depreciation_M_COP",
+            "Tax_Base_Lev_PreBenefit_M_COP",
+            "Capex_Tax_Benefit_M_COP",
+            "Tax_Base_Lev_M_COP",
+            "Tax_Base_Lev_Cum_M_COP",
+            "Tax_M_COP",
+            "Tax_Lev_Cum_M_COP"
+        ]].copy()
+        tax_view.rename(columns={
+            "EBITDA_M_COP": "EBITDA",
+            "Interest_M_COP": "Interest",
+            "Depreciation_M_COP": "Depreciation",
+            "Tax_Base_Lev_PreBenefit_M_COP": "Tax Base Pre-Benefit",
+            "Capex_Tax_Benefit_M_COP": "CAPEX Benefit Used",
+            "Tax_Base_Lev_M_COP": "Tax Base After Benefit",
+            "Tax_Base_Lev_Cum_M_COP": "Tax Base Cumulative",
+            "Tax_M_COP": "Tax (Quarter)",
+            "Tax_Lev_Cum_M_COP": "Tax Cumulative"
+        }, inplace=True)
+        paged_table(tax_view, "tax_table")
+
+    # Full quarterly model (M COP and display-currency columns)
+    with st.expander("🗂️ Quarterly Model", expanded=False):
+        paged_table(
+            currency_view.frame(),
+            "quarterly_table",
+            default_columns=[
+                "Calendar_Year", "Quarter", "Generation_MWh", "Revenue_Disp", "EBITDA_Disp",
+                "Interest_Disp", "Tax_Disp", "UFCF_Disp", "LFCF_Disp", "Debt_Balance_M_COP",
+            ],
+            formats={"FX_Rate": "%.2f"},
+        )
+
+    # Hourly netting (only when the project runs on an hourly profile)
+    if model_params.get("generation_schedule") is not None:
+        with st.expander("⚡ Hourly Netting (self-consumption vs export)", expanded=False):
+            net_df = netting_table(model_params, profile_store.load(st.session_state["active_project"]))
+            net_df["Op_Year"] = (net_df["Op_Quarter"] - 1) // 4 + 1
+            net_annual = net_df.groupby("Op_Year")[
+                ["Generation_MWh", "Self_Consumed_MWh", "Exported_MWh", "Load_MWh"]
+            ].sum().reset_index()
+            net_annual["Self_Consumption_%"] = net_annual["Self_Consumed_MWh"] / net_annual["Generation_MWh"] * 100
+            net_annual["Solar_Coverage_%"] = net_annual["Self_Consumed_MWh"] / net_annual["Load_MWh"] * 100
+            n1, n2, n3 = st.columns(3)
+            n1.metric("Self-consumption (year 1)", f"{net_annual['Self_Consumption_%'].iloc[0]:.1f}%")
+            n2.metric("Solar coverage of load (year 1)", f"{net_annual['Solar_Coverage_%'].iloc[0]:.1f}%")
+            n3.metric("Export credit", f"{model_params['export_price_ratio'] * 100:.0f}% of PPA price")
+            net_long = net_annual.melt(
+                id_vars="Op_Year", value_vars=["Self_Consumed_MWh", "Exported_MWh"],
+                var_name="Energy", value_name="MWh"
+            )
+            st.altair_chart(
+                alt.Chart(net_long).mark_bar().encode(
+                    x=alt.X("Op_Year:O", title="Operating year"),
+                    y=alt.Y("MWh:Q", title="MWh"),
+                    color=alt.Color("Energy:N", scale=alt.Scale(range=["#2E7D32", "#F9A825"])),
+                    tooltip=["Op_Year", "Energy", alt.Tooltip("MWh:Q", format=",.1f")]
+                ),
+                use_container_width=True
+            )
+            st.dataframe(
+                net_annual.style.format({
+                    "Generation_MWh": "{:,.1f}",
+                    "Self_Consumed_MWh": "{:,.1f}",
+                    "Exported_MWh": "{:,.1f}",
+                    "Load_MWh": "{:,.1f}",
+                    "Self_Consumption_%": "{:.1f}",
+                    "Solar_Coverage_%": "{:.1f}",
+                }),
+                use_container_width=True,
+                hide_index=True
+            )
+
+    # Actuals: budget vs actual, and the re-forecast from the last actual quarter
+    with st.expander("📈 Actuals & Re-forecast", expanded=False):
+        actuals_project = st.session_state["active_project"]
+        st.caption(
+            "CSV with one row per quarter: year, quarter (1-4 or Q1-Q4) and any of "
+            "generation_mwh, revenue_m_cop, opex_m_cop. Blank cells keep the forecast. "
+            "Each upload replaces the project's actuals."
+        )
+        actuals_file = st.file_uploader("Actuals CSV", type=["csv"], key="actuals_file")
+        if actuals_file is not None and st.session_state.get("actuals_file_id") != actuals_file.file_id:
+            st.session_state["actuals_file_id"] = actuals_file.file_id
+            try:
+                uploaded_actuals = read_actuals_csv(actuals_file)
+                actuals_errors = check_actuals(model_params, uploaded_actuals)
+                if actuals_errors:
+                    raise ValueError("; ".join(actuals_errors[:5]))
+                actuals_store.save(actuals_project, uploaded_actuals)
+                st.rerun()
+            except ValueError as e:
+                st.error(f"Actuals not loaded: {e}")
+
+        stored_actuals = actuals_store.load(actuals_project)
+        if stored_actuals is None or not len(stored_actuals):
+            st.caption("No actuals stored for this project: the model is the budget.")
         else:
-            year_col = next(
-                (c for c in sim_tbl.columns if "Year" in c or "Año" in c),
-                None
+            last_year, last_q = stored_actuals[["Year", "Quarter"]].iloc[-1]
+            checkpoint = engine_result.checkpoint
+            st.caption(
+                f"{len(stored_actuals)} quarters of actuals up to {last_year} Q{last_q}; "
+                + (f"re-forecast from period {checkpoint.quarters + 1} of {len(engine_result)}."
+                   if checkpoint is not None else "no actual falls in the operating quarters.")
             )
-            val_col = next(
-                (c for c in sim_tbl.columns if c not in ("IRR", year_col)),
-                None
+            st.button("🗑️ Remove actuals", key="actuals_remove_btn",
+                      on_click=actuals_store.remove, args=(actuals_project,))
+
+            if "budget_pipeline" not in st.session_state:
+                st.session_state["budget_pipeline"] = build_model_pipeline()
+            budget = run_model(budget_params(model_params), st.session_state["budget_pipeline"])
+            st.markdown("**Budget vs re-forecast**")
+            st.dataframe(
+                reforecast_kpis(kpi_out, budget["kpis"]),
+                column_config={
+                    col: st.column_config.NumberColumn(format="%.2f")
+                    for col in ("Budget", "Re-forecast", "Change")
+                },
+                use_container_width=True,
+                hide_index=True,
             )
-            if year_col and val_col:
-                sim_tbl = sim_tbl.rename(columns={
-                    year_col: "ExitYear",
-                    val_col: "ExitValue"
-                })
-            else:
-                return pdf.output(dest='S').encode('latin-1', 'replace')
-
-        sim_tbl = sim_tbl.sort_values(["ExitYear", "ExitValue"])
-        sim_tbl = sim_tbl[["ExitYear", "ExitValue", "IRR"]].head(25)
-
-        headers_sim = ["Exit Year", "Exit Value (M COP)", "IRR %"]
-        widths_sim = [25, 55, 25]
-
-        pdf.set_fill_color(220, 220, 220)
-        for w, h in zip(widths_sim, headers_sim):
-            pdf.cell(w, 7, h, 1, 0, 'C', 1)
-        pdf.ln()
-
-        for _, row in sim_tbl.iterrows():
-            pdf.cell(widths_sim[0], 6, f"{int(row['ExitYear'])}", 1, 0, 'C')
-            pdf.cell(widths_sim[1], 6, f"{row['ExitValue']:,.1f}", 1, 0, 'R')
-            pdf.cell(widths_sim[2], 6, f"{row['IRR']:,.1f}", 1, 0, 'R')
-            pdf.ln()
-
-        pdf.ln(5)
-
-    # 6. Alternatives Matching Base IRR
-    if close_df_local is not None and not close_df_local.empty:
-        pdf.set_fill_color(14, 47, 68)
-        pdf.set_text_color(255, 255, 255)
-        pdf.cell(0, 10, "6. Alternatives with IRR Close to Base Case", 0, 1, 'L', 1)
-        pdf.set_text_color(0, 0, 0)
-        pdf.ln(2)
-        pdf.set_font("Arial", size=9)
-
-        close_pdf = close_df_local.head(10).copy()
-        headers = ["Exit Year", "Exit Value (M COP)", "IRR %", "Delta IRR vs Base"]
-        widths = [25, 55, 25, 30]
-        pdf.set_fill_color(220, 220, 220)
-        for w, h in zip(widths, headers):
-            pdf.cell(w, 7, h, 1, 0, 'C', 1)
-        pdf.ln()
-
-        for _, row in close_pdf.iterrows():
-            pdf.cell(widths[0], 6, f"{int(row['Exit Year'])}", 1, 0, 'C')
-            pdf.cell(widths[1], 6, f"{row['Exit Value (M COP)']:,.1f}", 1, 0, 'R')
-            pdf.cell(widths[2], 6, f"{row['IRR']:,.1f}", 1, 0, 'R')
-            pdf.cell(widths[3], 6, f"{row['ΔIRR_vs_Base']:+.1f}", 1, 0, 'R')
-            pdf.ln()
-
-    return pdf.output(dest='S').encode('latin-1', 'replace')
 
+            variance_df = variance_table(model_params, engine_result, budget["engine"])
+            variance_line = st.selectbox("Variance line", VARIANCE_LINES, index=1, key="variance_line")
+            line_df = variance_df[(variance_df["Line"] == variance_line) & (variance_df["Period"] != "Total")]
+            st.altair_chart(
+                alt.Chart(line_df).mark_bar().encode(
+                    x=alt.X("Period:O", title="Quarter", sort=None),
+                    y=alt.Y("Variance:Q", title=f"{variance_line}: actual - budget"),
+                    color=alt.condition(alt.datum.Variance >= 0, alt.value("#2E7D32"), alt.value("#C62828")),
+                    tooltip=["Period", alt.Tooltip("Budget:Q", format=",.1f"),
+                             alt.Tooltip("Actual:Q", format=",.1f"),
+                             alt.Tooltip("Variance_%:Q", format=".1f")]
+                ),
+                use_container_width=True
+            )
+            paged_table(variance_df, "variance_table", formats={"Variance_%": "%.1f"})
+
+    # Coverage & payback (DSCR / LLCR per quarter from the engine arrays)
+    with st.expander("🏦 Coverage & Payback", expanded=False):
+        def fmt_metric(value, pattern):
+            return "n/a" if np.isnan(value) else pattern.format(value)
+
+        m1, m2, m3, m4 = st.columns(4)
+        m1.metric("Min DSCR", fmt_metric(fin_metrics["min_dscr"], "{:.2f}x"))
+        m1.caption(f"Avg {fmt_metric(fin_metrics['avg_dscr'], '{:.2f}x')}")
+        m2.metric("LLCR", fmt_metric(fin_metrics["llcr"], "{:.2f}x"))
+        m2.caption(f"Min {fmt_metric(fin_metrics['min_llcr'], '{:.2f}x')}")
+        m3.metric("Equity payback", fmt_metric(fin_metrics["payback_years"], "{:.1f} yrs"))
+        m3.caption(f"Discounted at Ke: {fmt_metric(fin_metrics['discounted_payback_years'], '{:.1f} yrs')}")
+        m4.metric("Cash-on-cash yield", fmt_metric(fin_metrics["cash_yield_pct"], "{:.1f}%"))
+        m4.caption("Avg annual operating LFCF / equity")
+
+        if not enable_debt:
+            st.caption(T["lbl_nodebt"])
+        else:
+            cov_df = coverage_table(engine_result)
+            cov_df = cov_df[cov_df["DSCR"].notna()]
+            cov_df["Period"] = start_year + (model_params["start_q_num"] + cov_df["Quarter"] - 2) / 4
+            cov_long = cov_df.melt(id_vars="Period", value_vars=["DSCR", "LLCR"], var_name="Ratio", value_name="Value")
+            cov_chart = alt.Chart(cov_long).mark_line().encode(
+                x=alt.X("Period:Q", title="Year", axis=alt.Axis(format="d")),
+                y=alt.Y("Value:Q", title="Coverage (x)"),
+                color="Ratio:N",
+                tooltip=["Ratio", alt.Tooltip("Period:Q", format=".2f"), alt.Tooltip("Value:Q", format=".2f")]
+            )
+            if model_params["debt_sizing"] == "Target DSCR":
+                target_rule = alt.Chart(pd.DataFrame({"Value": [model_params["target_dscr"]]})).mark_rule(
+                    strokeDash=[4, 4], color="gray"
+                ).encode(y="Value:Q")
+                cov_chart = cov_chart + target_rule
+            st.altair_chart(cov_chart, use_container_width=True)
+            st.caption(
+                "DSCR = CFADS / (interest + principal); LLCR = PV of CFADS to loan maturity at the loan rate / "
+                "opening debt. CFADS = EBITDA − taxes − FTT (M COP). Min/avg exclude construction quarters."
+            )
 
-# ------------------------------------------------------
-# TOP KPIs, PDF & EXCEL BUTTONS
-# ------------------------------------------------------
-col_head1, col_head2 = st.columns([3, 1])
-with col_head1:
-    st.subheader(f"📊 {currency_mode}")
-with col_head2:
-    sim_df_for_pdf = st.session_state.get("sim_df", None)
-    close_df_for_pdf = st.session_state.get("sim_close_df", None)
-    pdf_bytes = create_pdf(
-        df_annual_dash,
-        df_annual_dash,
-        project_name,
-        client_name,
-        project_loc,
-        symbol,
-        currency_mode,
-        fx_rate_current,
-        sim_df_local=sim_df_for_pdf,
-        close_df_local=close_df_for_pdf
-    )
+    # Input sensitivities (all inputs in one batched engine run)
+    with st.expander("🎯 Input Sensitivities (∂IRR / ∂NPV per input)", expanded=False):
+        sens_inputs = {key: st.session_state.get(key) for key in PROJECT_INPUT_KEYS}
+        sens_project = st.session_state["active_project"]
+        # Valued like the dashboard: hourly netting and actuals included, so key on both stores
+        sens_key = (
+            tuple(sens_inputs.items()), currency_mode, us_inflation_annual, sens_project,
+            profile_store.signature(sens_project) if sens_inputs.get("profile_on") else "",
+            actuals_store.signature(sens_project),
+        )
+        sens_cached = artifacts.get("sensitivities")
+        if sens_cached is None or sens_cached[0] != sens_key:
+            sens_cached = (sens_key, input_sensitivities(
+                sens_inputs, currency_mode, us_inflation_annual, project=sens_project,
+                profile_store=profile_store, actuals_store=actuals_store,
+            ))
+            artifacts.put("sensitivities", sens_cached)
+        sens_df = sens_cached[1]
+        sens_df = sens_df.loc[sens_df["Elasticity_IRR"].abs().fillna(0).sort_values(ascending=False).index]
 
-    # Use scenario name (if any) for the file names
-    project_label = st.session_state.get("active_project", "").strip()
-    project_label = project_label.replace(" ", "_") or "Project"
+        st.caption(
+            "Change in Equity IRR (percentage points) and Equity NPV "
+            f"({currency_mode}) per unit of each input as entered in the sidebar "
+            "(integer inputs: per step). Elasticity = % change in the KPI per 1% change in the input."
+        )
+        sens_chart_df = sens_df[sens_df["Elasticity_IRR"].abs() > 1e-9].head(12)
+        if not sens_chart_df.empty:
+            sens_chart = alt.Chart(sens_chart_df).mark_bar().encode(
+                x=alt.X("Elasticity_IRR:Q", title="IRR elasticity"),
+                y=alt.Y("Input:N", sort=None, title=None),
+                color=alt.condition(alt.datum.Elasticity_IRR > 0, alt.value("#2E7D32"), alt.value("#C62828")),
+                tooltip=["Input", alt.Tooltip("dIRR_pp:Q", format=".3f"), alt.Tooltip("Elasticity_IRR:Q", format=".2f")]
+            )
+            st.altair_chart(sens_chart, use_container_width=True)
+        st.dataframe(
+            sens_df.drop(columns="Key").rename(columns={
+                "dIRR_pp": "∂IRR (pp)",
+                "dNPV": "∂NPV",
+                "Elasticity_IRR": "IRR elasticity",
+                "Elasticity_NPV": "NPV elasticity",
+            }).style.format({
+                "Value": "{:,.2f}",
+                "∂IRR (pp)": "{:,.3f}",
+                "∂NPV": "{:,.3f}",
+                "IRR elasticity": "{:,.2f}",
+                "NPV elasticity": "{:,.2f}",
+            }),
+            use_container_width=True,
+            hide_index=True
+        )
 
-    scen_label = st.session_state.get("scenario_name", "").strip()
-    scen_label = scen_label.replace(" ", "_") or "memo"
+    # KPIs for every exit year (both exit methods) from one pass over the engine result
+    @st.fragment
+    def exit_year_kpis():
+        with st.expander("📈 IRR / NPV / MOIC by Exit Year", expanded=False):
+            # Both methods priced from the inputs (the unselected one is zeroed in model_params)
+            saved_inputs = st.session_state["projects"][st.session_state["active_project"]].get("inputs", {})
+            exit_prices = {
+                method: float(st.session_state.get(key, saved_inputs.get(key, BASE_CASE_INPUTS[key])))
+                for method, key in (("Fixed Asset Value", "exit_asset_val"), ("EBITDA Multiple", "exit_mult_val"))
+            }
+            curves = exit_year_curves(model_params, engine_result, exit_prices=exit_prices)
+            curves = curves[curves["ExitYear"].between(2, ppa_term_years)]
+            curve_metric = st.radio(
+                "Metric",
+                ["IRR", "NPV", "MOIC"],
+                horizontal=True,
+                key="exit_curve_metric"
+            )
+            curve_titles = {"IRR": "Equity IRR (%)", "NPV": f"Equity NPV ({symbol})", "MOIC": "MOIC (x)"}
+            curve_chart = alt.Chart(curves).mark_line(point=True).encode(
+                x=alt.X("ExitYear:Q", title=T["s5_year"], axis=alt.Axis(tickMinStep=1)),
+                y=alt.Y(f"{curve_metric}:Q", title=curve_titles[curve_metric]),
+                color=alt.Color("Method:N", title="Exit method"),
+                tooltip=["Method", "ExitYear",
+                         alt.Tooltip("IRR:Q", format=".1f"),
+                         alt.Tooltip("NPV:Q", format=",.1f"),
+                         alt.Tooltip("MOIC:Q", format=".2f"),
+                         alt.Tooltip("Exit_Value_M_COP:Q", format=",.1f")]
+            )
+            exit_rule = alt.Chart(pd.DataFrame({"ExitYear": [dash_exit_year]})).mark_rule(
+                strokeDash=[4, 4], color="gray"
+            ).encode(x="ExitYear:Q")
+            st.altair_chart(curve_chart + exit_rule, use_container_width=True)
+            st.caption(
+                "Each point is the dashboard KPI with that exit year selected (other inputs unchanged). "
+                "Dashed line: current exit year. Exit values in M COP."
+            )
+            st.dataframe(
+                curves.pivot(index="ExitYear", columns="Method", values=["IRR", "NPV", "MOIC"])
+                .rename_axis(index="Exit Year").style.format("{:,.2f}", na_rep="–"),
+                use_container_width=True
+            )
 
-    pdf_file_name = f"{project_label}__{scen_label}.pdf"
+    exit_year_kpis()
 
-    st.download_button(
-        label="📄 Download PDF Report",
-        data=pdf_bytes,
-        file_name=pdf_file_name,
-        mime="application/pdf"
+    st.markdown(f"##### {T['chart_cf']}")
+    df_melt = df_annual_dash.melt(
+        id_vars=["Calendar_Year"],
+        value_vars=["UFCF_Disp", "LFCF_Disp"],
+        var_name="Type",
+        value_name="CashFlow"
     )
+    base_chart = alt.Chart(df_melt).encode(
+        x=alt.X('Type:N', title=None, axis=None),
+        y=alt.Y('CashFlow:Q', title=f"Cash Flow ({currency_mode})")
+    )
+    bars = base_chart.mark_bar().encode(
+        color=alt.Color('Type:N'),
+        tooltip=['Calendar_Year', 'Type', 'CashFlow']
+    )
+    text = base_chart.mark_text(dy=-10).encode(
+        text=alt.Text('CashFlow:Q', format='.1f')
+    )
+    chart = alt.layer(bars, text).properties(width=80).facet(
+        column=alt.Column('Calendar_Year:O', title="Year",
+                          header=alt.Header(labelAngle=0, labelAlign='center'))
+    )
+    st.altair_chart(chart, use_container_width=True)
 
-    # NEW: Excel export
-    excel_bytes = generate_excel_file()
-    excel_file_name = f"{project_label}__{scen_label}.xlsx"
+    st.markdown("---")
 
-    st.download_button(
-        label="📊 Download Excel Model",
-        data=excel_bytes,
-        file_name=excel_file_name,
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
+    # Layout changes rerun only the statements
+    @st.fragment
+    def statement_tables():
+        table_layout = st.radio("Table Layout",
+                                ["Horizontal (Years as Columns)", "Vertical (Years as Rows)"],
+                                horizontal=True)
 
-k1, k2, k3, k4 = st.columns(4)
-k1.metric(T["kpi_eq"], f"{symbol}{equity_inv_disp:,.1f}")
-start_p = current_tariff * (1 - discount_rate)
-if "USD" in currency_mode:
-    start_p /= fx_rate_current
-k2.metric(T["kpi_tar"], f"${start_p:,.2f} /kWh")
-k3.metric(T["kpi_irr"], f"{irr_levered:.1f}%")
-k4.metric(T["kpi_npv"], f"{symbol}{npv_equity:,.1f}")
-
-st.divider()
-
-# Saved scenarios comparison (per project)
-if scenarios_dict:
-    st.markdown("### Saved Scenarios Comparison (current project)")
-    df_scen = pd.DataFrame.from_dict(
-        scenarios_dict,
-        orient="index"
-    )
-    df_scen.index.name = "Scenario"
-    df_scen.reset_index(inplace=True)
-
-    cols_order = [
-        "Scenario",
-        "PPA_Years",
-        "Equity_Investment",
-        "IRR_Levered_%",
-        "MOIC_x",
-        "Exit_Method",
-        "Exit_Year",
-        "Exit_Value_M_COP",
-        "PPA_Year1_$perkWh",
-        "Client_Tariff_$perkWh",
-    ]
+        views_out = model_pipeline.get("views", {**model_params, "table_layout": table_layout})
+
+        for title, view_key in ((T["tab_pl"], "pnl_view"), (T["tab_full"], "cf_view")):
+            # Year columns (horizontal layout) become labels for column_config
+            statement = views_out[view_key].rename(columns=str)
+            st.markdown(f"### {title}")
+            st.dataframe(statement, column_config=number_columns(statement), use_container_width=True)
 
-    for col in cols_order:
-        if col not in df_scen.columns:
-            df_scen[col] = np.nan
+    statement_tables()
 
-    # Backward compatibility: if old Tariff_$perkWh exists, map to PPA_Year1
-    if "Tariff_$perkWh" in df_scen.columns:
-        df_scen["PPA_Year1_$perkWh"] = df_scen["PPA_Year1_$perkWh"].fillna(
-            df_scen["Tariff_$perkWh"]
+
+# ------------------------------------------------------
+# SIMULATION VIEW
+# ------------------------------------------------------
+# A fragment: changing the grid or running it reruns only this section
+@st.fragment
+def exit_simulation():
+    st.markdown("---")
+    st.header(T["sim_title"])
+    # Disk cache key: the sidebar inputs plus the stored profile and actuals the engine ran with
+    sim_inputs = {key: st.session_state.get(key) for key in PROJECT_INPUT_KEYS}
+    sim_inputs["actuals"] = actuals_store.signature(st.session_state["active_project"])
+    if sim_inputs.get("profile_on"):
+        sim_inputs["profile"] = profile_store.signature(st.session_state["active_project"])
+    with st.expander("Config", expanded=True):
+        sim_basis = st.radio(
+            "Exit basis",
+            ["Fixed Asset Value", "EBITDA Multiple"],
+            horizontal=True,
+            key="sim_basis"
         )
+        c_sim1, c_sim2 = st.columns(2)
+        with c_sim1:
+            sim_years = st.slider(T["s5_year"], 2, ppa_term_years, (5, 10))
+        with c_sim2:
+            if sim_basis == "Fixed Asset Value":
+                base_val = int(final_exit_val_cop) if final_exit_val_cop > 0 else 100
+                min_v = st.number_input(f"{T['sim_min']} (COP)",
+                                        value=max(10, base_val - 50),
+                                        step=10)
+                max_v = st.number_input(f"{T['sim_max']} (COP)",
+                                        value=base_val + 50,
+                                        step=10)
+                step_v = st.number_input(T["sim_step"], value=10, step=1)
+            else:
+                base_mult = float(st.session_state.get("exit_mult_val") or 5.0)
+                min_m = st.number_input(f"Min {T['s5_mult']}",
+                                        value=max(0.5, base_mult - 3.0),
+                                        step=0.5, format="%.1f")
+                max_m = st.number_input(f"Max {T['s5_mult']}",
+                                        value=base_mult + 3.0,
+                                        step=0.5, format="%.1f")
+                step_m = st.number_input(T["sim_step"], value=0.5, min_value=0.1,
+                                         step=0.1, format="%.1f")
+        sim_mode = "Uniform"
+        if sim_basis == "Fixed Asset Value":
+            sim_mode = st.radio(
+                "Grid",
+                ["Uniform", "Adaptive (hurdle contours)"],
+                horizontal=True,
+                key="sim_mode",
+                help="Adaptive starts from a coarse grid and only refines exit values where "
+                     "IRR crosses the selected hurdles, giving iso-IRR lines to 1/10 of the step."
+            )
+        sim_hurdle_options = {
+            f"Base IRR ({irr_levered:.1f}%)": irr_levered,
+            f"Ke ({investor_disc_rate * 100:.1f}%)": investor_disc_rate * 100,
+        }
+        if sim_mode != "Uniform":
+            sim_hurdles = st.multiselect(
+                "Hurdle IRRs",
+                list(sim_hurdle_options),
+                default=list(sim_hurdle_options)
+            )
 
-    df_scen = df_scen[cols_order]
+    def run_adaptive_simulation():
+        """Adaptive exit grid: coarse lattice + iso-IRR contours for the selected hurdles."""
+        hurdles = [sim_hurdle_options[h] for h in sim_hurdles if np.isfinite(sim_hurdle_options[h])]
+        points, contours = adaptive_exit_grid(
+            engine_result, construction_quarters, cap_gains_rate,
+            range(sim_years[0], sim_years[1] + 1), min_v, max_v, hurdles,
+            tol=max(float(step_v), 1.0) / 10
+        )
+        hurdle_names = {v: k for k, v in sim_hurdle_options.items()}
+        contours["Hurdle"] = contours["Hurdle"].map(hurdle_names)
+
+        points_chart = alt.Chart(points).mark_circle(size=70).encode(
+            x=alt.X("ExitValue:Q", title=T["s5_val"], scale=alt.Scale(zero=False)),
+            y=alt.Y("ExitYear:Q", title=T["s5_year"], scale=alt.Scale(zero=False)),
+            color=alt.Color("IRR:Q", scale=alt.Scale(scheme="redyellowgreen"), title="IRR %"),
+            tooltip=["ExitYear", alt.Tooltip("ExitValue:Q", format=",.1f"),
+                     alt.Tooltip("IRR:Q", format=".2f"), "Level"]
+        )
+        contour_chart = alt.Chart(contours).mark_line(point=True, strokeWidth=3).encode(
+            x="ExitValue:Q",
+            y="ExitYear:Q",
+            color=alt.Color("Hurdle:N", scale=alt.Scale(scheme="category10")),
+            detail="Hurdle:N",
+            tooltip=["Hurdle", "ExitYear", alt.Tooltip("ExitValue:Q", format=",.1f")]
+        )
+        st.altair_chart(
+            alt.layer(points_chart, contour_chart).resolve_scale(color="independent")
+            .properties(title=T["sim_chart"]),
+            use_container_width=True
+        )
 
-    st.dataframe(
-        df_scen.style.format({
-            "PPA_Years": "{:.0f}",
-            "Equity_Investment": "{:,.1f}",
-            "IRR_Levered_%": "{:,.1f}",
-            "MOIC_x": "{:,.2f}",
-            "Exit_Year": "{:.0f}",
-            "Exit_Value_M_COP": "{:,.1f}",
-            "PPA_Year1_$perkWh": "{:,.1f}",
-            "Client_Tariff_$perkWh": "{:,.1f}",
-        }),
-        use_container_width=True
-    )
-else:
-    st.markdown("_No scenarios saved yet for this project. Use **'Save current scenario'** above to store one._")
-
-c1, c2, c3 = st.columns(3)
-with c1:
-    st.markdown(f"### {T['card_proj']}")
-    st.metric("TIR", f"{irr_unlevered:.1f}%")
-with c2:
-    st.markdown(f"### {T['card_eq']}")
-    st.metric(T["kpi_moic"], f"{moic_levered:.1f}x")
-    st.caption(f"{T['lbl_lev']}: {debt_ratio * 100:.0f}%" if enable_debt else T["lbl_nodebt"])
-with c3:
-    st.markdown("### ⚖️ Leverage Boost")
-    st.metric("Delta", f"{irr_levered - irr_unlevered:+.1f}%", delta_color="normal")
-
-st.divider()
-
-# Revenue proof
-with st.expander(T["rev_proof"], expanded=False):
-    st.write("Revenue Proof: **Generation (MWh) × Price ($/kWh) = Revenue (M)**")
-    proof_df = df_annual_dash[["Calendar_Year", "Generation_MWh", "Revenue_Disp"]].copy()
-    proof_df.columns = ["Year", T["col_gen"], T["col_rev"]]
-    st.dataframe(
-        proof_df.style.format({
-            "Year": "{:.0f}",
-            T["col_gen"]: "{:,.1f}",
-            T["col_rev"]: "{:,.1f}"
-        })
-    )
+        n_years = sim_years[1] - sim_years[0] + 1
+        n_uniform = n_years * (int((max_v - min_v) / (max(float(step_v), 1.0) / 10)) + 1)
+        st.caption(
+            f"{len(points)} IRR solves ({n_uniform:,} for a uniform grid of the same resolution)."
+        )
+        if contours.empty:
+            st.info("No hurdle crossings inside the selected ranges.")
+        else:
+            st.dataframe(
+                contours.pivot_table(index="ExitYear", columns="Hurdle", values="ExitValue", aggfunc="min")
+                .rename_axis(index="Exit Year").style.format("{:,.1f}", na_rep="–"),
+                use_container_width=True
+            )
 
-# Tax diagnostics (levered)
-with st.expander("Tax Base & Loss Carryforward (Levered view)", expanded=False):
-    tax_view = df_full[[
-        "Calendar_Year",
-        "Quarter",
-        "EBITDA_M_COP",
-        "Interest_M_COP",
-        "Depreciation_M_COP",
-        "Tax_Base_Lev_PreBenefit_M_COP",
-        "Capex_Tax_Benefit_M_COP",
-        "Tax_Base_Lev_M_COP",
-        "Tax_Base_Lev_Cum_M_COP",
-        "Tax_M_COP",
-        "Tax_Lev_Cum_M_COP"
-    ]].copy()
-    tax_view.rename(columns={
-        "EBITDA_M_COP": "EBITDA",
-        "Interest_M_COP": "Interest",
-        "Depreciation_M_COP": "Depreciation",
-        "Tax_Base_Lev_PreBenefit_M_COP": "Tax Base Pre-Benefit",
-        "Capex_Tax_Benefit_M_COP": "CAPEX Benefit Used",
-        "Tax_Base_Lev_M_COP": "Tax Base After Benefit",
-        "Tax_Base_Lev_Cum_M_COP": "Tax Base Cumulative",
-        "Tax_M_COP": "Tax (Quarter)",
-        "Tax_Lev_Cum_M_COP": "Tax Cumulative"
-    }, inplace=True)
-    st.dataframe(
-        tax_view.style.format({
-            "EBITDA": "{:,.1f}",
-            "Interest": "{:,.1f}",
-            "Depreciation": "{:,.1f}",
-            "Tax Base Pre-Benefit": "{:,.1f}",
-            "CAPEX Benefit Used": "{:,.1f}",
-            "Tax Base After Benefit": "{:,.1f}",
-            "Tax Base Cumulative": "{:,.1f}",
-            "Tax (Quarter)": "{:,.1f}",
-            "Tax Cumulative": "{:,.1f}",
-        }),
-        use_container_width=True
-    )
+        # Exports get the regular coarse lattice (PDF heatmap needs a full grid)
+        lattice = points[points["Level"] == 0].drop(columns="Level")
+        lattice["IRR"] = lattice["IRR"].round(1)
+        return lattice
+
+    def run_multiple_simulation():
+        """Exit year x EBITDA multiple grid, priced off trailing four-quarter EBITDA."""
+        years = np.arange(sim_years[0], sim_years[1] + 1)
+        multiples = np.round(np.arange(min_m, max_m + step_m / 2, step_m), 4)
+        yy, mm = np.repeat(years, len(multiples)), np.tile(multiples, len(years))
+        sim_key = simulation_key(sim_inputs, sim_years, min_m, max_m, step_m, kind="ebitda_multiple")
+        mult_df = sim_cache.get(sim_key)
+        if mult_df is None:
+            irr, values = exit_multiple_irr(
+                engine_result, construction_quarters, cap_gains_rate, yy, mm
+            )
+            mult_df = pd.DataFrame({
+                "ExitYear": yy,
+                "ExitMultiple": mm,
+                "ExitValue": values.round(1),
+                "IRR": irr.round(1),
+            })
+            sim_cache.put(sim_key, mult_df)
+        else:
+            st.caption("Loaded from the simulation cache (same inputs and grid).")
+
+        heatmap = alt.Chart(mult_df).mark_rect().encode(
+            x=alt.X("ExitMultiple:O", title=T["s5_mult"]),
+            y=alt.Y("ExitYear:O", title=T["s5_year"]),
+            color=alt.Color(
+                "IRR:Q",
+                scale=alt.Scale(scheme="redyellowgreen"),
+                title="IRR %"
+            ),
+            tooltip=["ExitYear", "ExitMultiple",
+                     alt.Tooltip("ExitValue:Q", title="Exit Value (M COP)", format=",.1f"), "IRR"]
+        ).properties(title=f"{T['sim_chart']} (EBITDA Multiple)")
+        text_sim = heatmap.mark_text(baseline="middle").encode(
+            text=alt.Text("IRR:Q", format=".1f"),
+            color=alt.value("black")
+        )
+        st.altair_chart(heatmap + text_sim, use_container_width=True)
+        st.caption(
+            "Exit value = trailing four-quarter EBITDA at the exit quarter x multiple "
+            "(as the dashboard's EBITDA Multiple method)."
+        )
+        artifacts.put("sim_multiple_df", mult_df)
+
+    def run_uniform_simulation():
+        """Exit year x exit value grid (cached on disk by inputs and grid)."""
+        sim_key = simulation_key(sim_inputs, sim_years, min_v, max_v, step_v)
+        sim_df = sim_cache.get(sim_key)
+        if sim_df is None:
+            years = np.arange(sim_years[0], sim_years[1] + 1)
+            values = np.arange(int(min_v), int(max_v) + int(step_v), int(step_v))
+            # One batched IRR solve for the whole grid (the same path as /v1/buyback)
+            vv, yy = np.repeat(values, len(years)), np.tile(years, len(values))
+            irr = exit_value_irr(engine_result, construction_quarters, cap_gains_rate, yy, vv)
+            sim_df = pd.DataFrame({"ExitYear": yy, "ExitValue": vv, "IRR": irr.round(1)})
+            sim_cache.put(sim_key, sim_df)
+        else:
+            st.caption("Loaded from the simulation cache (same inputs and grid).")
+        st.session_state["sim_cache_key"] = sim_key
+
+        heatmap = alt.Chart(sim_df).mark_rect().encode(
+            x=alt.X('ExitValue:O', title=T["s5_val"]),
+            y=alt.Y('ExitYear:O', title=T["s5_year"]),
+            color=alt.Color(
+                'IRR:Q',
+                scale=alt.Scale(scheme='redyellowgreen'),
+                title='IRR %'
+            ),
+            tooltip=['ExitYear', 'ExitValue', 'IRR']
+        ).properties(title=T["sim_chart"])
+
+        text_sim = heatmap.mark_text(
+            baseline='middle'
+        ).encode(
+            text=alt.Text('IRR:Q', format='.1f'),
+            color=alt.value('black')
+        )
 
-st.markdown(f"##### {T['chart_cf']}")
-df_melt = df_annual_dash.melt(
-    id_vars=["Calendar_Year"],
-    value_vars=["UFCF_Disp", "LFCF_Disp"],
-    var_name="Type",
-    value_name="CashFlow"
-)
-base_chart = alt.Chart(df_melt).encode(
-    x=alt.X('Type:N', title=None, axis=None),
-    y=alt.Y('CashFlow:Q', title=f"Cash Flow ({currency_mode})")
-)
-bars = base_chart.mark_bar().encode(
-    color=alt.Color('Type:N'),
-    tooltip=['Calendar_Year', 'Type', 'CashFlow']
-)
-text = base_chart.mark_text(dy=-10).encode(
-    text=alt.Text('CashFlow:Q', format='.1f')
-)
-chart = alt.layer(bars, text).properties(width=80).facet(
-    column=alt.Column('Calendar_Year:O', title="Year",
-                      header=alt.Header(labelAngle=0, labelAlign='center'))
-)
-st.altair_chart(chart, use_container_width=True)
+        st.altair_chart(heatmap + text_sim, use_container_width=True)
+
+        # Sensitivity summary around base IRR
+        target_irr = irr_levered
+        lower_bound = target_irr * 0.9
+        upper_bound = target_irr * 1.1
+
+        close_df = sim_close_matches(sim_df, target_irr)
+
+        if close_df is not None:
+            st.markdown(f"#### {T['sim_match_title']}")
+            st.caption(
+                f"Base case IRR: {target_irr:.1f}%. "
+                f"Showing alternatives with IRR between {lower_bound:.1f}% and {upper_bound:.1f}%."
+            )
+            st.dataframe(
+                close_df.style.format({
+                    "Exit Year": "{:.0f}",
+                    "Exit Value (M COP)": "{:,.1f}",
+                    "IRR": "{:.1f}",
+                    "ΔIRR_vs_Base": "{:+.1f}"
+                }),
+                use_container_width=True
+            )
+        else:
+            st.info(
+                f"No simulation points found with IRR within ±10% of base case ({target_irr:.1f}%). "
+                f"Try widening the year/value ranges."
+            )
+
+        # Store for PDF & Excel (evictable under the session memory budget)
+        artifacts.put("sim_df", sim_df)
+        artifacts.put("sim_close_df", close_df)
+
+    sim_clicked = st.button(T["sim_run"])
+    if sim_clicked:
+        with profiled("Run Simulation", current_inputs_hash(), profiler_mode):
+            if sim_basis == "EBITDA Multiple":
+                run_multiple_simulation()
+            elif sim_mode != "Uniform":
+                sim_df = run_adaptive_simulation()
+                artifacts.put("sim_df", sim_df)
+                artifacts.put("sim_close_df", sim_close_matches(sim_df, irr_levered))
+                st.session_state.pop("sim_cache_key", None)
+            else:
+                run_uniform_simulation()
+
+
+# Deal terms maximizing NPV / IRR under client, lender and buy-back limits
+@st.fragment
+def deal_optimizer():
+    st.markdown("---")
+    st.header("🎯 Deal Optimizer")
+    deal_keys = deal_variables(model_params)
+    deal_current = {k: [v] for k, v in deal_values(model_params, deal_keys).items()}
+    deal_now = {name: float(values[0]) for name, values in deal_metrics(model_params, deal_current).items()}
+    with st.expander("Objective & constraints", expanded=True):
+        st.caption(
+            "Searches the deal terms below with batched engine runs (a cross-entropy search over "
+            "populations of deals, then a local compass search onto the constraint edges). "
+            "Debt terms are only searched with debt enabled; the exit value follows the exit method. "
+            "Client savings = 1 − PPA payments / the same energy at the utility tariff, up to the exit."
+        )
+        deal_objective = st.radio(
+            "Maximize", list(DEAL_OBJECTIVES), format_func=DEAL_OBJECTIVES.get,
+            horizontal=True, key="deal_objective"
+        )
+        deal_limits = {}
+        c_opt1, c_opt2, c_opt3 = st.columns(3)
+        constraint_defaults = {
+            "min_savings_pct": (c_opt1, round(deal_now["savings_pct"], 1), 1.0, "%.1f"),
+            "min_dscr": (c_opt2, float(model_params["target_dscr"]), 0.05, "%.2f"),
+            "max_buyback": (c_opt3, round(max(deal_now["buyback_m_cop"], 0.0), 1), 5.0, "%.1f"),
+        }
+        for name, (col, default, step, fmt) in constraint_defaults.items():
+            if name == "min_dscr" and not model_params["enable_debt"]:
+                continue
+            with col:
+                if st.checkbox(DEAL_CONSTRAINTS[name][0], value=True, key=f"deal_on_{name}"):
+                    deal_limits[name] = st.number_input(
+                        f"{'Min' if DEAL_CONSTRAINTS[name][2] == '>=' else 'Max'} "
+                        f"{DEAL_CONSTRAINTS[name][0]}",
+                        value=default, step=step, format=fmt, key=f"deal_limit_{name}",
+                        label_visibility="collapsed",
+                    )
+        bounds_df = pd.DataFrame([
+            {"Input": DEAL_VARIABLES[k][0], "Lower": float(lo), "Upper": float(hi)}
+            for k, (lo, hi) in default_deal_bounds(model_params, deal_keys).items()
+        ])
+        edited_bounds = st.data_editor(
+            bounds_df, disabled=["Input"], hide_index=True, use_container_width=True,
+            key=f"deal_bounds_{'_'.join(deal_keys)}",
+        )
+
+    if st.button("🎯 Optimize deal"):
+        deal_bounds = {
+            k: (float(row.Lower), float(row.Upper))
+            for k, row in zip(deal_keys, edited_bounds.itertuples())
+        }
+        if any(lo > hi for lo, hi in deal_bounds.values()):
+            st.warning("Each lower bound must be at most its upper bound.")
+        else:
+            with st.spinner("Optimizing..."):
+                artifacts.put("deal_optimizer", optimize_deal(
+                    model_params, deal_objective, deal_limits, deal_bounds, deal_keys
+                ))
+
+    deal = artifacts.get("deal_optimizer")
+    if deal:
+        objective_label = DEAL_OBJECTIVES[deal["objective"]]
+        d1, d2, d3 = st.columns(3)
+        d1.metric(
+            f"{objective_label} (optimal)", f"{deal['metrics'][deal['objective']]:,.2f}",
+            f"{deal['metrics'][deal['objective']] - deal['current_metrics'][deal['objective']]:+,.2f} vs current"
+        )
+        d2.metric("Client savings", f"{deal['metrics']['savings_pct']:.1f}%")
+        d3.metric("Deals valued", f"{deal['evaluations']:,}")
+        if not deal["feasible"]:
+            st.error("No deal within the bounds meets every constraint; showing the least infeasible one.")
+        st.markdown("**Deal terms**")
+        st.dataframe(
+            deal["variables"].drop(columns="Key"),
+            column_config=number_columns(deal["variables"].drop(columns="Key"), default="%.2f"),
+            use_container_width=True, hide_index=True,
+        )
+        if len(deal["constraints"]):
+            st.markdown("**Constraints** (binding = active at the optimum)")
+            st.dataframe(
+                deal["constraints"],
+                column_config=number_columns(deal["constraints"], default="%.3f"),
+                use_container_width=True, hide_index=True,
+            )
+        history = deal["history"]
+        history = history[history["Generation"] != "polish"]
+        st.altair_chart(
+            alt.Chart(history).mark_line(point=True).encode(
+                x=alt.X("Evaluations:Q", title="Deals valued"),
+                y=alt.Y("Best_Objective:Q", title=f"Best {objective_label}", scale=alt.Scale(zero=False)),
+                tooltip=["Generation", "Evaluations", alt.Tooltip("Best_Objective:Q", format=",.2f")]
+            ),
+            use_container_width=True
+        )
+        st.caption(
+            f"After the population search: {history['Best_Objective'].iloc[-1]:,.2f}; "
+            f"after the compass search: {deal['metrics'][deal['objective']]:,.2f}."
+        )
+        if st.button("✅ Apply optimal terms to the sidebar", key="deal_apply_btn"):
+            st.session_state["pending_inputs"] = deal["values"]
+            st.rerun()
+
+
+# System size (generation, CAPEX, OPEX on size curves) against the client's consumption
+@st.fragment
+def system_sizing():
+    st.markdown("---")
+    st.header("📐 System Sizing")
+    with st.expander("Sizing settings", expanded=True):
+        st.caption(
+            "Rebuilds the project at a range of first-year generations, scaling CAPEX and OPEX by "
+            "size ** exponent (below 1 = economies of scale), and values every size in one batched "
+            "engine run. Coverage = generation / client consumption. "
+            + ("Each size is netted hour by hour against the stored load profile."
+               if model_params["use_hourly_profile"] else
+               "Without an hourly profile all generation is billed, so the coverage cap is what "
+               "ties the size to the client's consumption.")
+        )
+        z1, z2, z3 = st.columns(3)
+        sizing_objective = z1.radio(
+            "Maximize", list(SIZING_OBJECTIVES), format_func=SIZING_OBJECTIVES.get, key="sizing_objective"
+        )
+        max_coverage = z2.number_input(
+            "Max coverage (% of consumption)", min_value=1.0, value=DEFAULT_MAX_COVERAGE_PCT,
+            step=5.0, format="%.1f", key="sizing_max_cov"
+        )
+        n_sizes = z3.slider("Sizes", 11, 201, 41, step=10, key="sizing_n")
+        capex_exponent = z1.number_input(
+            "CAPEX size exponent", min_value=0.1, max_value=1.5, value=DEFAULT_CAPEX_EXPONENT,
+            step=0.05, format="%.2f", key="sizing_capex_exp"
+        )
+        opex_exponent = z2.number_input(
+            "OPEX size exponent", min_value=0.0, max_value=1.5, value=DEFAULT_OPEX_EXPONENT,
+            step=0.05, format="%.2f", key="sizing_opex_exp"
+        )
+        range_lo, range_hi = default_size_range(model_params, max_coverage)
+        # Unkeyed: the defaults follow the generation / consumption inputs
+        size_lo = z3.number_input("From (MWh/yr)", min_value=0.1, value=max(round(range_lo, 1), 0.1),
+                                  step=10.0, format="%.1f")
+        size_hi = z3.number_input("To (MWh/yr)", min_value=0.1, value=max(round(range_hi, 1), 1.0),
+                                  step=10.0, format="%.1f")
+
+    if st.button("📐 Size system"):
+        if size_lo >= size_hi:
+            st.warning("The size range must run from a smaller to a larger generation.")
+        else:
+            site_profile = (
+                profile_store.load(st.session_state["active_project"])
+                if model_params["use_hourly_profile"] else None
+            )
+            artifacts.put("system_sizing", optimize_size(
+                model_params, sizing_objective, max_coverage, (size_lo, size_hi), n_sizes,
+                capex_exponent, opex_exponent, profile=site_profile,
+            ))
+
+    sizing = artifacts.get("system_sizing")
+    if sizing:
+        column = sizing["column"]
+        objective_label = SIZING_OBJECTIVES[sizing["objective"]]
+        current = sizing["current"]
+        table = sizing["table"]
+        if current is None:
+            st.info(f"The project has no first-year generation, so the entered CAPEX and OPEX are taken "
+                    f"as the costs at {sizing['reference_mwh']:,.1f} MWh/yr and scaled from there.")
+        if not sizing["feasible"]:
+            st.error("No size in the range stays within the coverage cap.")
+        else:
+            best = sizing["best"]
+            s1, s2, s3 = st.columns(3)
+            s1.metric("Optimal generation", f"{best['Generation_MWh']:,.1f} MWh/yr",
+                      None if current is None else
+                      f"{best['Generation_MWh'] - current['Generation_MWh']:+,.1f} vs current")
+            s2.metric("Coverage", f"{best['Coverage_%']:.1f}%",
+                      f"cap {sizing['max_coverage_pct']:g}%", delta_color="off")
+            s3.metric(f"{objective_label} (optimal)", f"{best[column]:,.2f}",
+                      None if current is None else f"{best[column] - current[column]:+,.2f} vs current")
+        chart_df = table.assign(Point=np.where(table["Current"], "Current", ""))
+        if sizing["feasible"]:
+            chart_df.loc[chart_df["Generation_MWh"] == best["Generation_MWh"], "Point"] = "Optimal"
+        size_line = alt.Chart(chart_df).mark_line().encode(
+            x=alt.X("Generation_MWh:Q", title="First-year generation (MWh/yr)"),
+            y=alt.Y(f"{column}:Q", title=objective_label),
+            tooltip=[alt.Tooltip("Generation_MWh:Q", format=",.1f"), alt.Tooltip("Coverage_%:Q", format=".1f"),
+                     alt.Tooltip("CAPEX_M_COP:Q", format=",.1f"), alt.Tooltip(f"{column}:Q", format=",.2f")]
+        )
+        size_points = alt.Chart(chart_df[chart_df["Point"] != ""]).mark_point(size=90, filled=True).encode(
+            x="Generation_MWh:Q", y=f"{column}:Q", color=alt.Color("Point:N", title=None)
+        )
+        size_chart = size_line + size_points
+        cap_mwh = model_params["client_consumption"] * sizing["max_coverage_pct"] / 100
+        if table["Generation_MWh"].min() <= cap_mwh <= table["Generation_MWh"].max():
+            size_chart = size_chart + alt.Chart(pd.DataFrame({"Cap": [cap_mwh]})).mark_rule(
+                strokeDash=[4, 4], color="gray"
+            ).encode(x="Cap:Q")
+        st.altair_chart(size_chart, use_container_width=True)
+        st.caption("Dashed line: coverage cap. NPV in the display currency; CAPEX / OPEX in M COP.")
+        with st.expander("All sizes"):
+            st.dataframe(table, column_config=number_columns(table, default="%.2f"),
+                         use_container_width=True, hide_index=True)
+        if sizing["feasible"] and st.button("✅ Apply optimal size to the sidebar", key="sizing_apply_btn"):
+            st.session_state["pending_inputs"] = {
+                "gen_val": round(float(best["Generation_MWh"]), 1),
+                "capex_val": round(float(best["CAPEX_M_COP"]), 1),
+                "opex_val": round(float(best["OPEX_M_COP"]), 1),
+            }
+            st.rerun()
+
+
+def simulation_view():
+    exit_simulation()
+    deal_optimizer()
+    system_sizing()
 
-st.markdown("---")
-table_layout = st.radio("Table Layout",
-                        ["Horizontal (Years as Columns)", "Vertical (Years as Rows)"],
-                        horizontal=True)
-
-st.markdown(f"### {T['tab_pl']}")
-pnl_data_screen = df_annual_full.copy()
-pnl_data_screen["EBIT_Disp"] = pnl_data_screen["EBITDA_Disp"] - pnl_data_screen["Depreciation_Disp"]
-pnl_data_screen["EBT_Disp"] = pnl_data_screen["EBIT_Disp"] - pnl_data_screen["Interest_Disp"]
-pnl_data_screen["Net_Income_Disp"] = pnl_data_screen["EBT_Disp"] - pnl_data_screen["Tax_Disp"]
-
-pnl_view = pnl_data_screen[[
-    "Calendar_Year", "Revenue_Disp", "OPEX_Disp", "Gross_Disp",
-    "SGA_Disp", "EBITDA_Disp", "Depreciation_Disp", "EBIT_Disp",
-    "Interest_Disp", "EBT_Disp", "Tax_Disp", "Net_Income_Disp"
-]].set_index("Calendar_Year")
-
-if "Horizontal" in table_layout:
-    pnl_view = pnl_view.T
-    pnl_view.index = [
-        "Revenue", "(-) OPEX", "(=) Gross Profit", "(-) SGA", "(=) EBITDA",
-        "(-) Depreciation", "(=) EBIT", "(-) Interest",
-        "(=) EBT", "(-) Taxes", "(=) Net Income"
-    ]
-    st.dataframe(pnl_view.style.format("{:,.1f}"))
-else:
-    st.dataframe(pnl_view.style.format("{:,.1f}"))
-
-st.markdown(f"### {T['tab_full']}")
-cf_cols = ["Generation_MWh", "Revenue_Disp", "OPEX_Disp",
-           "EBITDA_Disp", "UFCF_Disp", "LFCF_Disp"]
-cf_view = df_annual_full.set_index("Calendar_Year")[cf_cols]
-
-if "Horizontal" in table_layout:
-    cf_view = cf_view.T
-    cf_view.index = ["Generation (MWh)", "Revenue", "(-) OPEX",
-                     "(=) EBITDA", "Unlevered FCF", "Levered FCF"]
-    st.dataframe(cf_view.style.format("{:,.1f}"))
-else:
-    st.dataframe(cf_view.style.format("{:,.1f}"))
 
 # ------------------------------------------------------
-# SIMULATION
+# PORTFOLIO VIEW (KPI INDEX, BULK IMPORT)
 # ------------------------------------------------------
-st.markdown("---")
-st.header(T["sim_title"])
-with st.expander("Config", expanded=True):
-    c_sim1, c_sim2 = st.columns(2)
-    with c_sim1:
-        sim_years = st.slider(T["s5_year"], 2, ppa_term_years, (5, 10))
-    with c_sim2:
-        base_val = int(final_exit_val_cop) if final_exit_val_cop > 0 else 100
-        min_v = st.number_input(f"{T['sim_min']} (COP)",
-                                value=max(10, base_val - 50),
-                                step=10)
-        max_v = st.number_input(f"{T['sim_max']} (COP)",
-                                value=base_val + 50,
-                                step=10)
-        step_v = st.number_input(T["sim_step"], value=10, step=1)
-
-
-def calculate_sim_irr(y_exit, v_exit_cop):
-    exit_q = construction_quarters + (y_exit * 4)
-    if exit_q > len(df_full):
-        return 0
-    df_slice = df_full.iloc[:exit_q].copy()
-    last_r = df_slice.iloc[-1]
-    gain_local = v_exit_cop - last_r["Book_Value_M_COP"]
-    tax_local = gain_local * cap_gains_rate if gain_local > 0 else 0
-    net_exit_cop = v_exit_cop - last_r["Debt_Balance_M_COP"] - tax_local
-    df_slice.at[len(df_slice) - 1, "LFCF_M_COP"] += net_exit_cop
-    return get_irr(df_slice["LFCF_M_COP"])
-
-
-if st.button(T["sim_run"]):
-    years_to_sim = list(range(sim_years[0], sim_years[1] + 1))
-    vals_to_sim = list(range(int(min_v), int(max_v) + int(step_v), int(step_v)))
-    sim_data = []
-    for v in vals_to_sim:
-        for y in years_to_sim:
-            sim_data.append({
-                "ExitYear": y,
-                "ExitValue": v,
-                "IRR": round(calculate_sim_irr(y, v), 1)
-            })
+@st.fragment
+def portfolio_index():
+    st.markdown("---")
+    st.header("📋 Portfolio")
+    with st.expander("All projects and saved scenarios", expanded=True):
+        st.caption(
+            "KPIs come from a persisted index: only projects whose inputs changed since they were "
+            f"last valued are re-run. Values in {currency_mode}."
+        )
+        revalued = kpi_index.refresh(
+            st.session_state["projects"], currency_mode, us_inflation_annual,
+            profile_store=profile_store, actuals_store=actuals_store,
+        )
+        c_pf1, c_pf2, c_pf3 = st.columns([2, 1, 1])
+        with c_pf1:
+            portfolio_search = st.text_input("Filter by project / scenario name", value="",
+                                             key="portfolio_search")
+        with c_pf2:
+            portfolio_min_irr = st.number_input("Min. equity IRR (%)", value=None, step=1.0,
+                                                key="portfolio_min_irr")
+        with c_pf3:
+            portfolio_scenarios = st.checkbox("Include saved scenarios", value=True,
+                                              key="portfolio_scenarios")
+        portfolio_df = kpi_index.table(
+            search=portfolio_search.strip(), min_irr=portfolio_min_irr,
+            include_scenarios=portfolio_scenarios, sort_by="irr_levered", descending=True,
+        )
+        portfolio_df["scenario"] = portfolio_df["scenario"].replace("", "(current inputs)")
+        st.caption(
+            f"{len(portfolio_df)} rows" + (f" · {revalued} re-valued on this run" if revalued else "")
+        )
+        st.dataframe(
+            portfolio_df.drop(columns="currency_mode"),
+            column_config={
+                "project": "Project",
+                "scenario": "Scenario",
+                "equity_investment": st.column_config.NumberColumn("Equity", format="%.1f"),
+                "irr_unlevered": st.column_config.NumberColumn("IRR Unlev. %", format="%.1f"),
+                "irr_levered": st.column_config.NumberColumn("IRR Lev. %", format="%.1f"),
+                "npv_equity": st.column_config.NumberColumn("NPV Equity", format="%.1f"),
+                "moic": st.column_config.NumberColumn("MOIC x", format="%.2f"),
+                "min_dscr": st.column_config.NumberColumn("Min DSCR x", format="%.2f"),
+                "payback_years": st.column_config.NumberColumn("Payback (yrs)", format="%.1f"),
+                "updated_at": "Valued at",
+            },
+            use_container_width=True,
+            hide_index=True,
+        )
 
-    sim_df = pd.DataFrame(sim_data)
-
-    heatmap = alt.Chart(sim_df).mark_rect().encode(
-        x=alt.X('ExitValue:O', title=T["s5_val"]),
-        y=alt.Y('ExitYear:O', title=T["s5_year"]),
-        color=alt.Color(
-            'IRR:Q',
-            scale=alt.Scale(scheme='redyellowgreen'),
-            title='IRR %'
-        ),
-        tooltip=['ExitYear', 'ExitValue', 'IRR']
-    ).properties(title=T["sim_chart"])
-
-    text_sim = heatmap.mark_text(
-        baseline='middle'
-    ).encode(
-        text=alt.Text('IRR:Q', format='.1f'),
-        color=alt.value('black')
-    )
 
-    st.altair_chart(heatmap + text_sim, use_container_width=True)
+@st.fragment
+def bulk_import():
+    st.markdown("---")
+    st.header("📥 Bulk Project Import")
+    with st.expander("Import a site list (CSV / Excel, one row per project)", expanded=False):
+        st.caption(
+            "Columns are the sidebar input keys (values as entered, percentages in %); blank cells "
+            "take the base case. Rows are validated in chunks, the valid projects are written to the "
+            "project store in one step and valued together in batched engine runs."
+        )
+        st.download_button(
+            "⬇️ Download template (CSV)",
+            data=site_template,
+            file_name="pharos_site_template.csv",
+            mime="text/csv",
+        )
+        site_file = st.file_uploader("Site list", type=["csv", "xlsx"], key="site_file")
+        c_imp1, c_imp2 = st.columns(2)
+        with c_imp1:
+            import_replace = st.checkbox(
+                "Update projects that already exist (inputs only)", value=False, key="import_replace"
+            )
+        with c_imp2:
+            import_partial = st.checkbox(
+                "Import valid rows even if some rows fail", value=False, key="import_partial"
+            )
 
-    # Sensitivity summary around base IRR
-    target_irr = irr_levered
-    lower_bound = target_irr * 0.9
-    upper_bound = target_irr * 1.1
+        if site_file is not None and st.button("📥 Validate & import"):
+            import_progress = st.progress(0.0, text="Validating...")
+            site_import = validate_sites(
+                read_site_chunks(site_file, site_file.name),
+                existing=st.session_state["projects"].keys(),
+                replace=import_replace,
+                on_chunk=lambda rows: import_progress.progress(0.5, text=f"Validated {rows} rows"),
+            )
+            write_ok = site_import.sites and (import_partial or not site_import.errors)
+            if write_ok:
+                merged_projects = merge_sites(st.session_state["projects"], site_import.sites)
+                try:
+                    write_projects_file(PROJECTS_FILE, merged_projects)
+                except OSError as e:
+                    write_ok = False
+                    st.error(f"Could not save projects to disk: {e}")
+                else:
+                    st.session_state["projects"] = merged_projects
+                    active = st.session_state["active_project"]
+                    if active in site_import.sites:
+                        # The sidebar still holds the old inputs and would save them back
+                        st.session_state["pending_inputs"] = dict(site_import.sites[active])
+            import_progress.progress(0.75, text="Valuing projects...")
+            artifacts.put("bulk_import", {
+                "file": site_file.name,
+                "rows": site_import.rows,
+                "imported": len(site_import.sites) if write_ok else 0,
+                "errors": site_import.error_table(),
+                "ignored_columns": site_import.ignored_columns,
+                "kpis": (
+                    portfolio_kpis(site_import.sites, currency_mode, us_inflation_annual,
+                                   profile_store=profile_store, actuals_store=actuals_store)
+                    if write_ok else None
+                ),
+            })
+            import_progress.progress(1.0, text="Done")
+            if write_ok:
+                st.rerun()
 
-    close_df = sim_df[
-        (sim_df["IRR"] >= lower_bound) &
-        (sim_df["IRR"] <= upper_bound)
-    ].copy()
+        bulk_import = artifacts.get("bulk_import")
+        if bulk_import:
+            if bulk_import["imported"]:
+                st.success(
+                    f"Imported {bulk_import['imported']} of {bulk_import['rows']} rows "
+                    f"from '{bulk_import['file']}'."
+                )
+            else:
+                st.error(
+                    f"Nothing was imported from '{bulk_import['file']}': fix the rows below "
+                    "or allow importing the valid rows only."
+                )
+            if bulk_import["ignored_columns"]:
+                st.caption(f"Ignored columns: {', '.join(bulk_import['ignored_columns'])}")
+            if not bulk_import["errors"].empty:
+                st.markdown(f"**Validation errors ({len(bulk_import['errors'])})**")
+                st.dataframe(bulk_import["errors"], use_container_width=True, hide_index=True)
+            if bulk_import["kpis"] is not None:
+                st.markdown(f"**Imported projects ({currency_mode})**")
+                st.dataframe(
+                    bulk_import["kpis"],
+                    column_config=number_columns(
+                        bulk_import["kpis"],
+                        formats={"MOIC_x": "%.2f", "Min_DSCR_x": "%.2f", "LLCR_x": "%.2f"}
+                    ),
+                    use_container_width=True,
+                    hide_index=True
+                )
 
-    if not close_df.empty:
-        close_df["ΔIRR_vs_Base"] = (close_df["IRR"] - target_irr).round(1)
-        close_df = close_df.sort_values(
-            by="ΔIRR_vs_Base",
-            key=lambda s: s.abs()
-        )
-        # Rename to human-readable labels for display
-        close_df = close_df.rename(columns={
-            "ExitYear": "Exit Year",
-            "ExitValue": "Exit Value (M COP)"
-        })
-        close_df = close_df[[
-            "Exit Year", "Exit Value (M COP)", "IRR", "ΔIRR_vs_Base"
-        ]].head(15)
-
-        st.markdown(f"#### {T['sim_match_title']}")
+
+@st.fragment
+def stress_tests():
+    st.markdown("---")
+    st.header("🧪 Portfolio Stress Tests")
+    with st.expander("Shock sets", expanded=False):
         st.caption(
-            f"Base case IRR: {target_irr:.1f}%. "
-            f"Showing alternatives with IRR between {lower_bound:.1f}% and {upper_bound:.1f}%."
+            "Each row shocks one sidebar input as entered (percentages move in points with \"add\"); "
+            "rows sharing a shock name are applied together. Every project is valued unshocked and "
+            "under every shock in batched engine runs. FX shocks only move USD figures."
+        )
+        shock_rows = pd.DataFrame(
+            [(name, key, op, float(value)) for name, shock in STRESS_SHOCKS.items() for key, op, value in shock],
+            columns=["Shock", "Input", "Operation", "Value"],
+        )
+        shock_inputs = [k for k in PROJECT_INPUT_KEYS if not isinstance(BASE_CASE_INPUTS.get(k), str)]
+        edited_shocks = st.data_editor(
+            shock_rows,
+            column_config={
+                "Input": st.column_config.SelectboxColumn(options=shock_inputs, required=True),
+                "Operation": st.column_config.SelectboxColumn(options=list(STRESS_OPERATIONS), required=True),
+                "Value": st.column_config.NumberColumn(required=True),
+            },
+            num_rows="dynamic",
+            hide_index=True,
+            use_container_width=True,
+            key="stress_shocks",
+        )
+
+    if st.button("🧪 Run stress tests"):
+        shocks = {}
+        for name, key, op, value in edited_shocks.dropna().itertuples(index=False):
+            shocks.setdefault(str(name).strip() or "Unnamed", []).append((key, op, value))
+        projects = st.session_state["projects"]
+        with st.spinner(f"Valuing {len(projects)} projects x {len(shocks) + 1} cases..."):
+            summary, detail = stress_test(
+                {name: entry.get("inputs", {}) for name, entry in projects.items()},
+                shocks, currency_mode, us_inflation_annual, profile_store=profile_store,
+                actuals_store=actuals_store,
+            )
+        artifacts.put("stress_test", {"summary": summary, "detail": detail, "currency": currency_mode})
+
+    stress = artifacts.get("stress_test")
+    if stress:
+        summary = stress["summary"]
+        st.markdown(f"**Portfolio impact per shock ({stress['currency']})**")
+        impact_chart = alt.Chart(summary.iloc[1:]).mark_bar().encode(
+            x=alt.X("ΔIRR_pp:Q", title="Δ equity-weighted IRR (pp)"),
+            y=alt.Y("Shock:N", sort=None, title=None),
+            color=alt.condition(alt.datum["ΔIRR_pp"] > 0, alt.value("#2E7D32"), alt.value("#C62828")),
+            tooltip=["Shock", alt.Tooltip("ΔIRR_pp:Q", format=".2f"), alt.Tooltip("ΔNPV:Q", format=",.1f")]
         )
+        st.altair_chart(impact_chart, use_container_width=True)
         st.dataframe(
-            close_df.style.format({
-                "Exit Year": "{:.0f}",
-                "Exit Value (M COP)": "{:,.1f}",
-                "IRR": "{:.1f}",
-                "ΔIRR_vs_Base": "{:+.1f}"
-            }),
-            use_container_width=True
+            summary,
+            column_config=number_columns(
+                summary, formats={"ΔIRR_pp": "%.2f", "Worst_ΔIRR_pp": "%.2f", "Projects_Worse": "%d"}
+            ),
+            use_container_width=True,
+            hide_index=True
         )
-    else:
-        close_df = None
-        st.info(
-            f"No simulation points found with IRR within ±10% of base case ({target_irr:.1f}%). "
-            f"Try widening the year/value ranges."
+        st.caption(
+            "Wtd IRR: levered IRR weighted by equity over projects with a defined IRR. "
+            "Projects worse: levered IRR down vs base."
         )
+        st.markdown("**Per project**")
+        paged_table(stress["detail"], "stress_detail", formats={"ΔIRR_pp": "%.2f"})
+
+
+def portfolio_view():
+    portfolio_index()
+    stress_tests()
+    bulk_import()
 
-    # Store for PDF & Excel
-    st.session_state["sim_df"] = sim_df
-    st.session_state["sim_close_df"] = close_df
+
+# ------------------------------------------------------
+# DOCUMENTS VIEW (IC REPORT BOOK)
+# ------------------------------------------------------
+@st.fragment
+def documents_view():
+    st.markdown("---")
+    st.header("📚 IC Report Book")
+    with st.expander("Batch memos for several projects and saved scenarios", expanded=False):
+        book_projects = st.multiselect(
+            "Projects",
+            proj_names,
+            default=[p for p in [st.session_state["active_project"]] if p in proj_names],
+            key="book_projects"
+        )
+        c_book1, c_book2 = st.columns(2)
+        with c_book1:
+            book_scenarios = st.checkbox("Include saved scenarios", value=True, key="book_scenarios")
+        with c_book2:
+            book_fmt = st.radio("Format", REPORT_FORMATS, horizontal=True, key="book_fmt")
+        st.caption(
+            "Each project is valued on its saved inputs and each scenario on its saved input snapshot "
+            f"(older KPI-only scenarios reuse the project inputs). Figures in {currency_mode}."
+        )
+
+        if st.button("📚 Build report book"):
+            book_jobs = report_jobs(
+                st.session_state["projects"], book_projects, include_scenarios=book_scenarios
+            )
+            if not book_jobs:
+                st.warning("Select at least one project.")
+            else:
+                book_progress = st.progress(0.0, text=f"0/{len(book_jobs)} memos")
+                book_data = build_report_book(
+                    book_jobs, T,
+                    currency_mode=currency_mode,
+                    us_inflation_annual=us_inflation_annual,
+                    fmt=book_fmt,
+                    on_progress=lambda done, total: book_progress.progress(
+                        done / total, text=f"{done}/{total} memos"
+                    ),
+                )
+                artifacts.put("report_book", {"data": book_data, "fmt": book_fmt, "count": len(book_jobs)})
+
+        report_book = artifacts.get("report_book")
+        if report_book:
+            book_ext = "pdf" if report_book["fmt"] == "Merged PDF" else "zip"
+            st.download_button(
+                label=f"⬇️ Download report book ({report_book['count']} memos)",
+                data=report_book["data"],
+                file_name=f"Pharos_IC_Book_{datetime.now().strftime('%Y%m%d')}.{book_ext}",
+                mime="application/pdf" if book_ext == "pdf" else "application/zip"
+            )
 
 
+# ------------------------------------------------------
+# VIEWS
+# ------------------------------------------------------
+# Only the selected view renders; the sidebar inputs and the engine run
+# above are shared by all of them.
+APP_VIEWS = {
+    "📊 Dashboard": dashboard_view,
+    "🎲 Simulation": simulation_view,
+    "📋 Portfolio": portfolio_view,
+    "📚 Documents": documents_view,
+}
+app_view = st.radio("View", list(APP_VIEWS), horizontal=True, key="app_view",
+                    label_visibility="collapsed")
+APP_VIEWS[app_view]()
 
 
+# ------------------------------------------------------
+# MODEL PIPELINE DIAGNOSTICS
+# ------------------------------------------------------
+with st.expander("⏱️ Model pipeline (this rerun)", expanded=False):
+    stage_rows = [
+        {
+            "Stage": name,
+            "Status": "executed" if name in model_pipeline.executed else "cached",
+            "Last run (ms)": model_pipeline.timings.get(name, 0.0) * 1000,
+        }
+        for name in model_pipeline.stages
+    ]
+    st.dataframe(
+        pd.DataFrame(stage_rows).style.format({"Last run (ms)": "{:,.2f}"}),
+        use_container_width=True
+    )
+    st.caption(
+        f"Engine result: {engine_result.nbytes / 1024:,.1f} KB · "
+        f"Session artifacts: {artifacts.total_bytes / 1024 ** 2:,.2f} MB "
+        f"of {SESSION_MEMORY_BUDGET_MB:,.0f} MB budget"
+        + (f" · Evicted: {', '.join(artifacts.evicted[-5:])}" if artifacts.evicted else "")
+    )
 
 
+# ------------------------------------------------------
+# PROFILER CAPTURES
+# ------------------------------------------------------
+# The rerun capture ends here, before its own report is rendered
+if rerun_capture is not None:
+    rerun_capture.stop(current_inputs_hash())
+    st.session_state.pop("rerun_capture", None)
+
+with st.expander("🔬 Profiler", expanded=False):
+    st.radio(
+        "Capture", PROFILER_MODES, horizontal=True, key="profiler_mode",
+        format_func={"off": "Off", "operations": "Operations",
+                     "reruns": "Operations + every rerun"}.get,
+    )
+    st.caption(
+        "cProfile captures of Run Simulation, the PDF report and the Excel export (and of every "
+        "full rerun when selected), written to "
+        f"`{PROFILER_DIR}` with the hash of the inputs they ran with. "
+        "Set PHAROS_PROFILER=operations|reruns to start sessions with capture on."
+    )
+    # The reports below read capture files, so they only render while capture is on
+    captures = list_captures() if profiler_mode != "off" else None
+    if captures is None:
+        st.caption("Capture is off.")
+    elif captures.empty:
+        st.caption("No captures yet.")
+    else:
+        capture_labels = {
+            row.File: f"{row.Captured} · {row.Operation} · {row.Input_Hash} · {row.Wall_s:.3f} s"
+            for row in captures.itertuples()
+        }
+        capture_file = st.selectbox("Saved capture", list(capture_labels), format_func=capture_labels.get,
+                                    key="profiler_capture")
+        capture_path = os.path.join(PROFILER_DIR, capture_file)
+        flame = flame_rects(capture_path)
+        if not flame.empty:
+            flame["Label"] = np.where(
+                flame["Seconds"] >= flame["End_s"].max() * 0.08,
+                flame["Function"].str.slice(0, 40), ""
+            )
+            flame_base = alt.Chart(flame).encode(
+                x=alt.X("Start_s:Q", title="Seconds"),
+                x2="End_s:Q",
+                y=alt.Y("Depth:O", title="Call depth"),
+            )
+            st.altair_chart(
+                flame_base.mark_rect(stroke="white").encode(
+                    color=alt.Color("Seconds:Q", scale=alt.Scale(scheme="orangered"), legend=None),
+                    tooltip=["Function", alt.Tooltip("Seconds:Q", format=",.4f")],
+                ) + flame_base.mark_text(align="left", dx=3, fontSize=10).encode(text="Label:N"),
+                use_container_width=True,
+            )
+            st.caption("Icicle flamegraph: each bar is a call path, its width the time spent under it.")
+        sort_by = st.radio("Sort by", ["Cumulative_s", "Own_s"], horizontal=True, key="profiler_sort")
+        top = top_functions(capture_path, n=40, sort=sort_by)
+        st.dataframe(top, column_config=number_columns(top, default="%.4f", formats={"Calls": "%d"}),
+                     use_container_width=True, hide_index=True)
+        def capture_bytes(path=capture_path):
+            with open(path, "rb") as f:
+                return f.read()
+
+        st.download_button("Download capture (.prof, for snakeviz / pstats)", capture_bytes,
+                           file_name=capture_file, key="profiler_download")
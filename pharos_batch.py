@@ -0,0 +1,713 @@
+"""
+Scenario-axis batched Pharos engine.
+
+`run_batch_engine` evaluates S parameter sets at once: every input is an
+array of shape (S, 1) and every quarterly output has shape (S, Q), where Q
+is the longest horizon in the batch (shorter scenarios are zero-padded).
+Everything that is independent per quarter is a plain array expression;
+the recurrences (debt amortization, the Ley 1715 benefit pool and the
+cumulative tax) are stepped quarter by quarter across the whole batch at
+once. Quarters are stored down the rows and scenarios across the columns,
+so each step touches one contiguous row.
+
+`run_batch` adds the vectorized exit and KPIs (batched IRR/NPV/MOIC).
+
+This is the building block for sweeps, Monte Carlo and portfolio
+revaluation; `BatchResult.scenario(i)` gives back the single-run
+`EngineResult` for any member of the batch.
+"""
+import numpy as np
+import numpy_financial as npf
+
+from pharos_engine import (
+    ACTUAL_PARAMS,
+    CASH_COLUMNS,
+    DEFAULT_CURRENCY_MODE,
+    DISPLAY_INPUTS,
+    ENGINE_INPUTS,
+    EXIT_INPUTS,
+    KPI_INPUTS,
+    EngineResult,
+    cfads,
+    dscr_debt_schedule,
+)
+
+
+# ------------------------------------------------------
+# BATCH PARAMETERS
+# ------------------------------------------------------
+INT_PARAMS = (
+    "start_year", "start_q_num", "ppa_term_years", "construction_quarters",
+    "depreciation_years", "capex_benefit_years", "loan_tenor_years",
+    "grace_period_quarters", "exit_year",
+)
+BOOL_PARAMS = ("enable_ica", "enable_capex_benefit", "enable_debt", "debt_sculpting")
+OBJECT_PARAMS = ("exit_method", "debt_sizing")
+
+# Per-quarter principal schedule: optional (S, Q) array, NaN rows = level annuity
+SCHEDULE_PARAM = "debt_principal_schedule"
+# Per-quarter energy from hourly profiles: optional (S, Q) arrays, NaN rows = flat generation
+ENERGY_SCHEDULE_PARAMS = ("generation_schedule", "billed_schedule")
+# Per-quarter actuals: optional (S, Q) arrays, NaN = forecast
+SCHEDULE_PARAMS = (SCHEDULE_PARAM,) + ENERGY_SCHEDULE_PARAMS + ACTUAL_PARAMS
+
+# Model parameters carried by a batch as (S, 1) columns (currency_mode stays a scalar argument)
+BATCH_INPUTS = tuple(
+    key for key in dict.fromkeys(ENGINE_INPUTS + EXIT_INPUTS + DISPLAY_INPUTS + KPI_INPUTS)
+    if key != "currency_mode" and key not in SCHEDULE_PARAMS
+)
+BATCH_ENGINE_INPUTS = tuple(key for key in ENGINE_INPUTS if key not in SCHEDULE_PARAMS)
+
+
+def _column(values, key):
+    if key in OBJECT_PARAMS:
+        return np.asarray(values, dtype=object).reshape(-1, 1)
+    dtype = np.int64 if key in INT_PARAMS else bool if key in BOOL_PARAMS else np.float64
+    return np.asarray(values, dtype=dtype).reshape(-1, 1)
+
+
+def _schedules(schedules):
+    """(S, Q) schedule array from per-scenario sequences (None -> NaN row or cell)."""
+    if all(s is None for s in schedules):
+        return None
+    width = max(len(s) for s in schedules if s is not None)
+    out = np.full((len(schedules), width), np.nan)
+    for i, s in enumerate(schedules):
+        if s is not None:
+            out[i, :len(s)] = np.array(s, dtype=np.float64)
+    return out
+
+
+def stack_params(params_list):
+    """Stack model parameter dicts (see model_params_from_inputs) into (S, 1) arrays."""
+    bp = {
+        key: _column([p[key] for p in params_list], key)
+        for key in BATCH_INPUTS
+    }
+    for key in SCHEDULE_PARAMS:
+        schedule = _schedules([p.get(key) for p in params_list])
+        if schedule is not None:
+            bp[key] = schedule
+    return bp
+
+
+def broadcast_params(params, **overrides):
+    """
+    Batch from one base parameter dict with some parameters varied.
+
+    Each override is a 1-D sequence of length S (all the same length);
+    every other parameter is repeated S times.
+    """
+    sizes = {len(np.atleast_1d(v)) for v in overrides.values()}
+    if len(sizes) > 1:
+        raise ValueError(f"Overrides must share one length, got {sorted(sizes)}")
+    n = sizes.pop() if sizes else 1
+    batch = {}
+    for key in BATCH_INPUTS:
+        values = overrides[key] if key in overrides else [params[key]] * n
+        batch[key] = _column(values, key)
+    for key in SCHEDULE_PARAMS:
+        if params.get(key) is not None:
+            batch[key] = _schedules([params[key]] * n)
+    return batch
+
+
+def batch_size(bp):
+    return len(bp["capex_million_cop"])
+
+
+def scenario_params(bp, i, currency_mode=DEFAULT_CURRENCY_MODE):
+    """Plain parameter dict of batch member `i`."""
+    p = {key: bp[key][i, 0] if key in OBJECT_PARAMS else bp[key][i, 0].item()
+         for key in BATCH_INPUTS}
+    p["currency_mode"] = currency_mode
+    n = p["construction_quarters"] + p["ppa_term_years"] * 4
+    for key in SCHEDULE_PARAMS:
+        schedule = bp.get(key)
+        if schedule is not None and not np.isnan(schedule[i]).all():
+            values = schedule[i, :n].tolist()
+            if key in ACTUAL_PARAMS:
+                values = [None if np.isnan(v) else v for v in values]
+            p[key] = tuple(values)
+    return p
+
+
+def size_debt_batch(bp, tol=1e-9, max_iter=50):
+    """
+    Batched size_debt_dscr: sizes every `debt_sizing == "Target DSCR"`
+    scenario of `bp` (all iterated together through the batched engine)
+    and returns a copy of `bp` with their debt ratios and principal
+    schedules set and their sizing switched to "Debt Ratio".
+    """
+    dscr = (bp["debt_sizing"][:, 0] == "Target DSCR") & bp["enable_debt"][:, 0]
+    bp = dict(bp)
+    bp["debt_sizing"] = np.full_like(bp["debt_sizing"], "Debt Ratio")
+    if not dscr.any():
+        return bp
+
+    idx = np.flatnonzero(dscr)
+    sub = {key: value[idx] for key, value in bp.items()}
+    sub.pop(SCHEDULE_PARAM, None)
+    for key in ACTUAL_PARAMS:  # debt is sized on the budget
+        sub.pop(key, None)
+    capex = sub["capex_million_cop"]
+    cap = capex * sub["debt_ratio"]
+    grace = sub["grace_period_quarters"]
+    tenor_q = sub["loan_tenor_years"] * 4
+    n_quarters = sub["construction_quarters"] + sub["ppa_term_years"] * 4
+    q = np.arange(1, int(n_quarters.max()) + 1)[None, :]
+    repay = (q > grace) & (q <= tenor_q) & (q <= n_quarters)
+    sculpting = sub["debt_sculpting"]
+    safe_capex = np.where(capex != 0, capex, 1.0)
+
+    debt = cap[:, 0].copy()
+    schedule = None
+    for _ in range(max_iter):
+        sub["debt_ratio"] = np.where(capex != 0, debt[:, None] / safe_capex, 0.0)
+        if schedule is not None:
+            sub[SCHEDULE_PARAM] = schedule
+        batch = run_batch_engine(sub)
+        new_debt, new_schedule = dscr_debt_schedule(
+            cfads(batch), repay, sub["interest_rate_annual"] / 4,
+            tenor_q - grace, sub["target_dscr"], sculpting, cap
+        )
+        converged = np.abs(new_debt - debt) <= tol * np.maximum(1.0, debt)
+        # Sculpted schedules must be stable too (they move interest and taxes)
+        if schedule is None:
+            converged &= ~sculpting[:, 0]
+        else:
+            change = np.nan_to_num(np.abs(new_schedule - schedule)).max(axis=1)
+            converged &= change <= tol * np.maximum(1.0, debt)
+        debt, schedule = new_debt, new_schedule
+        if converged.all():
+            break
+
+    bp["debt_ratio"] = bp["debt_ratio"].copy()
+    bp["debt_ratio"][idx] = np.where(capex != 0, debt[:, None] / safe_capex, 0.0)
+    if sculpting.any():
+        full = bp.get(SCHEDULE_PARAM)
+        width = max(schedule.shape[1], 0 if full is None else full.shape[1])
+        merged = np.full((batch_size(bp), width), np.nan)
+        if full is not None:
+            merged[:, :full.shape[1]] = full
+        merged[idx] = np.nan
+        merged[idx, :schedule.shape[1]] = schedule
+        bp[SCHEDULE_PARAM] = merged
+    return bp
+
+
+# ------------------------------------------------------
+# BATCH RESULT
+# ------------------------------------------------------
+class BatchResult:
+    """
+    Engine output for S scenarios.
+
+    Storage is time-major: `cash` is (len(CASH_COLUMNS), Q, S) float64 and
+    `index` is (len(INDEX_COLUMNS), Q, S) int32, so the quarter-by-quarter
+    recurrences and cumulative sums run over contiguous rows of scenarios.
+    `batch[col]` returns the (S, Q) view. Per-scenario scalars are (S,)
+    arrays; quarters past a scenario's horizon (`n_quarters[i]`) are zero.
+    """
+
+    __slots__ = (
+        "params", "index", "cash", "n_quarters",
+        "structuring_fee", "total_debt_principal", "quarterly_debt_pmt",
+        "sga_const_cost_cop", "equity_investment_levered_cop",
+        "equity_investment_unlevered_cop", "capex_benefit_total",
+    )
+
+    _CASH_ROWS = EngineResult._CASH_ROWS
+    _INDEX_ROWS = EngineResult._INDEX_ROWS
+    SCALARS = (
+        "structuring_fee", "total_debt_principal", "quarterly_debt_pmt",
+        "sga_const_cost_cop", "equity_investment_levered_cop",
+        "equity_investment_unlevered_cop", "capex_benefit_total",
+    )
+
+    def __init__(self, params, index, cash, n_quarters, **scalars):
+        self.params = params
+        self.index = index
+        self.cash = cash
+        self.n_quarters = n_quarters
+        for name, value in scalars.items():
+            setattr(self, name, np.asarray(value, dtype=np.float64).reshape(-1))
+
+    def __len__(self):
+        return self.cash.shape[2]
+
+    @property
+    def n_periods(self):
+        return self.cash.shape[1]
+
+    @property
+    def nbytes(self):
+        return self.index.nbytes + self.cash.nbytes
+
+    def __getitem__(self, col):
+        if col in self._CASH_ROWS:
+            return self.cash[self._CASH_ROWS[col]].T
+        return self.index[self._INDEX_ROWS[col]].T
+
+    def scenario(self, i, currency_mode=DEFAULT_CURRENCY_MODE):
+        """Single-scenario EngineResult (trimmed to its own horizon)."""
+        n = int(self.n_quarters[i])
+        return EngineResult(
+            scenario_params(self.params, i, currency_mode),
+            index=self.index[:, :n, i],
+            cash=self.cash[:, :n, i],
+            **{name: getattr(self, name)[i].item() for name in self.SCALARS}
+        )
+
+
+# ------------------------------------------------------
+# BATCHED ENGINE
+# ------------------------------------------------------
+def _quarter_rows(schedule, n_periods):
+    """(S, W) schedule -> (Q, S) quarter-major array, NaN-padded or cut to Q quarters."""
+    out = np.full((n_periods, len(schedule)), np.nan)
+    width = min(schedule.shape[1], n_periods)
+    out[:width] = schedule[:, :width].T
+    return out
+
+
+def run_batch_engine(bp):
+    """
+    Quarterly engine over a batch of parameter sets (all figures in M COP).
+
+    `bp` maps every name in ENGINE_INPUTS to an array of shape (S, 1)
+    (see stack_params / broadcast_params). Mirrors run_quarterly_engine.
+    Internally quarters run down the rows and scenarios across the columns
+    (parameters are reshaped to (1, S)). Target-DSCR scenarios are sized
+    first (size_debt_batch).
+    """
+    if (bp["debt_sizing"] == "Target DSCR").any():
+        bp = size_debt_batch(bp)
+    p = {key: np.asarray(bp[key]).reshape(1, -1) for key in BATCH_ENGINE_INPUTS}
+    start_year = p["start_year"]
+    start_q_num = p["start_q_num"]
+    current_tariff = p["current_tariff"]
+    discount_rate = p["discount_rate"]
+    pcp_escalator_annual = p["pcp_escalator_annual"]
+    initial_gen_mwh_annual = p["initial_gen_mwh_annual"]
+    degradation_annual = p["degradation_annual"]
+    construction_quarters = p["construction_quarters"]
+    capex_million_cop = p["capex_million_cop"]
+    opex_million_cop_annual = p["opex_million_cop_annual"]
+    opex_inflation_annual = p["opex_inflation_annual"]
+    sga_percent = p["sga_percent"]
+    sga_const_pct = p["sga_const_pct"]
+    tax_rate = p["tax_rate"]
+    depreciation_years = p["depreciation_years"]
+    ftt_rate = p["ftt_rate"]
+    enable_ica = p["enable_ica"]
+    ica_rate = p["ica_rate"]
+    enable_capex_benefit = p["enable_capex_benefit"]
+    capex_benefit_years = p["capex_benefit_years"]
+    capex_benefit_capex_pct = p["capex_benefit_capex_pct"]
+    enable_debt = p["enable_debt"]
+    debt_ratio = p["debt_ratio"]
+    interest_rate_annual = p["interest_rate_annual"]
+    loan_tenor_years = p["loan_tenor_years"]
+    structuring_fee_pct = p["structuring_fee_pct"]
+    grace_period_quarters = p["grace_period_quarters"]
+
+    n_scen = capex_million_cop.shape[1]
+    full_quarters = construction_quarters + p["ppa_term_years"] * 4
+    n_periods = int(full_quarters.max())
+    q = np.arange(1, n_periods + 1)[:, None]
+    live = q <= full_quarters
+
+    cash = np.empty((len(CASH_COLUMNS), n_periods, n_scen))
+    (gen_quarterly, rev, opex, gross, sga, ica_cost, ebitda, dep, interest,
+     tax_levered, ftt_cost, ufcf, lfcf,
+     opening_debt, principal, debt_balance, book_val) = cash
+
+    # Financing
+    total_debt_principal = np.where(enable_debt, capex_million_cop * debt_ratio, 0.0)
+    structuring_fee = np.where(enable_debt, total_debt_principal * structuring_fee_pct, 0.0)
+    interest_rate_quarterly = np.where(enable_debt, interest_rate_annual / 4, 0.0)
+    amort_quarters = loan_tenor_years * 4 - grace_period_quarters
+    quarterly_debt_pmt = np.where(
+        enable_debt & (amort_quarters > 0),
+        -npf.pmt(interest_rate_quarterly, np.maximum(amort_quarters, 1), total_debt_principal),
+        0.0
+    )
+
+    sga_const_cost_cop = capex_million_cop * sga_const_pct
+    total_capex_cost = capex_million_cop + structuring_fee + sga_const_cost_cop
+    equity_investment_levered_cop = total_capex_cost - total_debt_principal
+    equity_investment_unlevered_cop = total_capex_cost
+
+    # CAPEX tax benefit pool (Ley 1715)
+    benefit_on = enable_capex_benefit & (capex_benefit_years > 0)
+    capex_benefit_total = np.where(
+        benefit_on, 0.5 * (capex_million_cop * capex_benefit_capex_pct), 0.0
+    )
+
+    # Timeline: calendar-year conditions become per-scenario quarter thresholds
+    q_offset = start_q_num - 1
+    construction = q <= construction_quarters
+    operation = live & ~construction
+    # Ley 1715 window: calendar years [op start + 1, op start + 1 + years)
+    op_start_year_offset = (q_offset + construction_quarters) // 4
+    benefit_q_from = 4 * (op_start_year_offset + 1) - q_offset + 1
+    benefit_q_to = np.where(benefit_on, benefit_q_from + 4 * capex_benefit_years, 0)
+
+    # Operations (construction quarters are zeroed through the `operation` mask)
+    t_op = (q - (construction_quarters + 1)) * 0.25
+    esc_factor = np.exp(t_op * np.log(1 + pcp_escalator_annual))
+    deg_factor = np.exp(t_op * np.log(1 - degradation_annual))
+    opex_fac = np.exp(t_op * np.log(1 + opex_inflation_annual))
+
+    p_price = current_tariff * (1 - discount_rate) * esc_factor
+    np.multiply((initial_gen_mwh_annual / 4) * deg_factor, operation, out=gen_quarterly)
+    billed_mwh = gen_quarterly
+    if bp.get("generation_schedule") is not None:
+        # Scenarios with hourly-profile energy replace the flat generation
+        generation_q, billed_q = (_quarter_rows(bp[key], n_periods) for key in ENERGY_SCHEDULE_PARAMS)
+        profiled = ~np.isnan(generation_q)
+        billed_mwh = np.where(profiled, billed_q * operation, gen_quarterly)
+        np.copyto(gen_quarterly, generation_q * operation, where=profiled)
+    actual_generation, actual_revenue, actual_opex = (
+        None if bp.get(key) is None else _quarter_rows(bp[key], n_periods) for key in ACTUAL_PARAMS
+    )
+    if actual_generation is not None:
+        # Actual generation keeps the budget's billed share
+        has_actual = ~np.isnan(actual_generation) & operation
+        with np.errstate(divide="ignore", invalid="ignore"):
+            billed_actual = np.where(
+                gen_quarterly != 0, billed_mwh * actual_generation / gen_quarterly, actual_generation
+            )
+        billed_mwh = np.where(has_actual, billed_actual, billed_mwh)
+        np.copyto(gen_quarterly, actual_generation, where=has_actual)
+    np.divide(billed_mwh * p_price, 1000, out=rev)
+    np.multiply((opex_million_cop_annual / 4) * opex_fac, operation, out=opex)
+    if actual_revenue is not None:
+        np.copyto(rev, actual_revenue, where=~np.isnan(actual_revenue) & operation)
+    if actual_opex is not None:
+        np.copyto(opex, actual_opex, where=~np.isnan(actual_opex) & operation)
+    np.subtract(rev, opex, out=gross)
+    np.multiply(gross, sga_percent, out=sga)
+    np.multiply(rev * ica_rate, enable_ica, out=ica_cost)
+    np.subtract(gross - sga, ica_cost, out=ebitda)
+    dep_q = np.divide(
+        capex_million_cop, depreciation_years,
+        out=np.zeros_like(capex_million_cop), where=depreciation_years > 0
+    ) / 4
+    dep_quarters = np.clip(q - construction_quarters, 0, 4 * depreciation_years)
+    np.multiply(dep_q, operation & (q <= construction_quarters + 4 * depreciation_years), out=dep)
+    np.maximum(0, capex_million_cop - dep_q * dep_quarters, out=book_val)
+
+    # Construction outflows
+    in_build = live & construction
+    cq_safe = np.maximum(construction_quarters, 1)
+    capex_unlevered = (capex_million_cop / cq_safe) * in_build
+    capex_levered = (
+        equity_investment_levered_cop / cq_safe + sga_const_cost_cop / cq_safe
+    ) * in_build
+
+    # Recurrences, stepped quarter by quarter across the batch: debt
+    # amortization, the Ley 1715 pool (50% of the incremental positive tax
+    # base, used in order until exhausted) and cumulative taxes (tax paid to
+    # date is the running max of tax on the positive cumulative base)
+    any_debt = bool(enable_debt.any())
+    any_benefit = bool(benefit_on.any())
+    tax_rate_row = tax_rate[0]
+    base_unlev_pre = ebitda - dep
+    tax_unlevered = np.empty((n_periods, n_scen))
+
+    if any_debt:
+        amortizing = live & (q > grace_period_quarters)
+        balance = total_debt_principal[0].copy()
+        rate_q = interest_rate_quarterly[0]
+        pmt_q = quarterly_debt_pmt[0]
+        schedule = bp.get(SCHEDULE_PARAM)
+        if schedule is not None:
+            # (Q, S) principal per quarter; NaN keeps the level annuity
+            schedule_q = _quarter_rows(schedule, n_periods)
+            scheduled = ~np.isnan(schedule_q)
+    else:
+        interest[...] = principal[...] = opening_debt[...] = 0.0
+    if any_benefit:
+        in_window = (q >= benefit_q_from) & (q < benefit_q_to)
+        remaining = capex_benefit_total[0].copy()
+        cum_base_lev_pre = np.zeros(n_scen)
+        positive_prev = np.zeros(n_scen)
+        benefit = np.empty(n_scen)
+    cum_base_unlev = np.zeros(n_scen)
+    cum_base_lev = np.zeros(n_scen)
+    paid_unlev = np.zeros(n_scen)
+    paid_lev = np.zeros(n_scen)
+    theoretical = np.empty(n_scen)
+
+    for k in range(n_periods):
+        if any_debt:
+            opening_debt[k] = balance
+            has_debt = balance > 0
+            has_debt &= live[k]
+            np.multiply(balance, rate_q, out=interest[k])
+            interest[k] *= has_debt
+            np.subtract(pmt_q, interest[k], out=principal[k])
+            if schedule is not None:
+                np.copyto(principal[k], schedule_q[k], where=scheduled[k])
+            np.minimum(principal[k], balance, out=principal[k])
+            principal[k] *= has_debt & amortizing[k]
+            balance -= principal[k]
+            base_lev_k = ebitda[k] - interest[k] - dep[k]
+        else:
+            base_lev_k = base_unlev_pre[k]
+
+        if any_benefit:
+            cum_base_lev_pre += base_lev_k
+            positive = np.maximum(cum_base_lev_pre, 0)
+            np.subtract(positive, positive_prev, out=benefit)
+            positive_prev = positive
+            np.maximum(benefit, 0, out=benefit)
+            benefit *= 0.5
+            np.minimum(remaining, benefit, out=benefit)
+            benefit *= in_window[k]
+            remaining -= benefit
+            cum_base_unlev += base_unlev_pre[k] - benefit
+            if any_debt:
+                cum_base_lev += base_lev_k - benefit
+        else:
+            cum_base_unlev += base_unlev_pre[k]
+            if any_debt:
+                cum_base_lev += base_lev_k
+
+        np.maximum(cum_base_unlev, 0, out=theoretical)
+        theoretical *= tax_rate_row
+        np.maximum(paid_unlev, theoretical, out=theoretical)
+        np.subtract(theoretical, paid_unlev, out=tax_unlevered[k])
+        paid_unlev, theoretical = theoretical, paid_unlev
+        if any_debt:
+            np.maximum(cum_base_lev, 0, out=theoretical)
+            theoretical *= tax_rate_row
+            np.maximum(paid_lev, theoretical, out=theoretical)
+            np.subtract(theoretical, paid_lev, out=tax_levered[k])
+            paid_lev, theoretical = theoretical, paid_lev
+
+    if any_debt:
+        np.subtract(opening_debt, principal, out=debt_balance)
+        np.multiply(opening_debt, live, out=opening_debt)
+        np.multiply(debt_balance, live, out=debt_balance)
+    else:
+        debt_balance[...] = 0.0
+        tax_levered[...] = tax_unlevered
+
+    outflows = opex + sga
+    np.multiply(capex_unlevered + outflows + tax_unlevered, ftt_rate, out=ftt_cost)
+    if any_debt:
+        levered_disbursements = capex_levered + outflows + principal + interest + tax_levered
+        np.copyto(ftt_cost, levered_disbursements * ftt_rate, where=enable_debt)
+
+    np.multiply(book_val, live, out=book_val)
+
+    np.subtract(ebitda - tax_unlevered - capex_unlevered, ftt_cost, out=ufcf)
+    lfcf[...] = ufcf
+    if any_debt:
+        np.copyto(
+            lfcf,
+            ebitda - tax_levered - interest - principal - capex_levered - ftt_cost,
+            where=enable_debt
+        )
+
+    index = np.empty((3, n_periods, n_scen), dtype=np.int32)
+    year_offsets = (np.arange(n_periods)[:, None] + np.arange(4)[None, :]) // 4
+    index[0] = q
+    index[1] = (q - 1) // 4 + 1
+    index[2] = start_year + year_offsets[:, q_offset[0]]
+    np.multiply(index, live, out=index)
+
+    return BatchResult(
+        bp, index, cash, full_quarters[0],
+        structuring_fee=structuring_fee,
+        total_debt_principal=total_debt_principal,
+        quarterly_debt_pmt=quarterly_debt_pmt,
+        sga_const_cost_cop=sga_const_cost_cop,
+        equity_investment_levered_cop=equity_investment_levered_cop,
+        equity_investment_unlevered_cop=equity_investment_unlevered_cop,
+        capex_benefit_total=capex_benefit_total,
+    )
+
+
+# ------------------------------------------------------
+# BATCHED EXIT & KPIs
+# ------------------------------------------------------
+def _at(values, idx):
+    """values[s, idx[s]] for an (S, Q) array and (S,) indices."""
+    return np.take_along_axis(values, idx.reshape(-1, 1), axis=1)[:, 0]
+
+
+def batch_exit(bp, batch):
+    """Vectorized compute_exit: (S,) arrays of exit values and net inflows (M COP)."""
+    construction_quarters = bp["construction_quarters"][:, 0]
+    exit_year = bp["exit_year"][:, 0]
+    fixed = bp["exit_method"][:, 0] == "Fixed Asset Value"
+    n_periods = batch.n_periods
+
+    # Trailing four quarters of EBITDA up to the exit quarter (truncated at the horizon)
+    cum_ebitda = np.concatenate(
+        [np.zeros((len(batch), 1)), np.cumsum(batch["EBITDA_M_COP"], axis=1)], axis=1
+    )
+    exit_q_idx = construction_quarters + exit_year * 4 - 1
+    start_idx = np.maximum(0, exit_q_idx - 3)
+    end = np.clip(exit_q_idx + 1, 0, n_periods)
+    start = np.clip(start_idx, 0, n_periods)
+    annual_ebitda = np.where(end > start, _at(cum_ebitda, end) - _at(cum_ebitda, start), 0.0)
+
+    final_exit_val_cop = np.where(
+        fixed, bp["exit_value_cop"][:, 0], annual_ebitda * bp["exit_multiple"][:, 0]
+    )
+    dash_exit_q = np.minimum(construction_quarters + exit_year * 4, batch.n_quarters)
+    book_v_final = _at(batch["Book_Value_M_COP"], dash_exit_q - 1)
+    debt_b_final = _at(batch["Debt_Balance_M_COP"], dash_exit_q - 1)
+    gain = final_exit_val_cop - book_v_final
+    cg_tax = np.where(gain > 0, gain * bp["cap_gains_rate"][:, 0], 0.0)
+
+    return {
+        "final_exit_val_cop": final_exit_val_cop,
+        "dash_exit_q": dash_exit_q,
+        "book_v_final": book_v_final,
+        "debt_b_final": debt_b_final,
+        "cg_tax": cg_tax,
+        "exit_inflow_unlevered_cop": final_exit_val_cop - cg_tax,
+        "exit_inflow_levered_cop": final_exit_val_cop - debt_b_final - cg_tax,
+    }
+
+
+def display_factors(bp, n_periods, currency_mode):
+    """(S, Q) M COP -> display-currency factors (1 for COP, 1000 / FX path for USD)."""
+    if "USD" not in currency_mode:
+        return np.ones((batch_size(bp), n_periods))
+    ratio = (1 + bp["utility_inflation_annual"]) / (1 + bp["us_inflation_annual"])
+    fx = bp["fx_rate_current"] * ratio ** (np.arange(n_periods)[None, :] / 4)
+    return 1000 / fx
+
+
+def dashboard_flows(bp, batch, exit_info, currency_mode=DEFAULT_CURRENCY_MODE):
+    """
+    (S, Q) UFCF/LFCF in display currency up to each exit quarter, with the
+    exit inflows in the exit quarter and zeros after it.
+    """
+    n_periods = batch.n_periods
+    factor = display_factors(bp, n_periods, currency_mode)
+    dash_q = exit_info["dash_exit_q"].reshape(-1, 1)
+    t = np.arange(n_periods)[None, :]
+    at_exit = t == dash_q - 1
+    before = t < dash_q
+    ufcf = np.where(before, batch["UFCF_M_COP"], 0.0)
+    lfcf = np.where(before, batch["LFCF_M_COP"], 0.0)
+    ufcf = (ufcf + at_exit * exit_info["exit_inflow_unlevered_cop"].reshape(-1, 1)) * factor
+    lfcf = (lfcf + at_exit * exit_info["exit_inflow_levered_cop"].reshape(-1, 1)) * factor
+    return ufcf, lfcf
+
+
+def batch_npv(rate, flows):
+    """npf.npv(rate, [0] + flows) per row: flows discounted from t = 1."""
+    rate = np.asarray(rate, dtype=np.float64).reshape(-1, 1)
+    t = np.arange(1, flows.shape[1] + 1)[None, :]
+    return (flows / (1 + rate) ** t).sum(axis=1)
+
+
+# Quarterly rates scanned for sign changes before Newton refinement
+IRR_SCAN_RATES = np.unique(np.concatenate([
+    -1 + np.geomspace(0.01, 1, 120),
+    np.geomspace(1e-4, 50, 160),
+    [0.0],
+]))
+
+
+def batch_irr(flows, tol=1e-12, max_iter=100):
+    """
+    Periodic IRR per row of `flows` (S, N).
+
+    NPV is evaluated on IRR_SCAN_RATES (one matrix product for the whole
+    batch); like npf.irr, the root closest to zero is chosen when there are
+    several. That bracket is then refined by Newton steps, falling back to
+    bisection whenever a step leaves the bracket. Rows without a root in
+    the scanned range return NaN.
+    """
+    flows = np.asarray(flows, dtype=np.float64)
+    n_rows = flows.shape[0]
+    t = np.arange(flows.shape[1])
+
+    grid = IRR_SCAN_RATES
+    npv_grid = flows @ ((1 + grid[None, :]) ** -t[:, None])
+    sign = np.sign(npv_grid)
+    crossing = sign[:, :-1] * sign[:, 1:] <= 0
+    # Distance to zero of each bracket's interpolated root; pick the closest one per row
+    f_a, f_b = npv_grid[:, :-1], npv_grid[:, 1:]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        frac = np.where(f_a == f_b, 0.0, f_a / (f_a - f_b))
+    dist = np.abs(grid[None, :-1] + np.clip(frac, 0.0, 1.0) * np.diff(grid)[None, :])
+    dist = np.where(crossing, dist, np.inf)
+    k = dist.argmin(axis=1)
+    rows = np.arange(n_rows)
+    valid = np.isfinite(dist[rows, k])
+
+    lo = grid[k].copy()
+    hi = grid[k + 1].copy()
+    f_lo = npv_grid[rows, k]
+    rate = np.where(valid, 0.5 * (lo + hi), np.nan)
+    rate = np.where(valid & (f_lo == 0), lo, rate)
+    active = valid & (f_lo != 0)
+
+    for _ in range(max_iter):
+        if not active.any():
+            break
+        idx = np.flatnonzero(active)
+        r = rate[idx]
+        disc = (1 + r[:, None]) ** -t[None, :]
+        cf = flows[idx]
+        value = (cf * disc).sum(axis=1)
+        slope = -(cf * t * disc).sum(axis=1) / (1 + r)
+
+        # Shrink the bracket around the root
+        same_as_lo = np.sign(value) == np.sign(f_lo[idx])
+        lo[idx] = np.where(same_as_lo, r, lo[idx])
+        f_lo[idx] = np.where(same_as_lo, value, f_lo[idx])
+        hi[idx] = np.where(same_as_lo, hi[idx], r)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            newton = r - value / slope
+        inside = np.isfinite(newton) & (newton > lo[idx]) & (newton < hi[idx])
+        new_r = np.where(inside, newton, 0.5 * (lo[idx] + hi[idx]))
+        new_r = np.where(value == 0, r, new_r)
+
+        rate[idx] = new_r
+        active[idx] = ~((np.abs(new_r - r) <= tol * np.maximum(1.0, np.abs(r))) | (value == 0))
+    return rate
+
+
+def annualized_irr_pct(q_irr):
+    """Quarterly IRR -> annual % (as get_irr)."""
+    return ((1 + q_irr) ** 4 - 1) * 100
+
+
+def batch_kpis(bp, batch, exit_info, currency_mode=DEFAULT_CURRENCY_MODE):
+    """Vectorized compute_kpis: (S,) arrays of equity, IRRs, MOIC and NPV."""
+    ufcf, lfcf = dashboard_flows(bp, batch, exit_info, currency_mode)
+    if "USD" in currency_mode:
+        inv_conv = 1000 / bp["fx_rate_current"][:, 0]
+    else:
+        inv_conv = np.ones(len(batch))
+    equity_inv_disp = batch.equity_investment_levered_cop * inv_conv
+    with np.errstate(divide="ignore", invalid="ignore"):
+        moic = np.where(equity_inv_disp > 0, lfcf.sum(axis=1) / equity_inv_disp, 0.0)
+    return {
+        "inv_conv": inv_conv,
+        "equity_inv_disp": equity_inv_disp,
+        "irr_unlevered": annualized_irr_pct(batch_irr(ufcf)),
+        "irr_levered": annualized_irr_pct(batch_irr(lfcf)),
+        "moic_levered": moic,
+        "npv_equity": batch_npv(bp["investor_disc_rate"][:, 0] / 4, lfcf),
+    }
+
+
+def run_batch(bp, currency_mode=DEFAULT_CURRENCY_MODE):
+    """Engine, exit and KPIs for a batch: returns (BatchResult, exit dict, KPI dict)."""
+    batch = run_batch_engine(bp)
+    exit_info = batch_exit(bp, batch)
+    return batch, exit_info, batch_kpis(bp, batch, exit_info, currency_mode)
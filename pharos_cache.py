@@ -0,0 +1,236 @@
+"""
+Caching helpers for the Pharos app.
+
+`SessionArtifacts` keeps the large per-session objects (simulation matrices,
+close-match tables, ...) under a byte budget and evicts the least recently
+used ones first, so server memory stays bounded per concurrent session.
+
+`SimulationCache` persists simulation grids to disk (one .npz per input
+hash and grid) so identical runs survive the session and are shared
+across sessions, with the directory kept under a size budget.
+
+`atomic_write` is the all-or-nothing file write used by every on-disk
+store (grids, project file, profiles, actuals, profiler captures).
+"""
+import hashlib
+import json
+import os
+import sys
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+# Per-session budget for evictable artifacts (MB), overridable per deployment
+SESSION_MEMORY_BUDGET_MB = float(os.environ.get("PHAROS_SESSION_MEMORY_MB", "64"))
+
+# On-disk simulation cache location and size budget (MB)
+SIM_CACHE_DIR = os.environ.get("PHAROS_SIM_CACHE_DIR", os.path.join(".pharos_cache", "simulations"))
+SIM_CACHE_BUDGET_MB = float(os.environ.get("PHAROS_SIM_CACHE_MB", "256"))
+
+
+def artifact_nbytes(value):
+    """Approximate in-memory size of an artifact in bytes."""
+    if value is None:
+        return 0
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(artifact_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(artifact_nbytes(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class SessionArtifacts:
+    """
+    LRU store for large session artifacts bounded by `budget_bytes`.
+
+    `put` evicts the least recently used entries until the total fits; the
+    entry being stored is never evicted by its own insertion. Evicted keys
+    are recorded so the UI can explain why something has to be recomputed.
+    """
+
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self._items = OrderedDict()  # key -> (value, nbytes)
+        self.evicted = []
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def total_bytes(self):
+        return sum(size for _, size in self._items.values())
+
+    def get(self, key, default=None):
+        if key not in self._items:
+            return default
+        self._items.move_to_end(key)
+        return self._items[key][0]
+
+    def put(self, key, value):
+        """Store `value` (None removes the key) and evict LRU entries over budget."""
+        self._items.pop(key, None)
+        if value is None:
+            return
+        self._items[key] = (value, artifact_nbytes(value))
+        while self.total_bytes > self.budget_bytes and len(self._items) > 1:
+            old_key = next(iter(self._items))
+            del self._items[old_key]
+            self.evicted.append(old_key)
+
+    def pop(self, key, default=None):
+        item = self._items.pop(key, None)
+        return default if item is None else item[0]
+
+    def clear(self):
+        self._items.clear()
+
+    def summary(self):
+        """Rows of (artifact, size in bytes), most recently used last."""
+        return [(key, size) for key, (_, size) in self._items.items()]
+
+
+# ------------------------------------------------------
+# SIMULATION DISK CACHE
+# ------------------------------------------------------
+def inputs_hash(inputs):
+    """Stable hash of a project input dict (key order independent)."""
+    payload = json.dumps(inputs, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def simulation_key(inputs, years, min_v, max_v, step_v, kind="exit_value"):
+    """Cache key for one simulation grid: input hash + grid definition."""
+    grid = f"{kind}_{int(years[0])}-{int(years[1])}_{min_v:g}-{max_v:g}-{step_v:g}"
+    return f"{inputs_hash(inputs)[:32]}_{grid}"
+
+
+def atomic_write(path, writer):
+    """
+    Write `path` all at once: `writer(tmp_path)` fills a temporary file in
+    the same directory (created if needed), which then replaces `path` via
+    `os.replace`, so readers see the old file or the new one, never a
+    partial one. On any error the temporary file is removed and the error
+    re-raised.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    os.close(fd)
+    try:
+        writer(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class SimulationCache:
+    """
+    Directory of simulation grids stored as uncompressed .npz files.
+
+    Each entry holds the columns of one simulation DataFrame. `get` touches
+    the file's mtime so eviction (oldest mtime first, once the directory
+    exceeds `budget_bytes`) is least-recently-used. Writes go through a
+    temporary file and `os.replace`, so concurrent sessions never read a
+    partial entry (see atomic_write); unreadable entries are treated as
+    misses and removed.
+    """
+
+    def __init__(self, directory=SIM_CACHE_DIR, budget_bytes=SIM_CACHE_BUDGET_MB * 1024 ** 2):
+        self.directory = directory
+        self.budget_bytes = budget_bytes
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def get(self, key):
+        """Cached DataFrame for `key`, or None."""
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                df = pd.DataFrame({col: data[col] for col in data.files})
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError):
+            self._remove(path)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return df
+
+    def put(self, key, df):
+        """Store the numeric columns of `df` under `key`, then enforce the budget."""
+        def write(tmp_path):
+            with open(tmp_path, "wb") as f:
+                np.savez(f, **{col: df[col].to_numpy() for col in df.columns})
+
+        try:
+            atomic_write(self._path(key), write)
+        except OSError:
+            return
+        self.evict()
+
+    def entries(self):
+        """[(path, size, mtime)] of cached grids, oldest first."""
+        if not os.path.isdir(self.directory):
+            return []
+        rows = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".npz"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue
+            rows.append((path, info.st_size, info.st_mtime))
+        return sorted(rows, key=lambda r: r[2])
+
+    @property
+    def total_bytes(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """Remove least recently used grids until the directory fits the budget."""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries[:-1]:
+            if total <= self.budget_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def clear(self):
+        for path, _, _ in self.entries():
+            self._remove(path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,1146 @@
+"""
+Pharos BTM model engine.
+
+Streamlit-free model code: the quarterly cash-flow engine, exit logic,
+display-currency conversion, annual aggregation and KPIs. The steps are
+wired together as a pipeline of stages with declared input dependencies,
+so a change to one input only re-executes the stages downstream of it
+(e.g. moving the exit-year slider does not rerun the quarterly engine).
+"""
+import time
+
+import numpy as np
+import pandas as pd
+import numpy_financial as npf
+
+
+# ------------------------------------------------------
+# INPUTS
+# ------------------------------------------------------
+# Keys we want to persist per project
+PROJECT_INPUT_KEYS = [
+    "project_name", "client_name", "project_loc",
+    "start_year", "start_q_str",
+    "ppa_term", "link_inf", "tariff_val", "inf_val", "disc_val", "esc_val",
+    "gen_val", "cons_val", "deg_val", "profile_on", "export_val",
+    "const_q", "capex_val", "opex_val", "oinf_val", "sga_val", "sga_const_val",
+    "tax_val", "cg_val", "dep_val", "ftt_val", "ica_on", "ica_rate",
+    "debt_on", "dr_val", "int_val", "tenor_val", "fee_val", "grace_val",
+    "debt_sizing", "dscr_target_val", "sculpt_on",
+    "exit_method", "exit_yr", "exit_mult_val", "exit_asset_val", "ke_val",
+    "fx_rate_current",
+    "capex_benefit_on", "capex_benefit_years", "capex_benefit_capex_pct"
+]
+
+# Base case values for the sidebar inputs (as entered, i.e. percentages in %)
+BASE_CASE_INPUTS = {
+    "start_year": 2026,
+    "start_q_str": "Q1",
+    "ppa_term": 10,
+    "link_inf": True,
+    "tariff_val": 881.6,
+    "inf_val": 5.0,
+    "disc_val": 25.0,
+    "esc_val": 3.5,
+    "gen_val": 44.9,
+    "cons_val": 560.8,
+    "deg_val": 0.6,
+    "profile_on": False,
+    "export_val": 0.0,
+    "const_q": 3,
+    "capex_val": 120.0,
+    "opex_val": 7.0,
+    "oinf_val": 5.0,
+    "sga_val": 10.0,
+    "sga_const_val": 2.0,
+    "tax_val": 35.0,
+    "cg_val": 20.0,
+    "dep_val": 5,
+    "ftt_val": 0.4,
+    "ica_on": False,
+    "ica_rate": 2.0,
+    "debt_on": False,
+    "dr_val": 70.0,
+    "int_val": 12.1,
+    "tenor_val": 9,
+    "fee_val": 2.0,
+    "grace_val": 3,
+    "debt_sizing": "Debt Ratio",
+    "dscr_target_val": 1.3,
+    "sculpt_on": False,
+    "exit_method": "EBITDA Multiple",
+    "exit_yr": 4,
+    "exit_mult_val": 5.0,
+    "exit_asset_val": 10.0,
+    "ke_val": 12.0,
+    "fx_rate_current": 4100.0,
+    "capex_benefit_on": False,
+    "capex_benefit_years": 10,
+    "capex_benefit_capex_pct": 100,
+}
+
+DEFAULT_CURRENCY_MODE = "COP (Millions)"
+DEFAULT_US_INFLATION = 0.025
+
+DEBT_SIZING_METHODS = ("Debt Ratio", "Target DSCR")
+
+QUARTER_NUMBERS = {"Q1": 1, "Q2": 2, "Q3": 3, "Q4": 4}
+
+
+def model_params_from_inputs(inputs, currency_mode=DEFAULT_CURRENCY_MODE,
+                             us_inflation_annual=DEFAULT_US_INFLATION):
+    """
+    Convert sidebar inputs (PROJECT_INPUT_KEYS, as entered) into model parameters.
+
+    Mirrors the sidebar: percentages become fractions, disabled sections
+    (debt, ICA, Ley 1715 benefit) are zeroed and the exit method selects
+    which exit value is used. Missing keys fall back to the base case.
+    """
+    def get(key):
+        value = inputs.get(key)
+        return BASE_CASE_INPUTS.get(key) if value is None else value
+
+    utility_inflation_annual = get("inf_val") / 100
+    link_to_inflation = bool(get("link_inf"))
+    enable_ica = bool(get("ica_on"))
+    enable_debt = bool(get("debt_on"))
+    enable_capex_benefit = bool(get("capex_benefit_on"))
+    exit_method = get("exit_method")
+
+    return {
+        # Timeline & revenue
+        "start_year": int(get("start_year")),
+        "start_q_num": QUARTER_NUMBERS[get("start_q_str")],
+        "ppa_term_years": int(get("ppa_term")),
+        "current_tariff": get("tariff_val"),
+        "utility_inflation_annual": utility_inflation_annual,
+        "discount_rate": get("disc_val") / 100,
+        "pcp_escalator_annual": (
+            utility_inflation_annual if link_to_inflation else get("esc_val") / 100
+        ),
+        "initial_gen_mwh_annual": get("gen_val"),
+        "client_consumption": get("cons_val"),
+        "degradation_annual": get("deg_val") / 100,
+        # Hourly profiles (pharos_profiles): exports credited at this share of the PPA price
+        "use_hourly_profile": bool(get("profile_on")),
+        "export_price_ratio": get("export_val") / 100,
+        # Costs
+        "construction_quarters": int(get("const_q")),
+        "capex_million_cop": get("capex_val"),
+        "opex_million_cop_annual": get("opex_val"),
+        "opex_inflation_annual": get("oinf_val") / 100,
+        "sga_percent": get("sga_val") / 100,
+        "sga_const_pct": get("sga_const_val") / 100,
+        # Tax
+        "tax_rate": get("tax_val") / 100,
+        "cap_gains_rate": get("cg_val") / 100,
+        "depreciation_years": int(get("dep_val")),
+        "ftt_rate": get("ftt_val") / 1000,
+        "enable_ica": enable_ica,
+        "ica_rate": get("ica_rate") / 100 if enable_ica else 0.0,
+        "enable_capex_benefit": enable_capex_benefit,
+        "capex_benefit_years": int(get("capex_benefit_years")) if enable_capex_benefit else 0,
+        "capex_benefit_capex_pct": (
+            get("capex_benefit_capex_pct") / 100.0 if enable_capex_benefit else 0.0
+        ),
+        # Financing
+        "enable_debt": enable_debt,
+        "debt_ratio": get("dr_val") / 100 if enable_debt else 0.0,
+        "interest_rate_annual": get("int_val") / 100 if enable_debt else 0.0,
+        "loan_tenor_years": int(get("tenor_val")) if enable_debt else 0,
+        "structuring_fee_pct": get("fee_val") / 100 if enable_debt else 0.0,
+        "grace_period_quarters": int(get("grace_val")) if enable_debt else 0,
+        "debt_sizing": get("debt_sizing") if enable_debt else "Debt Ratio",
+        "target_dscr": float(get("dscr_target_val")),
+        "debt_sculpting": bool(get("sculpt_on")) if enable_debt else False,
+        # Scenario / exit
+        "exit_method": exit_method,
+        "exit_year": int(get("exit_yr")),
+        "exit_value_cop": get("exit_asset_val") if exit_method == "Fixed Asset Value" else 0,
+        "exit_multiple": get("exit_mult_val") if exit_method != "Fixed Asset Value" else 0,
+        "investor_disc_rate": get("ke_val") / 100,
+        # Currency & FX
+        "fx_rate_current": get("fx_rate_current"),
+        "us_inflation_annual": us_inflation_annual,
+        "currency_mode": currency_mode,
+    }
+
+
+# ------------------------------------------------------
+# ENGINE RESULT
+# ------------------------------------------------------
+INDEX_COLUMNS = ["Quarter", "Global_Year", "Calendar_Year"]
+CASH_COLUMNS = [
+    "Generation_MWh",
+    "Revenue_M_COP", "OPEX_M_COP", "Gross_M_COP", "SGA_M_COP", "ICA_M_COP",
+    "EBITDA_M_COP", "Depreciation_M_COP", "Interest_M_COP", "Tax_M_COP",
+    "FTT_M_COP", "UFCF_M_COP", "LFCF_M_COP",
+    "Opening_Debt_M_COP", "Principal_M_COP", "Debt_Balance_M_COP", "Book_Value_M_COP",
+]
+DIAGNOSTIC_COLUMNS = [
+    "Tax_Base_Unlev_M_COP",
+    "Tax_Base_Lev_PreBenefit_M_COP",
+    "Tax_Base_Lev_M_COP",
+    "Tax_Base_Unlev_Cum_M_COP",
+    "Tax_Base_Lev_Cum_M_COP",
+    "Tax_Unlev_Cum_M_COP",
+    "Tax_Lev_Cum_M_COP",
+    "Capex_Tax_Benefit_M_COP",
+]
+# Quarterly model column order (as exported)
+FULL_COLUMNS = INDEX_COLUMNS + CASH_COLUMNS + DIAGNOSTIC_COLUMNS
+
+
+class EngineResult:
+    """
+    Compact engine output.
+
+    Cash-flow rows live in one contiguous float64 block (IRR/NPV inputs keep
+    full precision), the period index in int32 and the tax-base diagnostics
+    in float32. Diagnostics are only computed when first requested, and a
+    pandas frame is only built for tables and exports.
+    """
+
+    __slots__ = (
+        "params", "index", "cash", "_diagnostics", "checkpoint",
+        "structuring_fee", "total_debt_principal", "quarterly_debt_pmt",
+        "sga_const_cost_cop", "equity_investment_levered_cop",
+        "equity_investment_unlevered_cop", "capex_benefit_total",
+    )
+
+    _CASH_ROWS = {name: i for i, name in enumerate(CASH_COLUMNS)}
+    _INDEX_ROWS = {name: i for i, name in enumerate(INDEX_COLUMNS)}
+    _DIAGNOSTIC_ROWS = {name: i for i, name in enumerate(DIAGNOSTIC_COLUMNS)}
+
+    def __init__(self, params, index, cash, **scalars):
+        self.params = params
+        self.index = np.array(index, dtype=np.int32).reshape(len(INDEX_COLUMNS), -1)
+        self.cash = np.array(cash, dtype=np.float64).reshape(len(CASH_COLUMNS), -1)
+        self._diagnostics = None
+        self.checkpoint = None
+        for name, value in scalars.items():
+            setattr(self, name, value)
+
+    def __len__(self):
+        return self.cash.shape[1]
+
+    def set_diagnostics(self, rows):
+        self._diagnostics = np.array(rows, dtype=np.float32).reshape(len(DIAGNOSTIC_COLUMNS), -1)
+
+    @property
+    def diagnostics(self):
+        """Tax-base diagnostics block, recomputed by the engine on first access."""
+        if self._diagnostics is None:
+            self._diagnostics = run_quarterly_engine(self.params, diagnostics=True)._diagnostics
+        return self._diagnostics
+
+    @property
+    def nbytes(self):
+        size = self.index.nbytes + self.cash.nbytes
+        if self._diagnostics is not None:
+            size += self._diagnostics.nbytes
+        return size
+
+    def __getitem__(self, col):
+        if col in self._CASH_ROWS:
+            return self.cash[self._CASH_ROWS[col]]
+        if col in self._INDEX_ROWS:
+            return self.index[self._INDEX_ROWS[col]]
+        return self.diagnostics[self._DIAGNOSTIC_ROWS[col]]
+
+    def frame(self, diagnostics=True):
+        """Quarterly model as a DataFrame (FULL_COLUMNS order)."""
+        columns = FULL_COLUMNS if diagnostics else INDEX_COLUMNS + CASH_COLUMNS
+        data = {}
+        for col in columns:
+            values = self[col]
+            data[col] = values.astype(np.int64) if col in self._INDEX_ROWS else values.astype(np.float64)
+        return pd.DataFrame(data)
+
+
+class EngineCheckpoint:
+    """
+    Engine state after the last quarter with actuals.
+
+    `quarters` periods are final: their rows (`index`, `cash`) and the
+    state carried into the next quarter (debt balance, accumulated
+    depreciation, cumulative tax bases and taxes, remaining Ley 1715 pool,
+    first operating calendar year). `key` identifies the inputs those
+    periods depend on (see checkpoint_key) and `overrides` the debt sizing
+    they were run with, so a re-forecast with the same key can skip both.
+    """
+
+    __slots__ = ("key", "quarters", "state", "overrides", "index", "cash")
+
+    def __init__(self, key, quarters, state, overrides, index, cash):
+        self.key = key
+        self.quarters = quarters
+        self.state = state
+        self.overrides = overrides
+        self.index = index
+        self.cash = cash
+
+
+# ------------------------------------------------------
+# ENGINE
+# ------------------------------------------------------
+ENGINE_INPUTS = (
+    "start_year", "start_q_num", "ppa_term_years",
+    "current_tariff", "discount_rate", "pcp_escalator_annual",
+    "initial_gen_mwh_annual", "degradation_annual",
+    "construction_quarters", "capex_million_cop", "opex_million_cop_annual",
+    "opex_inflation_annual", "sga_percent", "sga_const_pct",
+    "tax_rate", "depreciation_years", "ftt_rate", "enable_ica", "ica_rate",
+    "enable_capex_benefit", "capex_benefit_years", "capex_benefit_capex_pct",
+    "enable_debt", "debt_ratio", "interest_rate_annual", "loan_tenor_years",
+    "structuring_fee_pct", "grace_period_quarters",
+    "debt_sizing", "target_dscr", "debt_sculpting", "debt_principal_schedule",
+    "generation_schedule", "billed_schedule",
+    "actual_generation", "actual_revenue", "actual_opex",
+)
+# Per-quarter actuals (engine periods, None = forecast), see pharos_actuals
+ACTUAL_PARAMS = ("actual_generation", "actual_revenue", "actual_opex")
+
+
+def budget_params(p):
+    """`p` without actuals (the budget case)."""
+    return {**p, **{key: None for key in ACTUAL_PARAMS}}
+
+
+def last_actual_quarter(p):
+    """Number of engine periods up to the last one with an actual (0 if none)."""
+    last = 0
+    for key in ACTUAL_PARAMS:
+        values = p.get(key)
+        if values is not None:
+            filled = [i for i, v in enumerate(values) if v is not None]
+            if filled:
+                last = max(last, filled[-1] + 1)
+    return last
+
+
+def checkpoint_key(p, quarters):
+    """Engine inputs the first `quarters` periods depend on (actuals cut to those periods)."""
+    return tuple(
+        _freeze(None if p.get(key) is None else tuple(p[key][:quarters]))
+        if key in ACTUAL_PARAMS else _freeze(p.get(key))
+        for key in ENGINE_INPUTS
+    )
+
+
+def run_quarterly_engine(p, diagnostics=False, previous=None):
+    """
+    Quarterly cash-flow engine (all figures in M COP).
+
+    Returns an EngineResult. The tax-base diagnostics are only collected
+    when `diagnostics` is set; otherwise the result recomputes them on
+    first access.
+
+    With `debt_sizing == "Target DSCR"` the debt is sized first (see
+    size_debt_dscr) and the result's params carry the sized debt ratio and
+    principal schedule. An explicit `debt_principal_schedule` (principal
+    per quarter) replaces the level annuity after the grace period.
+
+    `generation_schedule` / `billed_schedule` (MWh per quarter, e.g. from
+    hourly profiles, see pharos_profiles) replace the flat degraded
+    generation: revenue is billed MWh x PPA price.
+
+    `actual_generation` / `actual_revenue` / `actual_opex` (per quarter,
+    None = forecast) overwrite those lines in operating quarters; actual
+    generation without actual revenue is billed at the PPA price. Debt is
+    sized on the budget (actuals removed). The result then carries an
+    EngineCheckpoint after the last actual quarter, and a run given a
+    `previous` result whose checkpoint still applies (same inputs, same
+    actuals up to it) re-forecasts from there instead of from quarter one.
+    """
+    checkpoint = None if diagnostics or previous is None else previous.checkpoint
+    if checkpoint is not None and checkpoint.key != checkpoint_key(p, checkpoint.quarters):
+        checkpoint = None
+    n_actual = last_actual_quarter(p)
+    key = checkpoint_key(p, n_actual) if n_actual else None
+    if checkpoint is not None:
+        overrides = checkpoint.overrides
+    elif p.get("debt_sizing") == "Target DSCR" and p["enable_debt"]:
+        overrides = size_debt_dscr(budget_params(p))
+    else:
+        overrides = {}
+    p = {**p, **overrides}
+    start_year = p["start_year"]
+    start_q_num = p["start_q_num"]
+    ppa_term_years = p["ppa_term_years"]
+    current_tariff = p["current_tariff"]
+    discount_rate = p["discount_rate"]
+    pcp_escalator_annual = p["pcp_escalator_annual"]
+    initial_gen_mwh_annual = p["initial_gen_mwh_annual"]
+    degradation_annual = p["degradation_annual"]
+    construction_quarters = p["construction_quarters"]
+    capex_million_cop = p["capex_million_cop"]
+    opex_million_cop_annual = p["opex_million_cop_annual"]
+    opex_inflation_annual = p["opex_inflation_annual"]
+    sga_percent = p["sga_percent"]
+    sga_const_pct = p["sga_const_pct"]
+    tax_rate = p["tax_rate"]
+    depreciation_years = p["depreciation_years"]
+    ftt_rate = p["ftt_rate"]
+    enable_ica = p["enable_ica"]
+    ica_rate = p["ica_rate"]
+    enable_capex_benefit = p["enable_capex_benefit"]
+    capex_benefit_years = p["capex_benefit_years"]
+    capex_benefit_capex_pct = p["capex_benefit_capex_pct"]
+    enable_debt = p["enable_debt"]
+    debt_ratio = p["debt_ratio"]
+    interest_rate_annual = p["interest_rate_annual"]
+    loan_tenor_years = p["loan_tenor_years"]
+    structuring_fee_pct = p["structuring_fee_pct"]
+    grace_period_quarters = p["grace_period_quarters"]
+    debt_principal_schedule = p.get("debt_principal_schedule")
+    generation_schedule = p.get("generation_schedule")
+    billed_schedule = p.get("billed_schedule")
+    actual_generation = p.get("actual_generation")
+    actual_revenue = p.get("actual_revenue")
+    actual_opex = p.get("actual_opex")
+
+    full_quarters = construction_quarters + (ppa_term_years * 4)
+
+    if enable_debt:
+        structuring_fee = (capex_million_cop * debt_ratio) * structuring_fee_pct
+        total_debt_principal = capex_million_cop * debt_ratio
+        interest_rate_quarterly = interest_rate_annual / 4
+        loan_tenor_quarters = loan_tenor_years * 4
+        quarterly_debt_pmt = -npf.pmt(
+            interest_rate_quarterly,
+            loan_tenor_quarters - grace_period_quarters,
+            total_debt_principal
+        ) if (loan_tenor_quarters - grace_period_quarters) > 0 else 0
+    else:
+        structuring_fee = 0
+        total_debt_principal = 0
+        interest_rate_quarterly = 0.0
+        quarterly_debt_pmt = 0
+
+    sga_const_cost_cop = capex_million_cop * sga_const_pct
+    total_capex_cost = capex_million_cop + structuring_fee + sga_const_cost_cop
+    equity_investment_levered_cop = total_capex_cost - total_debt_principal
+    equity_investment_unlevered_cop = total_capex_cost
+
+    # CAPEX tax benefit pool (Ley 1715)
+    if enable_capex_benefit and capex_benefit_years > 0:
+        eligible_capex = capex_million_cop * capex_benefit_capex_pct
+        capex_benefit_total = 0.5 * eligible_capex
+        capex_benefit_remaining = capex_benefit_total
+    else:
+        eligible_capex = 0.0
+        capex_benefit_total = 0.0
+        capex_benefit_remaining = 0.0
+
+    q_list, gy_list, cal_list = [], [], []
+    gen_list, rev_list, ebitda_list = [], [], []
+    opex_list, sga_list, gross_list = [], [], []
+    dep_list, int_list, tax_list, ftt_list, ica_list = [], [], [], [], []
+    ufcf_list, lfcf_list, debt_bal_list, book_val_list = [], [], [], []
+
+    # Detailed debt schedule tracking
+    opening_debt_list = []
+    principal_list = []
+
+    # Tax base tracking
+    base_unlev_list, base_lev_list = [], []
+    base_lev_pre_list = []
+    cum_base_unlev_list, cum_base_lev_list = [], []
+    cum_tax_unlev_list, cum_tax_lev_list = [], []
+    capex_benefit_q_list = []
+
+    debt_balance = total_debt_principal
+    accumulated_dep = 0
+
+    cum_base_unlev = 0.0
+    cum_base_lev = 0.0
+    cum_tax_unlev = 0.0
+    cum_tax_lev = 0.0
+    cum_base_lev_pre = 0.0
+
+    op_start_calendar_year = None
+
+    first = 0
+    if checkpoint is not None:
+        first = checkpoint.quarters
+        (debt_balance, accumulated_dep, cum_base_unlev, cum_base_lev, cum_tax_unlev,
+         cum_tax_lev, cum_base_lev_pre, capex_benefit_remaining,
+         op_start_calendar_year) = checkpoint.state
+
+    for i in range(first, full_quarters):
+        q = i + 1
+        abs_q = (start_q_num - 1) + i
+        cal_year = start_year + (abs_q // 4)
+
+        if q <= construction_quarters:
+            phase = "Construction"
+            q_op_index = 0
+            op_year = 0
+        else:
+            phase = "Operation"
+            q_op_index = q - construction_quarters
+            op_year = (q_op_index - 1) // 4 + 1
+            if op_start_calendar_year is None:
+                op_start_calendar_year = cal_year
+
+        global_year = (q - 1) // 4 + 1
+
+        if phase == "Operation":
+            esc_factor = (1 + pcp_escalator_annual) ** ((q_op_index - 1) / 4)
+            deg_factor = (1 - degradation_annual) ** ((q_op_index - 1) / 4)
+            opex_fac = (1 + opex_inflation_annual) ** ((q_op_index - 1) / 4)
+
+            p_price = current_tariff * (1 - discount_rate) * esc_factor
+            if generation_schedule is not None:
+                gen_quarterly = generation_schedule[i]
+                billed_mwh = billed_schedule[i]
+            else:
+                gen_quarterly = (initial_gen_mwh_annual / 4) * deg_factor
+                billed_mwh = gen_quarterly
+            if actual_generation is not None and actual_generation[i] is not None:
+                # Keep the budget's billed share of generation
+                actual_gen = actual_generation[i]
+                billed_mwh = billed_mwh * actual_gen / gen_quarterly if gen_quarterly else actual_gen
+                gen_quarterly = actual_gen
+            rev = (billed_mwh * p_price) / 1000
+            opex = (opex_million_cop_annual / 4) * opex_fac
+            if actual_revenue is not None and actual_revenue[i] is not None:
+                rev = actual_revenue[i]
+            if actual_opex is not None and actual_opex[i] is not None:
+                opex = actual_opex[i]
+            gross = rev - opex
+            sga = gross * sga_percent
+            ica_cost = rev * ica_rate if enable_ica else 0.0
+            ebitda = gross - sga - ica_cost
+            dep = (capex_million_cop / depreciation_years) / 4 if op_year <= depreciation_years else 0
+        else:
+            gen_quarterly = rev = opex = gross = sga = ica_cost = ebitda = dep = 0
+
+        if phase == "Construction" and construction_quarters > 0:
+            capex_unlevered = capex_million_cop / construction_quarters
+            capex_levered = equity_investment_levered_cop / construction_quarters
+            sga_const_outflow = sga_const_cost_cop / construction_quarters
+            capex_levered += sga_const_outflow
+        else:
+            capex_unlevered = capex_levered = sga_const_outflow = 0
+
+        # Store opening balance for this quarter
+        opening_debt = debt_balance
+
+        if debt_balance > 0:
+            interest = debt_balance * interest_rate_quarterly
+            if q > grace_period_quarters:
+                if debt_principal_schedule is not None:
+                    principal = debt_principal_schedule[i]
+                else:
+                    principal = quarterly_debt_pmt - interest
+                if principal > debt_balance:
+                    principal = debt_balance
+            else:
+                principal = 0
+            debt_balance -= principal
+        else:
+            interest = principal = 0
+
+        # Tax base before benefit
+        base_lev_pre = ebitda - interest - dep
+
+        prev_cum_base_lev_pre = cum_base_lev_pre
+        cum_base_lev_pre += base_lev_pre
+
+        eff_base_q = max(cum_base_lev_pre, 0) - max(prev_cum_base_lev_pre, 0)
+
+        capex_tax_benefit_q = 0.0
+
+        if (
+            enable_capex_benefit
+            and phase == "Operation"
+            and op_start_calendar_year is not None
+            and cal_year >= op_start_calendar_year + 1
+            and cal_year < op_start_calendar_year + 1 + capex_benefit_years
+            and capex_benefit_remaining > 0
+            and eff_base_q > 0
+        ):
+            max_allowed_this_q = 0.5 * eff_base_q
+            capex_tax_benefit_q = min(capex_benefit_remaining, max_allowed_this_q)
+            capex_benefit_remaining -= capex_tax_benefit_q
+
+        base_unlev = ebitda - dep - capex_tax_benefit_q
+        base_lev = base_lev_pre - capex_tax_benefit_q
+
+        cum_base_unlev += base_unlev
+        cum_base_lev += base_lev
+
+        theor_tax_unlev = tax_rate * max(cum_base_unlev, 0)
+        theor_tax_lev = tax_rate * max(cum_base_lev, 0)
+
+        tax_unlevered = max(0, theor_tax_unlev - cum_tax_unlev)
+        tax_levered = max(0, theor_tax_lev - cum_tax_lev)
+
+        cum_tax_unlev += tax_unlevered
+        cum_tax_lev += tax_levered
+
+        if enable_debt:
+            total_disbursements = capex_levered + opex + sga + principal + interest + tax_levered
+        else:
+            total_disbursements = capex_unlevered + opex + sga + tax_unlevered
+
+        ftt_cost = total_disbursements * ftt_rate
+
+        accumulated_dep += dep
+        book_val = max(0, capex_million_cop - accumulated_dep)
+
+        ufcf = ebitda - tax_unlevered - capex_unlevered - ftt_cost
+        if enable_debt:
+            lfcf = ebitda - tax_levered - interest - principal - capex_levered - ftt_cost
+        else:
+            lfcf = ufcf
+
+        q_list.append(q)
+        gy_list.append(global_year)
+        cal_list.append(cal_year)
+        gen_list.append(gen_quarterly)
+        rev_list.append(rev)
+        opex_list.append(opex)
+        gross_list.append(gross)
+        sga_list.append(sga)
+        ica_list.append(ica_cost)
+        ebitda_list.append(ebitda)
+        dep_list.append(dep)
+        int_list.append(interest)
+        tax_list.append(tax_levered)
+        ftt_list.append(ftt_cost)
+
+        ufcf_list.append(ufcf)
+        lfcf_list.append(lfcf)
+
+        # Debt schedule tracking
+        opening_debt_list.append(opening_debt)
+        principal_list.append(principal)
+        debt_bal_list.append(debt_balance)
+        book_val_list.append(book_val)
+
+        if diagnostics:
+            base_unlev_list.append(base_unlev)
+            base_lev_list.append(base_lev)
+            base_lev_pre_list.append(base_lev_pre)
+            cum_base_unlev_list.append(cum_base_unlev)
+            cum_base_lev_list.append(cum_base_lev)
+            cum_tax_unlev_list.append(cum_tax_unlev)
+            cum_tax_lev_list.append(cum_tax_lev)
+            capex_benefit_q_list.append(capex_tax_benefit_q)
+
+        if q == n_actual:
+            state = (
+                debt_balance, accumulated_dep, cum_base_unlev, cum_base_lev, cum_tax_unlev,
+                cum_tax_lev, cum_base_lev_pre, capex_benefit_remaining, op_start_calendar_year,
+            )
+
+    index = np.array([q_list, gy_list, cal_list], dtype=np.int32).reshape(len(INDEX_COLUMNS), -1)
+    cash = np.array([
+        gen_list, rev_list, opex_list, gross_list, sga_list, ica_list,
+        ebitda_list, dep_list, int_list, tax_list, ftt_list,
+        ufcf_list, lfcf_list,
+        opening_debt_list, principal_list, debt_bal_list, book_val_list,
+    ], dtype=np.float64).reshape(len(CASH_COLUMNS), -1)
+    if checkpoint is not None:
+        index = np.hstack([checkpoint.index, index])
+        cash = np.hstack([checkpoint.cash, cash])
+
+    result = EngineResult(
+        p,
+        index=index,
+        cash=cash,
+        structuring_fee=structuring_fee,
+        total_debt_principal=total_debt_principal,
+        quarterly_debt_pmt=quarterly_debt_pmt,
+        sga_const_cost_cop=sga_const_cost_cop,
+        equity_investment_levered_cop=equity_investment_levered_cop,
+        equity_investment_unlevered_cop=equity_investment_unlevered_cop,
+        capex_benefit_total=capex_benefit_total,
+    )
+    if diagnostics:
+        result.set_diagnostics([
+            base_unlev_list, base_lev_pre_list, base_lev_list,
+            cum_base_unlev_list, cum_base_lev_list,
+            cum_tax_unlev_list, cum_tax_lev_list, capex_benefit_q_list,
+        ])
+    if checkpoint is not None and checkpoint.quarters == n_actual:
+        result.checkpoint = checkpoint
+    elif 0 < n_actual <= full_quarters:
+        result.checkpoint = EngineCheckpoint(
+            key, n_actual, state, overrides,
+            result.index[:, :n_actual].copy(), result.cash[:, :n_actual].copy(),
+        )
+    return result
+
+
+# ------------------------------------------------------
+# DEBT SIZING
+# ------------------------------------------------------
+def cfads(engine):
+    """Cash flow available for debt service (M COP): EBITDA - taxes - FTT."""
+    return engine["EBITDA_M_COP"] - engine["Tax_M_COP"] - engine["FTT_M_COP"]
+
+
+def dscr_debt_schedule(cf, repay, rate_q, amort_quarters, target_dscr, sculpting, cap):
+    """
+    Debt capacity at a target DSCR for CFADS rows `cf` (S, Q).
+
+    `repay` (S, Q) marks the repayment quarters; the other arguments are
+    (S, 1) columns. Level repayment: the annuity whose payment is the
+    smallest CFADS / target over the repayment quarters. Sculpted: debt
+    service = CFADS / target each quarter, and the debt is its present
+    value at the loan rate. Capacity is capped at `cap` (sculpted debt
+    service scaled down pro rata). Returns (debt (S,), principal schedule
+    (S, Q)); schedule rows are NaN where `sculpting` is off.
+    """
+    rate_q = np.broadcast_to(rate_q, (len(cf), 1))
+    target_dscr = np.broadcast_to(target_dscr, (len(cf), 1))
+    ds = np.where(repay, np.maximum(cf, 0.0) / target_dscr, 0.0)
+
+    # Level annuity sized on the weakest repayment quarter
+    pmt = np.where(repay, ds, np.inf).min(axis=1, keepdims=True)
+    pmt = np.where(np.isfinite(pmt), pmt, 0.0)
+    n = np.maximum(amort_quarters, 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        annuity = np.where(rate_q > 0, (1 - (1 + rate_q) ** -n) / rate_q, n)
+    level_debt = np.where(amort_quarters > 0, pmt * annuity, 0.0)
+
+    # Sculpted: present value of CFADS / target, discounted from the end of grace
+    j = np.cumsum(repay, axis=1)
+    disc = (1 + rate_q) ** -j
+    pv_cum = np.cumsum(ds * disc, axis=1)
+    sculpted_debt = pv_cum[:, -1:]
+
+    debt = np.minimum(np.where(sculpting, sculpted_debt, level_debt), cap)
+
+    # Principal from the balance path: B_j = (1 + r)^j * (D - PV of debt service to date)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scale = np.where(sculpted_debt > 0, debt / sculpted_debt, 0.0)
+    balance = np.where(repay, (1 + rate_q) ** j * (debt - scale * pv_cum), debt)
+    balance = np.maximum(balance, 0.0)
+    prev = np.concatenate([np.broadcast_to(debt, (len(cf), 1)), balance[:, :-1]], axis=1)
+    principal = np.where(repay, prev - balance, 0.0)
+    # Clear rounding residue in the last repayment quarter
+    last = repay.shape[1] - 1 - np.argmax(repay[:, ::-1], axis=1)
+    rows = np.flatnonzero(repay.any(axis=1))
+    principal[rows, last[rows]] += balance[rows, last[rows]]
+    schedule = np.where(sculpting, principal, np.nan)
+    return debt[:, 0], schedule
+
+
+def size_debt_dscr(p, tol=1e-9, max_iter=50):
+    """
+    Largest debt (up to `debt_ratio` x CAPEX) keeping CFADS / debt service
+    at or above `target_dscr` in every repayment quarter (after grace, up
+    to the tenor or the end of the horizon), with level or sculpted
+    (`debt_sculpting`) repayment.
+
+    Taxes and FTT depend on the debt, so CFADS is re-evaluated with the
+    engine until the debt amount is stable (a handful of runs). Returns the
+    parameter overrides for the sized run.
+    """
+    capex = p["capex_million_cop"]
+    cap = capex * p["debt_ratio"]
+    grace = p["grace_period_quarters"]
+    tenor_q = p["loan_tenor_years"] * 4
+    n_quarters = p["construction_quarters"] + p["ppa_term_years"] * 4
+    q = np.arange(1, n_quarters + 1)
+    repay = ((q > grace) & (q <= tenor_q))[None, :]
+
+    sized = {**p, "debt_sizing": "Debt Ratio", "debt_principal_schedule": None}
+    debt = cap
+    for _ in range(max_iter):
+        sized["debt_ratio"] = debt / capex if capex else 0.0
+        engine = run_quarterly_engine(sized)
+        new_debt, schedule = dscr_debt_schedule(
+            cfads(engine)[None, :], repay, p["interest_rate_annual"] / 4,
+            tenor_q - grace, p["target_dscr"], p["debt_sculpting"], cap
+        )
+        new_debt = float(new_debt[0])
+        converged = abs(new_debt - debt) <= tol * max(1.0, debt)
+        if p["debt_sculpting"]:
+            # The schedule changes interest and hence taxes: it must be stable too
+            previous = sized["debt_principal_schedule"]
+            converged &= previous is not None and bool(
+                np.abs(schedule[0] - previous).max() <= tol * max(1.0, debt)
+            )
+            sized["debt_principal_schedule"] = tuple(schedule[0].tolist())
+        debt = new_debt
+        if converged:
+            break
+    sized["debt_ratio"] = debt / capex if capex else 0.0
+    return {k: sized[k] for k in ("debt_sizing", "debt_ratio", "debt_principal_schedule")}
+
+
+# ------------------------------------------------------
+# EXIT
+# ------------------------------------------------------
+EXIT_INPUTS = (
+    "exit_method", "exit_year", "exit_value_cop", "exit_multiple",
+    "cap_gains_rate", "construction_quarters",
+)
+
+
+def compute_exit(p, engine):
+    """Exit value, capital gains tax and net exit inflows (M COP) at the exit quarter."""
+    construction_quarters = p["construction_quarters"]
+    dash_exit_year = p["exit_year"]
+
+    if p["exit_method"] == "Fixed Asset Value":
+        final_exit_val_cop = p["exit_value_cop"]
+    else:
+        exit_q_idx = construction_quarters + (dash_exit_year * 4) - 1
+        start_idx = max(0, exit_q_idx - 3)
+        annual_ebitda = engine["EBITDA_M_COP"][start_idx:exit_q_idx + 1].sum()
+        final_exit_val_cop = annual_ebitda * p["exit_multiple"]
+
+    dash_exit_q = min(construction_quarters + (dash_exit_year * 4), len(engine))
+    book_v_final = engine["Book_Value_M_COP"][dash_exit_q - 1]
+    debt_b_final = engine["Debt_Balance_M_COP"][dash_exit_q - 1]
+    gain = final_exit_val_cop - book_v_final
+    cg_tax = gain * p["cap_gains_rate"] if gain > 0 else 0
+
+    return {
+        "final_exit_val_cop": final_exit_val_cop,
+        "dash_exit_q": dash_exit_q,
+        "book_v_final": book_v_final,
+        "debt_b_final": debt_b_final,
+        "cg_tax": cg_tax,
+        "exit_inflow_unlevered_cop": final_exit_val_cop - cg_tax,
+        "exit_inflow_levered_cop": final_exit_val_cop - debt_b_final - cg_tax,
+    }
+
+
+# ------------------------------------------------------
+# DISPLAY CURRENCY
+# ------------------------------------------------------
+DISPLAY_INPUTS = ("fx_rate_current", "utility_inflation_annual", "us_inflation_annual")
+
+DISP_COLS = ["Revenue", "OPEX", "Gross", "SGA", "ICA", "EBITDA",
+             "Depreciation", "Interest", "Tax", "FTT", "UFCF", "LFCF"]
+
+AGG_COLS = ["Generation_MWh", "Revenue_Disp", "OPEX_Disp", "Gross_Disp",
+            "SGA_Disp", "ICA_Disp", "EBITDA_Disp", "Depreciation_Disp",
+            "Interest_Disp", "Tax_Disp", "FTT_Disp",
+            "UFCF_Disp", "LFCF_Disp"]
+
+
+def fx_path(n_quarters, fx_rate_current, utility_inflation_annual, us_inflation_annual):
+    """Quarterly COP/USD rate projected by inflation differential."""
+    ratio = (1 + utility_inflation_annual) / (1 + us_inflation_annual)
+    return np.array([fx_rate_current * ratio ** (i / 4) for i in range(n_quarters)])
+
+
+class CurrencyView:
+    """
+    Display-currency view over the canonical M COP engine result.
+
+    `view["LFCF_Disp"]` converts `LFCF_M_COP` on access instead of storing a
+    second copy of every column. Annual aggregates are computed once per
+    horizon (and exit adjustment) and cached, so switching back and forth
+    between currencies only touches the yearly tables.
+    """
+
+    def __init__(self, engine, fx_rate, currency_mode):
+        self.engine = engine
+        self.fx_rate = fx_rate
+        self.currency_mode = currency_mode
+        self.factor = 1000 / fx_rate if "USD" in currency_mode else 1
+        self._annual = {}
+
+    def __getitem__(self, col):
+        if col.endswith("_Disp"):
+            return self.engine[f"{col[:-len('_Disp')]}_M_COP"] * self.factor
+        if col == "FX_Rate":
+            return self.fx_rate
+        return self.engine[col]
+
+    def factor_at(self, idx):
+        """Conversion factor for quarter position `idx`."""
+        return self.factor if np.isscalar(self.factor) else self.factor[idx]
+
+    def frame(self, diagnostics=True):
+        """Quarterly frame with FX path and materialized *_Disp columns (for exports)."""
+        df = quarterly_frame(self.engine, self.fx_rate, diagnostics)
+        for col in DISP_COLS:
+            df[f"{col}_Disp"] = self[f"{col}_Disp"]
+        return df
+
+    def flows(self, n_quarters, exit_unlevered_cop=0.0, exit_levered_cop=0.0):
+        """UFCF/LFCF (display currency) up to `n_quarters`, with exit inflows in the last quarter."""
+        last_idx = n_quarters - 1
+        conv_final = self.factor_at(last_idx)
+        ufcf = self["UFCF_Disp"][:n_quarters].copy()
+        lfcf = self["LFCF_Disp"][:n_quarters].copy()
+        ufcf[last_idx] += exit_unlevered_cop * conv_final
+        lfcf[last_idx] += exit_levered_cop * conv_final
+        return ufcf, lfcf
+
+    def annual(self, n_quarters=None, exit_unlevered_cop=0.0, exit_levered_cop=0.0):
+        """Annual aggregates (AGG_COLS by Calendar_Year), cached per horizon and exit."""
+        n = len(self.engine) if n_quarters is None else n_quarters
+        key = (n, exit_unlevered_cop, exit_levered_cop)
+        if key not in self._annual:
+            disp = pd.DataFrame({
+                "Calendar_Year": self.engine["Calendar_Year"][:n].astype(np.int64),
+                "Generation_MWh": self.engine["Generation_MWh"][:n],
+            })
+            for col in DISP_COLS:
+                disp[f"{col}_Disp"] = self[f"{col}_Disp"][:n]
+            if exit_unlevered_cop or exit_levered_cop:
+                disp["UFCF_Disp"], disp["LFCF_Disp"] = self.flows(
+                    n, exit_unlevered_cop, exit_levered_cop
+                )
+            self._annual[key] = disp.groupby("Calendar_Year")[AGG_COLS].sum().reset_index()
+        return self._annual[key]
+
+
+def quarterly_frame(engine, fx_rate, diagnostics=True):
+    """Quarterly model frame in M COP with the FX path after the period columns."""
+    df = engine.frame(diagnostics)
+    df.insert(3, "FX_Rate", fx_rate)
+    return df
+
+
+class CurrencyViews:
+    """Canonical engine result, its FX path and the cached currency views."""
+
+    def __init__(self, engine, fx_rate):
+        self.engine = engine
+        self.fx_rate = fx_rate
+        self._views = {}
+
+    @property
+    def nbytes(self):
+        return self.fx_rate.nbytes
+
+    def view(self, currency_mode):
+        if currency_mode not in self._views:
+            self._views[currency_mode] = CurrencyView(self.engine, self.fx_rate, currency_mode)
+        return self._views[currency_mode]
+
+    def frame(self, diagnostics=True):
+        """Quarterly model frame in M COP (with FX path), built on demand."""
+        return quarterly_frame(self.engine, self.fx_rate, diagnostics)
+
+
+def convert_display(p, engine):
+    """Project the FX path; display-currency columns are computed on access."""
+    return CurrencyViews(engine, fx_path(
+        len(engine), p["fx_rate_current"],
+        p["utility_inflation_annual"], p["us_inflation_annual"]
+    ))
+
+
+# ------------------------------------------------------
+# AGGREGATION
+# ------------------------------------------------------
+AGGREGATION_INPUTS = ("currency_mode",)
+
+
+def aggregate_annual(p, display, exit_info):
+    """Dashboard cash flows (up to the exit quarter, incl. exit inflows) and annual aggregates."""
+    view = display.view(p["currency_mode"])
+    dash_exit_q = exit_info["dash_exit_q"]
+    exit_unlev = exit_info["exit_inflow_unlevered_cop"]
+    exit_lev = exit_info["exit_inflow_levered_cop"]
+
+    dash_ufcf, dash_lfcf = view.flows(dash_exit_q, exit_unlev, exit_lev)
+    df_annual_dash = view.annual(dash_exit_q, exit_unlev, exit_lev).copy()
+    df_annual_full = view.annual()
+
+    df_annual_dash["Implied_Price_Unit"] = 0.0
+    mask = df_annual_dash["Generation_MWh"] > 0
+    implied = df_annual_dash.loc[mask, "Revenue_Disp"] / df_annual_dash.loc[mask, "Generation_MWh"]
+    if "USD" not in p["currency_mode"]:
+        implied = implied * 1000
+    df_annual_dash.loc[mask, "Implied_Price_Unit"] = implied
+
+    return {
+        "view": view,
+        "dash_ufcf_disp": dash_ufcf,
+        "dash_lfcf_disp": dash_lfcf,
+        "df_annual_dash": df_annual_dash,
+        "df_annual_full": df_annual_full,
+    }
+
+
+# ------------------------------------------------------
+# KPIs
+# ------------------------------------------------------
+KPI_INPUTS = ("investor_disc_rate", "currency_mode", "fx_rate_current")
+
+
+def get_irr(stream):
+    try:
+        q_irr = npf.irr(stream)
+        return ((1 + q_irr) ** 4 - 1) * 100
+    except Exception:
+        return 0
+
+
+def compute_kpis(p, engine, aggregation):
+    """Equity investment, IRRs, MOIC and NPV in display currency."""
+    dash_ufcf = aggregation["dash_ufcf_disp"]
+    dash_lfcf = aggregation["dash_lfcf_disp"]
+    inv_conv = 1000 / p["fx_rate_current"] if "USD" in p["currency_mode"] else 1
+    equity_inv_disp = engine.equity_investment_levered_cop * inv_conv
+    return {
+        "inv_conv": inv_conv,
+        "equity_inv_disp": equity_inv_disp,
+        "irr_unlevered": get_irr(dash_ufcf),
+        "irr_levered": get_irr(dash_lfcf),
+        "moic_levered": dash_lfcf.sum() / equity_inv_disp if equity_inv_disp > 0 else 0,
+        "npv_equity": npf.npv(p["investor_disc_rate"] / 4, [0] + dash_lfcf.tolist()),
+    }
+
+
+# ------------------------------------------------------
+# VIEWS
+# ------------------------------------------------------
+VIEW_INPUTS = ("table_layout",)
+
+PNL_ROW_LABELS = [
+    "Revenue", "(-) OPEX", "(=) Gross Profit", "(-) SGA", "(=) EBITDA",
+    "(-) Depreciation", "(=) EBIT", "(-) Interest",
+    "(=) EBT", "(-) Taxes", "(=) Net Income"
+]
+CF_COLS = ["Generation_MWh", "Revenue_Disp", "OPEX_Disp",
+           "EBITDA_Disp", "UFCF_Disp", "LFCF_Disp"]
+CF_ROW_LABELS = ["Generation (MWh)", "Revenue", "(-) OPEX",
+                 "(=) EBITDA", "Unlevered FCF", "Levered FCF"]
+
+
+def pnl_annual(df_annual):
+    """Annual P&L built from the annual aggregates (display currency)."""
+    pnl_data = df_annual.copy()
+    pnl_data["EBIT_Disp"] = pnl_data["EBITDA_Disp"] - pnl_data["Depreciation_Disp"]
+    pnl_data["EBT_Disp"] = pnl_data["EBIT_Disp"] - pnl_data["Interest_Disp"]
+    pnl_data["Net_Income_Disp"] = pnl_data["EBT_Disp"] - pnl_data["Tax_Disp"]
+    return pnl_data
+
+
+def build_views(p, aggregation):
+    """P&L and cash-flow statement tables in the selected layout."""
+    df_annual_full = aggregation["df_annual_full"]
+    pnl_view = pnl_annual(df_annual_full)[[
+        "Calendar_Year", "Revenue_Disp", "OPEX_Disp", "Gross_Disp",
+        "SGA_Disp", "EBITDA_Disp", "Depreciation_Disp", "EBIT_Disp",
+        "Interest_Disp", "EBT_Disp", "Tax_Disp", "Net_Income_Disp"
+    ]].set_index("Calendar_Year")
+    cf_view = df_annual_full.set_index("Calendar_Year")[CF_COLS]
+
+    if "Horizontal" in p["table_layout"]:
+        pnl_view = pnl_view.T
+        pnl_view.index = PNL_ROW_LABELS
+        cf_view = cf_view.T
+        cf_view.index = CF_ROW_LABELS
+    return {"pnl_view": pnl_view, "cf_view": cf_view}
+
+
+# ------------------------------------------------------
+# STAGE PIPELINE
+# ------------------------------------------------------
+def _freeze(value):
+    """Hashable, comparable representation of a parameter value."""
+    if isinstance(value, np.ndarray):
+        return ("ndarray", value.shape, value.dtype.str, value.tobytes())
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    return value
+
+
+class Stage:
+    """
+    A pipeline step: `func(params, *upstream_outputs)` reading only `inputs`.
+    Incremental stages also get `previous=` their last output (None on the
+    first run) to resume from.
+    """
+
+    __slots__ = ("name", "func", "inputs", "upstream", "incremental")
+
+    def __init__(self, name, func, inputs=(), upstream=(), incremental=False):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.upstream = tuple(upstream)
+        self.incremental = incremental
+
+
+class StagePipeline:
+    """
+    Memoized stage graph.
+
+    Each stage is re-executed only when one of its declared inputs or an
+    upstream stage output changed since its last run; otherwise the cached
+    output is returned. Stage functions only see their declared inputs, so a
+    missing declaration fails loudly instead of silently serving stale data.
+    """
+
+    def __init__(self, stages):
+        self.stages = {s.name: s for s in stages}
+        self._cache = {}  # name -> (key, version, output)
+        self.timings = {}  # name -> seconds of the last execution
+        self.executed = []  # stages executed since the last reset_log()
+
+    def reset_log(self):
+        self.executed = []
+
+    def invalidate(self, name=None):
+        if name is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(name, None)
+
+    def _resolve(self, name, params):
+        stage = self.stages[name]
+        upstream = [self._resolve(u, params) for u in stage.upstream]
+        key = (
+            tuple(_freeze(params.get(k)) for k in stage.inputs),
+            tuple(version for version, _ in upstream),
+        )
+        cached = self._cache.get(name)
+        if cached is not None and cached[0] == key:
+            return cached[1], cached[2]
+
+        stage_params = {k: params.get(k) for k in stage.inputs}
+        extra = {"previous": cached[2] if cached is not None else None} if stage.incremental else {}
+        t0 = time.perf_counter()
+        output = stage.func(stage_params, *[out for _, out in upstream], **extra)
+        self.timings[name] = time.perf_counter() - t0
+        self.executed.append(name)
+
+        version = cached[1] + 1 if cached is not None else 0
+        self._cache[name] = (key, version, output)
+        return version, output
+
+    def get(self, name, params):
+        """Output of stage `name` for `params`, recomputing only what changed."""
+        return self._resolve(name, params)[1]
+
+
+def build_model_pipeline():
+    """engine -> exit / display conversion -> aggregation -> KPIs -> views."""
+    return StagePipeline([
+        Stage("engine", run_quarterly_engine, ENGINE_INPUTS, incremental=True),
+        Stage("exit", compute_exit, EXIT_INPUTS, upstream=("engine",)),
+        Stage("display", convert_display, DISPLAY_INPUTS, upstream=("engine",)),
+        Stage("aggregation", aggregate_annual, AGGREGATION_INPUTS,
+              upstream=("display", "exit")),
+        Stage("kpis", compute_kpis, KPI_INPUTS, upstream=("engine", "aggregation")),
+        Stage("views", build_views, VIEW_INPUTS, upstream=("aggregation",)),
+    ])
+
+
+def run_model(params, pipeline=None):
+    """Run the full pipeline (except views) and return the stage outputs by name."""
+    pipeline = pipeline or build_model_pipeline()
+    return {
+        name: pipeline.get(name, params)
+        for name in ("engine", "exit", "display", "aggregation", "kpis")
+    }
@@ -0,0 +1,321 @@
+"""
+Bulk project import for the Pharos app.
+
+A site list is a CSV or Excel sheet with one row per project and columns
+named after PROJECT_INPUT_KEYS (values as entered in the sidebar, i.e.
+percentages in %). `read_site_chunks` streams it in fixed-size chunks and
+`validate_sites` checks each chunk column by column as it arrives, so
+large pipelines are never parsed row by row or held twice in memory.
+Blank cells fall back to the base case. `merge_sites` applies the valid
+rows to the project store and `write_projects_file` replaces the store
+file atomically, so an import is written all at once or not at all.
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from pharos_analytics import EXIT_METHODS, INTEGER_INPUT_BOUNDS
+from pharos_cache import atomic_write
+from pharos_engine import (
+    BASE_CASE_INPUTS,
+    DEBT_SIZING_METHODS,
+    PROJECT_INPUT_KEYS,
+    QUARTER_NUMBERS,
+)
+
+
+# Rows parsed and validated per chunk
+IMPORT_CHUNK_ROWS = 250
+
+TEXT_KEYS = ("project_name", "client_name", "project_loc")
+CHOICE_KEYS = {
+    "start_q_str": tuple(QUARTER_NUMBERS),
+    "exit_method": EXIT_METHODS,
+    "debt_sizing": DEBT_SIZING_METHODS,
+}
+BOOL_KEYS = tuple(k for k, v in BASE_CASE_INPUTS.items() if isinstance(v, bool))
+INT_KEYS = tuple(
+    k for k, v in BASE_CASE_INPUTS.items()
+    if isinstance(v, int) and not isinstance(v, bool)
+)
+FLOAT_KEYS = tuple(
+    k for k in PROJECT_INPUT_KEYS
+    if k not in TEXT_KEYS and k not in CHOICE_KEYS and k not in BOOL_KEYS and k not in INT_KEYS
+)
+
+# (min, max) per numeric input; None = unbounded. Inflation/escalation may be negative.
+# The explicit bounds come last so they override the non-negative default, and
+# match the sidebar widgets' limits (a stored value outside them breaks the app).
+INPUT_BOUNDS = {
+    **{k: (0, None) for k in FLOAT_KEYS if k not in ("inf_val", "oinf_val", "esc_val")},
+    **INTEGER_INPUT_BOUNDS,
+    "capex_benefit_capex_pct": (0, 100),
+    "export_val": (0, 100),
+    "dr_val": (0, 100),
+    "dscr_target_val": (1.0, None),
+}
+# Inputs that must be strictly positive
+POSITIVE_KEYS = ("tariff_val", "gen_val", "capex_val", "fx_rate_current")
+
+TRUE_VALUES = {"true", "yes", "y", "1", "1.0", "si", "sí", "x"}
+FALSE_VALUES = {"false", "no", "n", "0", "0.0", ""}
+
+
+# ------------------------------------------------------
+# READING
+# ------------------------------------------------------
+def read_site_chunks(source, file_name, chunk_rows=IMPORT_CHUNK_ROWS):
+    """
+    Yield DataFrame chunks of a site list (CSV, or the first sheet of an
+    .xlsx workbook). `source` is a path or binary file object. Every cell
+    is kept as read (strings for CSV); validation does the typing.
+    """
+    if os.path.splitext(file_name)[1].lower() in (".xlsx", ".xlsm"):
+        yield from _excel_chunks(source, chunk_rows)
+        return
+    yield from pd.read_csv(
+        source, chunksize=chunk_rows, dtype=str, keep_default_na=False,
+        skipinitialspace=True, encoding="utf-8-sig"
+    )
+
+
+def _excel_chunks(source, chunk_rows):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = ["" if c is None else str(c) for c in header]
+        block = []
+        for row in rows:
+            if all(v is None for v in row):
+                continue
+            block.append(row)
+            if len(block) == chunk_rows:
+                yield pd.DataFrame(block, columns=columns)
+                block = []
+        if block:
+            yield pd.DataFrame(block, columns=columns)
+    finally:
+        workbook.close()
+
+
+# ------------------------------------------------------
+# VALIDATION
+# ------------------------------------------------------
+def _cell_text(values):
+    """Stripped text of each cell (None/NaN -> "") as an object array."""
+    return np.array([
+        "" if v is None or (isinstance(v, float) and np.isnan(v)) else str(v).strip()
+        for v in values
+    ], dtype=object)
+
+
+def _coerce_column(key, text):
+    """(values, error messages) arrays for one input column of a chunk; blanks get the base case."""
+    errors = np.full(len(text), "", dtype=object)
+    blank = text == ""
+    default = BASE_CASE_INPUTS.get(key, "")
+
+    if key in TEXT_KEYS:
+        if key == "project_name":
+            errors[blank] = "project name is required"
+        return text, errors
+
+    if key in CHOICE_KEYS:
+        values = np.where(blank, default, text)
+        errors[~np.isin(values, CHOICE_KEYS[key])] = f"must be one of {', '.join(CHOICE_KEYS[key])}"
+        return values, errors
+
+    if key in BOOL_KEYS:
+        lower = np.array([t.lower() for t in text], dtype=object)
+        true = np.isin(lower, list(TRUE_VALUES))
+        values = np.where(blank, default, true)
+        errors[~blank & ~true & ~np.isin(lower, list(FALSE_VALUES))] = "must be true/false"
+        return values, errors
+
+    numbers = pd.to_numeric(text, errors="coerce").astype(np.float64)
+    missing = np.isnan(numbers)
+    errors[~blank & missing] = "not a number"
+    with np.errstate(invalid="ignore"):
+        if key in INT_KEYS:
+            errors[~missing & (numbers % 1 != 0)] = "must be a whole number"
+        lo, hi = INPUT_BOUNDS.get(key, (None, None))
+        if lo is not None:
+            errors[numbers < lo] = f"must be ≥ {lo}"
+        if hi is not None:
+            errors[numbers > hi] = f"must be ≤ {hi}"
+        if key in POSITIVE_KEYS:
+            errors[numbers <= 0] = "must be > 0"
+    values = np.where(missing, default, numbers)
+    return values, errors
+
+
+def _python_values(key, values):
+    """Coerced column as plain Python values of the input's type (JSON-serializable)."""
+    if key in INT_KEYS:
+        return [int(v) for v in values]
+    if key in BOOL_KEYS:
+        return [bool(v) for v in values]
+    if key in FLOAT_KEYS:
+        return [float(v) for v in values]
+    return [str(v) for v in values]
+
+
+def coerce_input_rows(rows):
+    """
+    Type-check input dicts (e.g. API requests) column by column, with the
+    site-list rules. Returns (inputs, errors): per row, the given keys
+    coerced to their sidebar types (absent keys take the base case in
+    model_params_from_inputs) and a list of "key: message" strings.
+    Unknown keys are errors; a project name is not required.
+    """
+    inputs = [{} for _ in rows]
+    errors = [[] for _ in rows]
+    for key in sorted(set().union(*rows)) if rows else ():
+        given = np.array([row.get(key) is not None for row in rows])
+        if key not in PROJECT_INPUT_KEYS:
+            for i in np.flatnonzero(given):
+                errors[i].append(f"{key}: unknown input")
+            continue
+        text = _cell_text([row.get(key) for row in rows])
+        values, messages = _coerce_column(key, text)
+        if key == "project_name":
+            messages[:] = ""
+        values = _python_values(key, values)
+        for i in np.flatnonzero(given):
+            if messages[i]:
+                errors[i].append(f"{key}: {messages[i]}")
+            else:
+                inputs[i][key] = values[i]
+    for row, errs in zip(inputs, errors):
+        exit_yr = row.get("exit_yr", BASE_CASE_INPUTS["exit_yr"])
+        ppa_term = row.get("ppa_term", BASE_CASE_INPUTS["ppa_term"])
+        if exit_yr > ppa_term:
+            errs.append("exit_yr: must be ≤ ppa_term")
+    return inputs, errors
+
+
+class SiteImport:
+    """
+    Validated site list, filled chunk by chunk.
+
+    `sites` maps project name -> input dict (all PROJECT_INPUT_KEYS) for
+    the rows that passed; `errors` lists (Row, Project, Column, Error)
+    with spreadsheet row numbers (header = row 1). Names repeated within
+    the file, or already in `existing` unless `replace`, are errors.
+    """
+
+    def __init__(self, existing=(), replace=False):
+        self.existing = set(existing)
+        self.replace = replace
+        self.sites = {}
+        self.errors = []
+        self.rows = 0
+        self.ignored_columns = []
+
+    @property
+    def invalid_rows(self):
+        return len({e["Row"] for e in self.errors if e["Row"] is not None})
+
+    def add_chunk(self, chunk):
+        columns = {str(c).strip(): c for c in chunk.columns}
+        first_row = self.rows + 2
+        self.rows += len(chunk)
+
+        if self.rows == len(chunk):
+            self.ignored_columns = [c for c in columns if c not in PROJECT_INPUT_KEYS]
+            if "project_name" not in columns:
+                self.errors.append({
+                    "Row": None, "Project": "", "Column": "project_name",
+                    "Error": "missing column (one row per project, named by project_name)",
+                })
+        if "project_name" not in columns:
+            return
+
+        empty = np.full(len(chunk), "", dtype=object)
+        clean = {}
+        errors = {}
+        for key in PROJECT_INPUT_KEYS:
+            text = _cell_text(chunk[columns[key]].to_numpy(dtype=object)) if key in columns else empty
+            clean[key], errors[key] = _coerce_column(key, text)
+
+        # Cross-field rules
+        late_exit = (clean["exit_yr"] > clean["ppa_term"]) & (errors["exit_yr"] == "")
+        errors["exit_yr"][late_exit & (errors["ppa_term"] == "")] = "must be ≤ ppa_term"
+
+        names = clean["project_name"]
+        named = names != ""
+        duplicate = named & (
+            pd.Series(names).duplicated().to_numpy() | np.isin(names, list(self.sites))
+        )
+        errors["project_name"][duplicate] = "duplicate project name in file"
+        if not self.replace:
+            errors["project_name"][named & ~duplicate & np.isin(names, list(self.existing))] = (
+                "project already exists"
+            )
+
+        messages = np.column_stack([errors[key] for key in PROJECT_INPUT_KEYS])
+        failed = (messages != "").any(axis=1)
+        for i in np.flatnonzero(failed):
+            for j in np.flatnonzero(messages[i] != ""):
+                self.errors.append({
+                    "Row": first_row + int(i), "Project": names[i],
+                    "Column": PROJECT_INPUT_KEYS[j], "Error": messages[i, j],
+                })
+
+        typed = [_python_values(key, clean[key]) for key in PROJECT_INPUT_KEYS]
+        for i in np.flatnonzero(~failed):
+            self.sites[names[i]] = {key: column[i] for key, column in zip(PROJECT_INPUT_KEYS, typed)}
+
+    def error_table(self):
+        return pd.DataFrame(self.errors, columns=["Row", "Project", "Column", "Error"])
+
+
+def validate_sites(chunks, existing=(), replace=False, on_chunk=None):
+    """Validate an iterable of chunks into a SiteImport (`on_chunk(rows_so_far)` after each)."""
+    result = SiteImport(existing, replace)
+    for chunk in chunks:
+        result.add_chunk(chunk)
+        if on_chunk:
+            on_chunk(result.rows)
+    return result
+
+
+def site_template():
+    """CSV template: all input columns with the base case as the example row."""
+    row = {key: BASE_CASE_INPUTS.get(key, "") for key in PROJECT_INPUT_KEYS}
+    row.update(project_name="Site 001", client_name="Client", project_loc="Bogota, Colombia")
+    return pd.DataFrame([row], columns=PROJECT_INPUT_KEYS).to_csv(index=False).encode("utf-8")
+
+
+# ------------------------------------------------------
+# PROJECT STORE
+# ------------------------------------------------------
+def merge_sites(projects, sites):
+    """
+    New project store with `sites` added. Replaced projects keep their
+    scenarios and files; only their inputs change.
+    """
+    merged = dict(projects)
+    for name, inputs in sites.items():
+        entry = dict(merged.get(name, {}))
+        entry["inputs"] = dict(inputs)
+        entry.setdefault("scenarios", {})
+        entry.setdefault("files", [])
+        merged[name] = entry
+    return merged
+
+
+def write_projects_file(path, projects):
+    """Write the project store to `path` in one atomic_write (all or nothing)."""
+    def write(tmp_path):
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(projects, f, ensure_ascii=False, indent=2)
+
+    atomic_write(path, write)
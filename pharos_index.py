@@ -0,0 +1,202 @@
+"""
+Persisted KPI index of the project store.
+
+One SQLite row per project (its current inputs) and per saved scenario
+with an input snapshot: the hash of what it was valued with, headline
+KPIs and when it was last valued. `KPIIndex.refresh` hashes every entry,
+compares against the stored hashes and re-values only the entries that
+changed (or are new) in batched engine runs; entries that no longer
+exist are dropped. Listing the portfolio is then a single query, however
+many projects there are.
+
+The hash covers the inputs, the display currency, US inflation, the
+stored hourly profile (for projects that use it), the project's actuals
+and INDEX_VERSION, which is bumped whenever the model changes the KPIs it
+produces. A monthly actuals upload therefore only re-values the projects
+it touched.
+"""
+import os
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from pharos_analytics import portfolio_kpis
+from pharos_cache import inputs_hash
+from pharos_engine import DEFAULT_CURRENCY_MODE, DEFAULT_US_INFLATION
+
+
+KPI_INDEX_FILE = os.environ.get("PHAROS_KPI_INDEX", os.path.join(".pharos_cache", "kpi_index.sqlite"))
+INDEX_VERSION = 1
+
+# Scenario column value of a project's current inputs
+CURRENT_INPUTS = ""
+
+# Index column -> portfolio_kpis column
+INDEX_KPI_COLUMNS = {
+    "equity_investment": "Equity_Investment",
+    "irr_unlevered": "IRR_Unlevered_%",
+    "irr_levered": "IRR_Levered_%",
+    "npv_equity": "NPV_Equity",
+    "moic": "MOIC_x",
+    "min_dscr": "Min_DSCR_x",
+    "payback_years": "Payback_Years",
+}
+INDEX_SORT_COLUMNS = ("project", "scenario", "updated_at") + tuple(INDEX_KPI_COLUMNS)
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS kpi_index (
+    project TEXT NOT NULL,
+    scenario TEXT NOT NULL,
+    input_hash TEXT NOT NULL,
+    currency_mode TEXT NOT NULL,
+    {", ".join(f"{c} REAL" for c in INDEX_KPI_COLUMNS)},
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (project, scenario)
+)
+"""
+
+
+def index_entries(projects):
+    """{(project, scenario): inputs} for every project and every scenario with a snapshot."""
+    entries = {}
+    for name, entry in projects.items():
+        entries[(name, CURRENT_INPUTS)] = entry.get("inputs", {})
+        for scen_name, scen in entry.get("scenarios", {}).items():
+            if "inputs" in scen:
+                entries[(name, scen_name)] = scen["inputs"]
+    return entries
+
+
+class KPIIndex:
+    """
+    SQLite KPI index (one file, shared by all sessions).
+
+    SQLite serializes concurrent writers; two sessions refreshing the same
+    change at once both value it and the later write wins with identical
+    numbers.
+    """
+
+    def __init__(self, path=KPI_INDEX_FILE):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        """Connection committing on success, rolling back on error, always closed."""
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def hashes(self, entries, currency_mode=DEFAULT_CURRENCY_MODE,
+               us_inflation_annual=DEFAULT_US_INFLATION, profile_store=None, actuals_store=None):
+        """Valuation hash of each entry."""
+        out = {}
+        for (project, scenario), inputs in entries.items():
+            profile = actuals = ""
+            if profile_store is not None and inputs.get("profile_on"):
+                profile = profile_store.signature(project)
+            if actuals_store is not None:
+                actuals = actuals_store.signature(project)
+            out[(project, scenario)] = inputs_hash({
+                "inputs": inputs, "currency_mode": currency_mode,
+                "us_inflation": us_inflation_annual, "profile": profile,
+                "actuals": actuals, "version": INDEX_VERSION,
+            })
+        return out
+
+    def refresh(self, projects, currency_mode=DEFAULT_CURRENCY_MODE,
+                us_inflation_annual=DEFAULT_US_INFLATION, profile_store=None, actuals_store=None):
+        """
+        Bring the index in line with the project store. Returns the number
+        of entries re-valued.
+        """
+        entries = index_entries(projects)
+        hashes = self.hashes(entries, currency_mode, us_inflation_annual, profile_store, actuals_store)
+        with self._connect() as conn:
+            stored = {
+                (project, scenario): h
+                for project, scenario, h in conn.execute(
+                    "SELECT project, scenario, input_hash FROM kpi_index"
+                )
+            }
+            stale = [key for key in stored if key not in entries]
+            if stale:
+                conn.executemany("DELETE FROM kpi_index WHERE project = ? AND scenario = ?", stale)
+
+        changed = [key for key, h in hashes.items() if stored.get(key) != h]
+        if not changed:
+            return 0
+
+        # portfolio_kpis keys must be unique labels: use the position
+        kpis = portfolio_kpis(
+            {i: entries[key] for i, key in enumerate(changed)},
+            currency_mode, us_inflation_annual,
+            profile_store=profile_store,
+            profile_projects={i: key[0] for i, key in enumerate(changed)},
+            actuals_store=actuals_store,
+        )
+        values = np.column_stack([kpis[col].to_numpy(np.float64) for col in INDEX_KPI_COLUMNS.values()])
+        now = datetime.now().isoformat(timespec="seconds")
+        rows = [
+            (project, scenario, hashes[(project, scenario)], currency_mode,
+             *[None if np.isnan(v) else float(v) for v in row], now)
+            for (project, scenario), row in zip(changed, values)
+        ]
+        columns = ("project", "scenario", "input_hash", "currency_mode", *INDEX_KPI_COLUMNS, "updated_at")
+        with self._connect() as conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO kpi_index ({', '.join(columns)}) "
+                f"VALUES ({', '.join('?' * len(columns))})",
+                rows,
+            )
+        return len(changed)
+
+    def table(self, search="", min_irr=None, include_scenarios=True, sort_by="project",
+              descending=False, limit=None):
+        """
+        Index rows as a DataFrame, filtered and sorted in SQL: `search`
+        matches project or scenario names (case-insensitive substring),
+        `min_irr` is a floor on levered IRR (%).
+        """
+        if sort_by not in INDEX_SORT_COLUMNS:
+            raise ValueError(f"Unknown sort column {sort_by!r}")
+        where, args = [], []
+        if search:
+            where.append("(project LIKE ? ESCAPE '\\' OR scenario LIKE ? ESCAPE '\\')")
+            pattern = "%" + search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            args += [pattern, pattern]
+        if min_irr is not None:
+            where.append("irr_levered >= ?")
+            args.append(float(min_irr))
+        if not include_scenarios:
+            where.append("scenario = ?")
+            args.append(CURRENT_INPUTS)
+        sql = (
+            f"SELECT project, scenario, {', '.join(INDEX_KPI_COLUMNS)}, currency_mode, updated_at "
+            "FROM kpi_index"
+            + (f" WHERE {' AND '.join(where)}" if where else "")
+            # NULL KPIs (no IRR, ...) last in either direction
+            + f" ORDER BY {sort_by} IS NULL, {sort_by} {'DESC' if descending else 'ASC'}, project, scenario"
+            + (" LIMIT ?" if limit else "")
+        )
+        if limit:
+            args.append(int(limit))
+        with self._connect() as conn:
+            df = pd.read_sql_query(sql, conn, params=args)
+        for col in INDEX_KPI_COLUMNS:
+            df[col] = df[col].astype(np.float64)
+        return df
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM kpi_index")
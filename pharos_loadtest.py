@@ -0,0 +1,352 @@
+"""
+Headless load test of the Pharos app.
+
+    python pharos_loadtest.py --sessions 8 --iterations 3 --max-p95-ms 4000
+
+Each simulated analyst session drives pharos_app.py through Streamlit's
+testing API (AppTest) with a realistic sequence, once per iteration:
+switch project, edit generation and CAPEX, toggle debt, run the exit
+simulation, then download the PDF report and the Excel model. Every step
+is one or more script reruns; its wall time is recorded per session.
+
+AppTest installs a process-wide mock runtime for each run, so sessions
+cannot share a process: each runs in its own worker process, all started
+together (optionally ramped up), and they compete for the machine's CPUs
+the way concurrent sessions compete for the server's. Downloads are
+deferred callables the browser fetches after the click; the harness
+calls them right after the click rerun, as the server would.
+
+The report gives rerun latency percentiles per step and overall, CPU
+use (CPU seconds of all sessions / wall time, i.e. cores kept busy) and
+per-session memory (peak RSS and its growth over the idle process). The
+app runs in a scratch directory with seeded projects, so the real
+project store, caches and indexes are never touched; a --workdir must be
+missing or empty, since the seeded store overwrites its project file.
+With --max-p95-ms, --max-session-mb or any app exception the exit status
+is 1, which makes the run usable as a capacity regression check.
+
+The module does not import Streamlit (the worker processes do).
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows: no memory figures
+    resource = None
+
+from pharos_engine import BASE_CASE_INPUTS
+from pharos_import import write_projects_file
+
+
+APP_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pharos_app.py")
+# Mirrors pharos_app.PROJECTS_FILE (relative to the app's working directory)
+PROJECTS_FILE = "pharos_projects.json"
+
+# Steps of one iteration, in order
+LOAD_STEPS = (
+    "switch_project", "edit_generation", "edit_capex", "toggle_debt",
+    "run_simulation", "download_pdf", "download_excel",
+)
+LATENCY_PERCENTILES = (50, 90, 95, 99)
+
+
+# ------------------------------------------------------
+# SCRATCH PROJECTS
+# ------------------------------------------------------
+def seed_projects(n_projects, seed=0):
+    """`n_projects` base-case variants (tariff, generation, CAPEX, debt) as a project store."""
+    rng = random.Random(seed)
+    projects = {}
+    for i in range(n_projects):
+        inputs = dict(BASE_CASE_INPUTS)
+        inputs["tariff_val"] = round(inputs["tariff_val"] * rng.uniform(0.85, 1.15), 1)
+        inputs["gen_val"] = round(inputs["gen_val"] * rng.uniform(0.7, 1.5), 1)
+        inputs["capex_val"] = round(inputs["capex_val"] * rng.uniform(0.8, 1.3), 1)
+        inputs["debt_on"] = rng.random() < 0.5
+        projects[f"Load test {i + 1:02d}"] = {"inputs": inputs, "scenarios": {}, "files": []}
+    return projects
+
+
+# ------------------------------------------------------
+# SESSION (WORKER PROCESS)
+# ------------------------------------------------------
+def _peak_rss_mb():
+    if resource is None:
+        return float("nan")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def _record_deferred_downloads():
+    """
+    {file id: callable} of every deferred download registered in this
+    process. AppTest only exposes a download button's file id, and the
+    mock runtime holding the callable is dropped after each run.
+    """
+    from streamlit.runtime.media_file_manager import MediaFileManager
+
+    registered = {}
+    add_deferred = MediaFileManager.add_deferred
+
+    def recording_add_deferred(self, data_callable, *args, **kwargs):
+        file_id = add_deferred(self, data_callable, *args, **kwargs)
+        registered[file_id] = data_callable
+        return file_id
+
+    MediaFileManager.add_deferred = recording_add_deferred
+    return registered
+
+
+def run_session(session, config):
+    """
+    One simulated analyst session (runs in a worker process). Returns the
+    step timings, app exceptions, CPU seconds and memory of the session.
+    """
+    os.chdir(config["workdir"])
+    # Streamlit resets its loggers' levels on every run; keep the report readable
+    logging.disable(logging.WARNING)
+    from streamlit.testing.v1 import AppTest
+
+    downloads = _record_deferred_downloads()
+    rng = random.Random(config["seed"] * 1000 + session)
+    baseline_mb = _peak_rss_mb()
+    time.sleep(config["ramp_s"] * session / max(config["sessions"], 1))
+
+    at = AppTest.from_file(config["app"], default_timeout=config["timeout_s"])
+    at.session_state["password_correct"] = True
+    steps, errors = [], []
+    cpu_start = time.process_time()
+
+    def timed(iteration, step, action):
+        start = time.perf_counter()
+        try:
+            action()
+        except Exception as e:  # a broken step is reported, the session goes on
+            errors.append({"session": session, "iteration": iteration, "step": step, "error": repr(e)})
+        else:
+            errors.extend(
+                {"session": session, "iteration": iteration, "step": step, "error": e.message}
+                for e in at.exception
+            )
+        steps.append({"session": session, "iteration": iteration, "step": step,
+                      "ms": (time.perf_counter() - start) * 1000})
+        if config["think_ms"]:
+            time.sleep(config["think_ms"] * rng.uniform(0.5, 1.5) / 1000)
+
+    def set_view(name):
+        view = at.radio(key="app_view")
+        view.set_value(next(o for o in view.options if name in o)).run()
+
+    def switch_project():
+        select = next(s for s in at.selectbox if s.label == "Select project")
+        others = [o for o in select.options if o != select.value]
+        select.set_value(rng.choice(others)).run()
+
+    def edit(key, low, high):
+        widget = at.number_input(key=key)
+        widget.set_value(round(widget.value * rng.uniform(low, high), 1)).run()
+
+    def toggle_debt():
+        debt = at.checkbox(key="debt_on")
+        debt.set_value(not debt.value).run()
+
+    def run_simulation():
+        set_view("Simulation")
+        next(b for b in at.button if "Run Simulation" in b.label).click().run()
+        set_view("Dashboard")
+
+    def download(label):
+        next(d for d in at.get("download_button") if label in d.label).click().run()
+        button = next(d for d in at.get("download_button") if label in d.label)
+        data = downloads[button.proto.deferred_file_id]()
+        if not data:
+            raise RuntimeError(f"{label} download is empty")
+
+    timed(0, "first_load", at.run)
+    actions = {
+        "switch_project": switch_project,
+        "edit_generation": lambda: edit("gen_val", 0.8, 1.2),
+        "edit_capex": lambda: edit("capex_val", 0.9, 1.1),
+        "toggle_debt": toggle_debt,
+        "run_simulation": run_simulation,
+        "download_pdf": lambda: download("PDF"),
+        "download_excel": lambda: download("Excel"),
+    }
+    for iteration in range(1, config["iterations"] + 1):
+        for step in LOAD_STEPS:
+            timed(iteration, step, actions[step])
+
+    return {
+        "session": session,
+        "steps": steps,
+        "errors": errors,
+        "cpu_s": time.process_time() - cpu_start,
+        "baseline_mb": baseline_mb,
+        "peak_mb": _peak_rss_mb(),
+    }
+
+
+# ------------------------------------------------------
+# LOAD TEST
+# ------------------------------------------------------
+def latency_table(steps):
+    """Latency percentiles (ms) per step and over all steps after the first load."""
+    df = pd.DataFrame(steps)
+    rows = []
+    groups = [(step, df[df["step"] == step]["ms"]) for step in ("first_load",) + LOAD_STEPS]
+    groups.append(("all steps", df[df["step"] != "first_load"]["ms"]))
+    for step, ms in groups:
+        if ms.empty:
+            continue
+        rows.append({
+            "Step": step,
+            "Count": len(ms),
+            **{f"P{p}_ms": np.percentile(ms, p) for p in LATENCY_PERCENTILES},
+            "Max_ms": ms.max(),
+        })
+    return pd.DataFrame(rows)
+
+
+def run_load_test(sessions=4, iterations=2, think_ms=250, ramp_s=0.0, n_projects=8,
+                  app=APP_SCRIPT, workdir=None, timeout_s=300, seed=0):
+    """
+    Run `sessions` concurrent sessions of `iterations` iterations each
+    against `app` in `workdir` (a fresh scratch directory by default,
+    removed afterwards; a given `workdir` must be missing or empty, else
+    ValueError, so a real project store is never overwritten). Returns a report dict: `latency` table, `sessions`
+    table (CPU s, peak and growth MB, errors), `errors`, `wall_s`,
+    `cpu_cores` (mean cores busy) and the run settings.
+    """
+    scratch = workdir is None
+    if not scratch and os.path.isdir(workdir) and os.listdir(workdir):
+        raise ValueError(f"workdir {workdir!r} is not empty; the load test seeds its own {PROJECTS_FILE}")
+    workdir = tempfile.mkdtemp(prefix="pharos_load_") if scratch else workdir
+    try:
+        os.makedirs(workdir, exist_ok=True)
+        write_projects_file(os.path.join(workdir, PROJECTS_FILE), seed_projects(n_projects, seed))
+        config = {
+            "app": os.path.abspath(app), "workdir": workdir, "sessions": sessions,
+            "iterations": iterations, "think_ms": think_ms, "ramp_s": ramp_s,
+            "timeout_s": timeout_s, "seed": seed,
+        }
+        ctx = multiprocessing.get_context("spawn")
+        start = time.perf_counter()
+        with ctx.Pool(sessions) as pool:
+            results = pool.starmap(run_session, [(i, config) for i in range(sessions)])
+        wall_s = time.perf_counter() - start
+    finally:
+        if scratch:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    steps = [s for r in results for s in r["steps"]]
+    errors = [e for r in results for e in r["errors"]]
+    session_table = pd.DataFrame([
+        {
+            "Session": r["session"],
+            "Steps": len(r["steps"]),
+            "Errors": len(r["errors"]),
+            "CPU_s": r["cpu_s"],
+            "Peak_MB": r["peak_mb"],
+            "Growth_MB": r["peak_mb"] - r["baseline_mb"],
+        }
+        for r in results
+    ])
+    return {
+        "settings": {
+            "sessions": sessions, "iterations": iterations, "think_ms": think_ms,
+            "ramp_s": ramp_s, "projects": n_projects, "cpus": os.cpu_count(),
+        },
+        "latency": latency_table(steps),
+        "sessions": session_table,
+        "errors": errors,
+        "wall_s": wall_s,
+        "cpu_cores": session_table["CPU_s"].sum() / wall_s,
+    }
+
+
+def format_report(report):
+    s = report["settings"]
+    lines = [
+        f"Pharos load test: {s['sessions']} sessions x {s['iterations']} iterations "
+        f"({s['projects']} projects, think {s['think_ms']} ms, {s['cpus']} CPUs)",
+        "",
+        report["latency"].to_string(index=False, float_format=lambda v: f"{v:,.0f}"),
+        "",
+        report["sessions"].to_string(index=False, float_format=lambda v: f"{v:,.1f}"),
+        "",
+        f"Wall {report['wall_s']:,.1f} s · CPU {report['cpu_cores']:.2f} cores busy · "
+        f"peak session RSS {report['sessions']['Peak_MB'].max():,.0f} MB · "
+        f"{len(report['errors'])} app errors",
+    ]
+    for e in report["errors"][:10]:
+        lines.append(f"  session {e['session']} iteration {e['iteration']} {e['step']}: {e['error']}")
+    return "\n".join(lines)
+
+
+def check_report(report, max_p95_ms=None, max_session_mb=None):
+    """Failed capacity checks as messages (empty when the run passes)."""
+    failures = []
+    if report["errors"]:
+        failures.append(f"{len(report['errors'])} app errors")
+    overall = report["latency"].set_index("Step").loc["all steps"]
+    if max_p95_ms is not None and overall["P95_ms"] > max_p95_ms:
+        failures.append(f"P95 {overall['P95_ms']:,.0f} ms > {max_p95_ms:,.0f} ms")
+    peak = report["sessions"]["Peak_MB"].max()
+    if max_session_mb is not None and peak > max_session_mb:
+        failures.append(f"peak session RSS {peak:,.0f} MB > {max_session_mb:,.0f} MB")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pharos app load test (headless, local)")
+    parser.add_argument("--sessions", type=int, default=4, help="concurrent sessions")
+    parser.add_argument("--iterations", type=int, default=2, help="interaction sequences per session")
+    parser.add_argument("--think-ms", type=float, default=250, help="mean pause between steps")
+    parser.add_argument("--ramp-s", type=float, default=0.0, help="spread session starts over this time")
+    parser.add_argument("--projects", type=int, default=8, help="seeded projects to switch between")
+    parser.add_argument("--app", default=APP_SCRIPT)
+    parser.add_argument("--workdir", default=None, help="empty app working directory (default: scratch)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-p95-ms", type=float, default=None, help="fail above this P95 latency")
+    parser.add_argument("--max-session-mb", type=float, default=None, help="fail above this peak RSS")
+    parser.add_argument("--json", default=None, help="also write the report as JSON")
+    args = parser.parse_args()
+    if args.sessions < 1 or args.iterations < 1 or args.projects < 2:
+        parser.error("need at least 1 session, 1 iteration and 2 projects")
+
+    try:
+        report = run_load_test(args.sessions, args.iterations, args.think_ms, args.ramp_s, args.projects,
+                               args.app, args.workdir, seed=args.seed)
+    except ValueError as e:
+        parser.error(str(e))
+    print(format_report(report))
+    failures = check_report(report, args.max_p95_ms, args.max_session_mb)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                **{k: report[k] for k in ("settings", "errors", "wall_s", "cpu_cores")},
+                "latency": report["latency"].to_dict(orient="records"),
+                "sessions": report["sessions"].to_dict(orient="records"),
+                "failures": failures,
+            }, f, indent=2)
+    if failures:
+        print("FAIL: " + "; ".join(failures))
+        sys.exit(1)
+    print("PASS")
+
+
+if __name__ == "__main__":
+    main()
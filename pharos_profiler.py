@@ -0,0 +1,236 @@
+"""
+Opt-in cProfile captures of app reruns and named operations.
+
+Profiling is off unless `PHAROS_PROFILER` (or the app's diagnostics
+toggle) selects a mode: "operations" profiles named operations (Run
+Simulation, Excel export, ...), "reruns" also profiles every full rerun.
+When off, `start_capture` returns None before touching the profiler, so
+the app pays nothing.
+
+Each capture is written as a pstats file named after the time, the
+operation, the hash of the inputs it ran with and its wall time, into
+`PHAROS_PROFILER_DIR`; only the newest PROFILER_KEEP files are kept.
+`top_functions` and `flame_rects` turn a capture into a top-functions
+table and the rectangles of an icicle flamegraph.
+
+cProfile allows one active profiler per process, so captures do not
+nest or overlap: an operation inside a profiled rerun (or while another
+session is capturing) is part of that capture rather than its own.
+"""
+import cProfile
+import os
+import pstats
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+from pharos_cache import atomic_write
+
+
+PROFILER_MODES = ("off", "operations", "reruns")
+PROFILER_MODE = os.environ.get("PHAROS_PROFILER", "off").strip().lower()
+if PROFILER_MODE not in PROFILER_MODES:
+    PROFILER_MODE = "off"
+PROFILER_DIR = os.environ.get("PHAROS_PROFILER_DIR", os.path.join(".pharos_cache", "cprofile"))
+PROFILER_KEEP = int(os.environ.get("PHAROS_PROFILER_KEEP", "50"))
+
+# Operation name of full-rerun captures
+RERUN = "rerun"
+
+_lock = threading.Lock()
+_active = None
+
+
+def _slug(text):
+    return re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-") or "operation"
+
+
+# ------------------------------------------------------
+# CAPTURES
+# ------------------------------------------------------
+class Capture:
+    """One running cProfile capture (see start_capture)."""
+
+    def __init__(self, operation, input_hash, directory):
+        self.operation = operation
+        self.input_hash = input_hash
+        self.directory = directory
+        self.started = datetime.now()
+        self.profiler = cProfile.Profile()
+        self._t0 = time.perf_counter()
+
+    def _release(self):
+        global _active
+        self.profiler.disable()
+        with _lock:
+            if _active is self:
+                _active = None
+
+    def stop(self, input_hash=None):
+        """Stop profiling and write the capture (under `input_hash` if given); returns its path."""
+        self._release()
+        wall_ms = (time.perf_counter() - self._t0) * 1000
+        if input_hash is not None:
+            self.input_hash = input_hash
+        name = (f"{self.started.strftime('%Y%m%d-%H%M%S-%f')}_{_slug(self.operation)}_"
+                f"{self.input_hash[:16]}_{wall_ms:.0f}ms.prof")
+        path = os.path.join(self.directory, name)
+        atomic_write(path, self.profiler.dump_stats)
+        prune_captures(self.directory)
+        return path
+
+    def discard(self):
+        """Stop profiling without writing anything (e.g. a rerun cut short)."""
+        self._release()
+
+
+def start_capture(operation, input_hash, mode=PROFILER_MODE, directory=PROFILER_DIR):
+    """
+    Started Capture of `operation` when `mode` profiles it, else None
+    (also None while another capture is running).
+    """
+    global _active
+    if mode == "off" or (operation == RERUN and mode != "reruns"):
+        return None
+    with _lock:
+        if _active is not None:
+            return None
+        capture = Capture(operation, input_hash, directory)
+        _active = capture
+    capture.profiler.enable()
+    return capture
+
+
+@contextmanager
+def profiled(operation, input_hash, mode=PROFILER_MODE, directory=PROFILER_DIR):
+    """Context manager around start_capture: the capture is written on exit, even on error."""
+    capture = start_capture(operation, input_hash, mode, directory)
+    try:
+        yield capture
+    finally:
+        if capture is not None:
+            capture.stop()
+
+
+def prune_captures(directory=PROFILER_DIR, keep=PROFILER_KEEP):
+    """Delete all but the newest `keep` captures."""
+    try:
+        names = sorted(n for n in os.listdir(directory) if n.endswith(".prof"))
+    except OSError:
+        return
+    for name in names[:max(len(names) - keep, 0)]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+
+
+def list_captures(directory=PROFILER_DIR):
+    """
+    Captures on disk, newest first (File, Captured, Operation, Input_Hash,
+    Wall_s), from the file names alone.
+    """
+    columns = ["File", "Captured", "Operation", "Input_Hash", "Wall_s"]
+    try:
+        names = sorted((n for n in os.listdir(directory) if n.endswith(".prof")), reverse=True)
+    except OSError:
+        names = []
+    rows = []
+    for name in names:
+        match = re.fullmatch(r"(\d{8}-\d{6}-\d{6})_([a-z0-9-]+)_([0-9a-f]*)_(\d+)ms\.prof", name)
+        if match is None:
+            continue
+        stamp, operation, input_hash, wall_ms = match.groups()
+        rows.append({
+            "File": name,
+            "Captured": datetime.strptime(stamp, "%Y%m%d-%H%M%S-%f").strftime("%Y-%m-%d %H:%M:%S"),
+            "Operation": operation,
+            "Input_Hash": input_hash,
+            "Wall_s": int(wall_ms) / 1000,
+        })
+    return pd.DataFrame(rows, columns=columns)
+
+
+# ------------------------------------------------------
+# REPORTS
+# ------------------------------------------------------
+def _label(func):
+    filename, line, name = func
+    if filename == "~":
+        return name
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+def top_functions(path, n=30, sort="Cumulative_s"):
+    """
+    The `n` heaviest functions of a capture (Function, Calls, Own_s,
+    Cumulative_s, Own_%), by `sort` (Own_s or Cumulative_s).
+    """
+    stats = pstats.Stats(path)
+    total = stats.total_tt or 1.0
+    df = pd.DataFrame([
+        {
+            "Function": _label(func),
+            "Calls": nc,
+            "Own_s": tt,
+            "Cumulative_s": ct,
+            "Own_%": tt / total * 100,
+        }
+        for func, (cc, nc, tt, ct, callers) in stats.stats.items()
+    ], columns=["Function", "Calls", "Own_s", "Cumulative_s", "Own_%"])
+    return df.sort_values(sort, ascending=False, ignore_index=True).head(n)
+
+
+def flame_rects(path, max_depth=24, min_fraction=0.002):
+    """
+    Icicle flamegraph of a capture: one rectangle per call path (Function,
+    Depth, Start_s, End_s, Seconds). cProfile keeps caller -> callee totals
+    rather than stacks, so each function's time under a path is its
+    per-caller time, scaled to the share of the caller's time the path
+    accounts for. Paths under `min_fraction` of the total are dropped;
+    recursion stops at the first repeat.
+    """
+    stats = pstats.Stats(path).stats
+    callees = {}
+    for func, (cc, nc, tt, ct, callers) in stats.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+    roots = [
+        (func, ct) for func, (cc, nc, tt, ct, callers) in stats.items()
+        if not any(caller in stats for caller in callers)
+    ]
+    total = sum(ct for _, ct in roots) or 1.0
+    rows = []
+
+    def visit(func, seconds, depth, start, path_funcs):
+        rows.append({
+            "Function": _label(func),
+            "Depth": depth,
+            "Start_s": start,
+            "End_s": start + seconds,
+            "Seconds": seconds,
+        })
+        if depth + 1 >= max_depth:
+            return
+        own_ct = stats[func][3]
+        share = seconds / own_ct if own_ct > 0 else 0.0
+        offset = start
+        for child, edge_ct in sorted(callees.get(func, []), key=lambda c: -c[1]):
+            if child in path_funcs:
+                continue
+            child_seconds = min(edge_ct * share, start + seconds - offset)
+            if child_seconds < min_fraction * total:
+                continue
+            visit(child, child_seconds, depth + 1, offset, path_funcs | {child})
+            offset += child_seconds
+
+    start = 0.0
+    for func, ct in sorted(roots, key=lambda r: -r[1]):
+        if ct >= min_fraction * total:
+            visit(func, ct, 0, start, frozenset([func]))
+            start += ct
+    return pd.DataFrame(rows, columns=["Function", "Depth", "Start_s", "End_s", "Seconds"])
@@ -0,0 +1,213 @@
+"""
+Hourly generation and client load profiles.
+
+A site profile is one year of hourly energy (8760 values, kWh) for PV
+generation and for the client's load. `ProfileStore` keeps each project's
+profile as a float32 (2, 8760) .npy file and opens it memory-mapped, so
+portfolio runs only page in the hours they touch.
+
+`quarterly_netting` nets generation against load hour by hour for every
+operating quarter at once: the quarter's calendar hours are degraded with
+the engine's convention, (1 - d) ** ((k - 1) / 4) for operating quarter k,
+and split into self-consumption (billed at the PPA price) and export.
+`profile_schedules` turns the result into the engine's
+`generation_schedule` / `billed_schedule`. Profiles give the shape; the
+levels follow the generation and consumption inputs.
+"""
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from pharos_cache import atomic_write
+
+
+HOURS_PER_YEAR = 8760
+# Hours per calendar quarter of a 365-day year (Jan-Mar 90 d, Apr-Jun 91 d, Jul-Sep 92 d, Oct-Dec 92 d)
+QUARTER_HOURS = (2160, 2184, 2208, 2208)
+QUARTER_BOUNDS = np.concatenate([[0], np.cumsum(QUARTER_HOURS)])
+
+PROFILE_DIR = os.environ.get("PHAROS_PROFILE_DIR", "pharos_profiles")
+
+# Accepted CSV headers (case-insensitive) for the two profile columns
+GENERATION_COLUMNS = ("generation_kwh", "generation", "gen_kwh", "pv_kwh")
+LOAD_COLUMNS = ("load_kwh", "load", "consumption_kwh", "consumption")
+
+
+# ------------------------------------------------------
+# PROFILE FILES
+# ------------------------------------------------------
+def read_profile_csv(source):
+    """
+    (2, 8760) float32 array [generation, load] in kWh per hour from a CSV
+    with one row per hour. Leap-year files (8784 rows) drop 29 February.
+    Raises ValueError for missing columns, wrong lengths or bad values.
+    """
+    df = pd.read_csv(source)
+    lookup = {str(c).strip().lower(): c for c in df.columns}
+
+    def column(names, label):
+        for name in names:
+            if name in lookup:
+                return pd.to_numeric(df[lookup[name]], errors="coerce").to_numpy(np.float64)
+        raise ValueError(f"Missing {label} column (one of: {', '.join(names)})")
+
+    profile = np.vstack([column(GENERATION_COLUMNS, "generation"), column(LOAD_COLUMNS, "load")])
+    if profile.shape[1] == HOURS_PER_YEAR + 24:
+        feb29 = 59 * 24
+        profile = np.delete(profile, np.s_[feb29:feb29 + 24], axis=1)
+    if profile.shape[1] != HOURS_PER_YEAR:
+        raise ValueError(f"Expected {HOURS_PER_YEAR} hourly rows, got {profile.shape[1]}")
+    if not np.isfinite(profile).all():
+        raise ValueError("Profile has empty or non-numeric values")
+    if (profile < 0).any():
+        raise ValueError("Profile values must be non-negative")
+    if profile[0].sum() <= 0:
+        raise ValueError("Generation profile is all zero")
+    return profile.astype(np.float32)
+
+
+def profile_totals(profile):
+    """Annual generation and load (MWh) of a profile."""
+    return {
+        "generation_mwh": float(profile[0].sum(dtype=np.float64)) / 1000,
+        "load_mwh": float(profile[1].sum(dtype=np.float64)) / 1000,
+    }
+
+
+class ProfileStore:
+    """
+    Directory of per-project hourly profiles (float32 .npy, one per project).
+
+    `load` returns a read-only memory map. Writes go through a temporary
+    file (atomic_write), so readers never see a partial profile.
+    """
+
+    def __init__(self, directory=PROFILE_DIR):
+        self.directory = directory
+
+    def _path(self, project):
+        digest = hashlib.sha256(project.encode("utf-8")).hexdigest()[:24]
+        return os.path.join(self.directory, f"{digest}.npy")
+
+    def __contains__(self, project):
+        return os.path.exists(self._path(project))
+
+    def signature(self, project):
+        """Changes whenever the project's profile is saved or removed ("" if none)."""
+        try:
+            st = os.stat(self._path(project))
+        except OSError:
+            return ""
+        return f"{st.st_mtime_ns}-{st.st_size}"
+
+    def save(self, project, profile):
+        def write(tmp_path):
+            out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(2, HOURS_PER_YEAR))
+            out[:] = profile
+            out.flush()
+            del out
+
+        atomic_write(self._path(project), write)
+
+    def load(self, project):
+        """Memory-mapped (2, 8760) profile of `project`, or None."""
+        try:
+            return np.load(self._path(project), mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+
+    def remove(self, project):
+        try:
+            os.remove(self._path(project))
+        except OSError:
+            pass
+
+
+# ------------------------------------------------------
+# NETTING
+# ------------------------------------------------------
+def quarterly_netting(profile, degradation_annual, start_q_num, construction_quarters,
+                      n_quarters, generation_mwh=None, load_mwh=None):
+    """
+    Generation, self-consumption, export and load (MWh) for operating
+    quarters 1..n_quarters, as (n_quarters,) float64 arrays.
+
+    Operating quarter k covers calendar quarter
+    (start_q_num - 1 + construction_quarters + k - 1) % 4 of the profile.
+    `generation_mwh` / `load_mwh` rescale the profile to those annual
+    totals (None keeps the recorded levels). Each calendar quarter is
+    netted for all its operating quarters in one (n, hours) operation.
+    """
+    totals = profile_totals(profile)
+    gen_scale = 1.0 if generation_mwh is None else generation_mwh / totals["generation_mwh"]
+    load_scale = 1.0 if load_mwh is None or totals["load_mwh"] <= 0 else load_mwh / totals["load_mwh"]
+
+    k = np.arange(n_quarters)
+    calendar_q = (start_q_num - 1 + construction_quarters + k) % 4
+    factor = (1 - degradation_annual) ** (k / 4) * gen_scale
+
+    out = {name: np.zeros(n_quarters) for name in ("generation", "self_consumed", "exported", "load")}
+    for c in range(4):
+        ks = np.flatnonzero(calendar_q == c)
+        if not len(ks):
+            continue
+        hours = slice(QUARTER_BOUNDS[c], QUARTER_BOUNDS[c + 1])
+        gen = np.asarray(profile[0, hours])
+        load = np.asarray(profile[1, hours]) * np.float32(load_scale)
+        scaled = factor[ks].astype(np.float32)[:, None] * gen[None, :]
+        out["generation"][ks] = factor[ks] * gen.sum(dtype=np.float64)
+        out["self_consumed"][ks] = np.minimum(scaled, load[None, :]).sum(axis=1, dtype=np.float64)
+        out["load"][ks] = load.sum(dtype=np.float64)
+    out["self_consumed"] = np.minimum(out["self_consumed"], out["generation"])
+    out["exported"] = out["generation"] - out["self_consumed"]
+    return {name: values / 1000 for name, values in out.items()}
+
+
+def profile_schedules(p, profile):
+    """
+    Engine `generation_schedule` / `billed_schedule` (MWh per quarter,
+    construction quarters zero) for model parameters `p` and a profile.
+    Self-consumption is billed in full, exports at `export_price_ratio`.
+    """
+    net = quarterly_netting(
+        profile, p["degradation_annual"], p["start_q_num"], p["construction_quarters"],
+        p["ppa_term_years"] * 4, p["initial_gen_mwh_annual"], p["client_consumption"],
+    )
+    pad = (0.0,) * p["construction_quarters"]
+    billed = net["self_consumed"] + p["export_price_ratio"] * net["exported"]
+    return {
+        "generation_schedule": pad + tuple(net["generation"].tolist()),
+        "billed_schedule": pad + tuple(billed.tolist()),
+    }
+
+
+def apply_profile(p, project, store):
+    """`p` with the project's profile schedules when it uses one and one is stored."""
+    if not p.get("use_hourly_profile"):
+        return p
+    profile = store.load(project)
+    if profile is None:
+        return p
+    return {**p, **profile_schedules(p, profile)}
+
+
+def netting_table(p, profile):
+    """Operating-quarter netting table (MWh and self-consumption share) for display."""
+    net = quarterly_netting(
+        profile, p["degradation_annual"], p["start_q_num"], p["construction_quarters"],
+        p["ppa_term_years"] * 4, p["initial_gen_mwh_annual"], p["client_consumption"],
+    )
+    df = pd.DataFrame({
+        "Op_Quarter": np.arange(1, len(net["generation"]) + 1),
+        "Generation_MWh": net["generation"],
+        "Self_Consumed_MWh": net["self_consumed"],
+        "Exported_MWh": net["exported"],
+        "Load_MWh": net["load"],
+    })
+    with np.errstate(divide="ignore", invalid="ignore"):
+        df["Self_Consumption_%"] = np.where(
+            df["Generation_MWh"] > 0, df["Self_Consumed_MWh"] / df["Generation_MWh"] * 100, np.nan
+        )
+    return df
@@ -0,0 +1,522 @@
+"""
+PDF investment memos for the Pharos BTM model.
+
+`create_pdf` renders one memo from a report context (see `report_context`).
+`build_report_book` renders memos for many projects and saved scenarios
+across a process pool and streams them into a single ZIP or one merged PDF.
+The module does not import Streamlit so it can run in worker processes.
+"""
+import io
+import os
+import re
+import tempfile
+import zipfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt  # noqa: E402
+import numpy as np  # noqa: E402
+
+from fpdf import FPDF  # noqa: E402
+
+from pharos_actuals import ActualsStore, apply_actuals  # noqa: E402
+from pharos_analytics import financial_metrics  # noqa: E402
+from pharos_engine import (  # noqa: E402
+    DEFAULT_CURRENCY_MODE,
+    DEFAULT_US_INFLATION,
+    model_params_from_inputs,
+    run_model,
+)
+from pharos_profiles import ProfileStore, apply_profile  # noqa: E402
+
+
+REPORT_FORMATS = ["ZIP", "Merged PDF"]
+
+
+# ------------------------------------------------------
+# PDF HELPER FUNCTIONS (CHARTS)
+# ------------------------------------------------------
+def make_fcf_chart_image(df_annual_dash_local, currency_mode_local):
+    unit_label = currency_mode_local
+    years = df_annual_dash_local["Calendar_Year"].astype(int)
+    fig, ax = plt.subplots(figsize=(6, 3))
+    ax.bar(years - 0.15, df_annual_dash_local["UFCF_Disp"],
+           width=0.3, label="UFCF")
+    ax.bar(years + 0.15, df_annual_dash_local["LFCF_Disp"],
+           width=0.3, label="LFCF")
+    ax.set_title(f"Free Cash Flows by Year ({unit_label})")
+    ax.set_xlabel("Year")
+    ax.set_ylabel(unit_label)
+    ax.legend()
+    fig.tight_layout()
+    tmpfile = tempfile.NamedTemporaryFile(delete=False, suffix=".png")
+    fig.savefig(tmpfile.name, dpi=150)
+    plt.close(fig)
+    return tmpfile.name
+
+
+def make_sim_heatmap_image(sim_df_local, T_local, currency_mode_local):
+    if sim_df_local is None or sim_df_local.empty:
+        return None
+
+    # sim_df_local must have ExitYear, ExitValue, IRR
+    pivot = sim_df_local.pivot(index="ExitYear", columns="ExitValue", values="IRR")
+    years = pivot.index.values
+    vals = pivot.columns.values
+
+    fig, ax = plt.subplots(figsize=(6, 4))
+    c = ax.imshow(pivot.values, aspect="auto", origin="lower")
+    ax.set_xticks(np.arange(len(vals)))
+    ax.set_xticklabels(vals, rotation=45, ha="right")
+    ax.set_yticks(np.arange(len(years)))
+    ax.set_yticklabels(years)
+    ax.set_xlabel(T_local["s5_val"])
+    ax.set_ylabel(T_local["s5_year"])
+    ax.set_title(f"{T_local['sim_chart']} ({currency_mode_local})")
+    fig.colorbar(c, ax=ax, label="IRR %")
+    fig.tight_layout()
+    tmpfile = tempfile.NamedTemporaryFile(delete=False, suffix=".png")
+    fig.savefig(tmpfile.name, dpi=150)
+    plt.close(fig)
+    return tmpfile.name
+
+
+# ------------------------------------------------------
+# PDF GENERATION
+# ------------------------------------------------------
+def _pdf_bytes(pdf):
+    return pdf.output(dest='S').encode('latin-1', 'replace')
+
+
+class PDF(FPDF):
+    def header(self):
+        if os.path.exists("logo.jpg"):
+            self.image("logo.jpg", 10, 8, 33)
+        self.set_font('Arial', 'B', 15)
+        self.cell(80)
+        self.cell(30, 10, 'Pharos Capital: BTM Model', 0, 0, 'C')
+        self.ln(20)
+
+    def footer(self):
+        self.set_y(-15)
+        self.set_font('Arial', 'I', 8)
+        self.cell(0, 10, f'Page {self.page_no()}', 0, 0, 'C')
+
+
+def create_pdf(report, T_local, sim_df_local=None, close_df_local=None, pdf=None):
+    """
+    Investment memo for one project/scenario.
+
+    `report` comes from report_context(). When `pdf` is given the memo is
+    appended to that document (merged report books) and None is returned;
+    otherwise the PDF bytes are returned.
+    """
+    df_annual_dash_local = report["df_annual_dash"]
+    proj_name = report["proj_name"]
+    cli_name = report["cli_name"]
+    loc = report["loc"]
+    curr_sym = report["curr_sym"]
+    currency_mode_local = report["currency_mode"]
+    fx_rate_current_local = report["fx_rate_current"]
+    start_year = report["start_year"]
+    start_q_str = report["start_q_str"]
+    ppa_term_years = report["ppa_term_years"]
+    current_tariff = report["current_tariff"]
+    discount_rate = report["discount_rate"]
+    initial_gen_mwh_annual = report["initial_gen_mwh_annual"]
+    capex_million_cop = report["capex_million_cop"]
+    debt_ratio = report["debt_ratio"]
+    inv_conv = report["inv_conv"]
+    equity_inv_disp = report["equity_inv_disp"]
+    irr_levered = report["irr_levered"]
+    npv_equity = report["npv_equity"]
+    moic_levered = report["moic_levered"]
+    metrics = report.get("metrics")
+
+    standalone = pdf is None
+    if standalone:
+        pdf = PDF()
+    pdf.add_page()
+    pdf.set_font("Arial", size=12)
+
+    # Units note
+    pdf.set_font("Arial", 'I', 9)
+    pdf.set_text_color(100, 100, 100)
+    pdf.cell(0, 6, f"All monetary figures in {currency_mode_local}", 0, 1, 'R')
+    pdf.ln(2)
+    pdf.set_text_color(0, 0, 0)
+    pdf.set_font("Arial", size=12)
+
+    # Compute Year-1 PPA price to client
+    ppa_price_year1_cop = current_tariff * (1 - discount_rate)
+    if "USD" in currency_mode_local:
+        ppa_price_year1_disp = ppa_price_year1_cop / fx_rate_current_local
+    else:
+        ppa_price_year1_disp = ppa_price_year1_cop
+
+    # 1. Project Overview
+    pdf.set_fill_color(14, 47, 68)
+    pdf.set_text_color(255, 255, 255)
+    pdf.cell(0, 10, "1. Project Overview", 0, 1, 'L', 1)
+    pdf.set_text_color(0, 0, 0)
+    pdf.ln(2)
+    pdf.cell(90, 7, f"Project: {proj_name}", 0, 0)
+    pdf.cell(90, 7, f"Client: {cli_name}", 0, 1)
+    pdf.cell(90, 7, f"Location: {loc}", 0, 1)
+    pdf.ln(5)
+
+    # 2. Key Assumptions
+    pdf.set_fill_color(14, 47, 68)
+    pdf.set_text_color(255, 255, 255)
+    pdf.cell(0, 10, "2. Key Assumptions", 0, 1, 'L', 1)
+    pdf.set_text_color(0, 0, 0)
+    pdf.ln(2)
+
+    # Row 1: timing
+    pdf.cell(60, 7, f"Start: {start_year} {start_q_str}", 0, 0)
+    pdf.cell(60, 7, f"Term: {ppa_term_years} Years", 0, 1)
+
+    # Row 2: tariffs
+    pdf.cell(60, 7, f"Client Tariff: ${current_tariff:,.1f}/kWh", 0, 0)
+    pdf.cell(60, 7, f"Discount Offered: {discount_rate*100:.1f}%", 0, 0)
+    pdf.cell(60, 7, f"Year 1 PPA Price: ${ppa_price_year1_disp:,.2f}/kWh", 0, 1)
+
+    # Row 3: energy & capex
+    pdf.cell(60, 7, f"Energy: {initial_gen_mwh_annual:,.1f} MWh", 0, 0)
+    pdf.cell(
+        60, 7,
+        f"CAPEX: {curr_sym}{capex_million_cop*inv_conv:,.1f} {currency_mode_local.split()[0]}",
+        0, 0
+    )
+    pdf.cell(60, 7, f"Leverage: {debt_ratio*100:.0f}%", 0, 1)
+    pdf.ln(5)
+
+    # 3. Executive Summary
+    pdf.set_fill_color(14, 47, 68)
+    pdf.set_text_color(255, 255, 255)
+    pdf.cell(0, 10, "3. Executive Summary", 0, 1, 'L', 1)
+    pdf.set_text_color(0, 0, 0)
+    pdf.ln(2)
+    pdf.set_font("Arial", 'B', 12)
+    pdf.cell(45, 10, f"Eq Inv: {curr_sym}{equity_inv_disp:,.1f}", 1, 0, 'C')
+    pdf.cell(45, 10, f"IRR: {irr_levered:.1f}%", 1, 0, 'C')
+    pdf.cell(45, 10, f"NPV: {curr_sym}{npv_equity:,.1f}", 1, 0, 'C')
+    pdf.cell(45, 10, f"MOIC: {moic_levered:,.1f}x", 1, 1, 'C')
+    if metrics:
+        def fmt(value, pattern):
+            return "n/a" if value is None or np.isnan(value) else pattern.format(value)
+        pdf.set_font("Arial", size=10)
+        pdf.cell(45, 8, f"Min DSCR: {fmt(metrics['min_dscr'], '{:.2f}x')}", 1, 0, 'C')
+        pdf.cell(45, 8, f"LLCR: {fmt(metrics['llcr'], '{:.2f}x')}", 1, 0, 'C')
+        pdf.cell(45, 8, f"Payback: {fmt(metrics['payback_years'], '{:.1f} yrs')}", 1, 0, 'C')
+        pdf.cell(45, 8, f"Cash yield: {fmt(metrics['cash_yield_pct'], '{:.1f}%')}", 1, 1, 'C')
+    pdf.set_font("Arial", size=12)
+    pdf.ln(5)
+
+    # 4. FCF Overview (Chart)
+    pdf.set_fill_color(14, 47, 68)
+    pdf.set_text_color(255, 255, 255)
+    pdf.cell(0, 10, "4. Free Cash Flow Overview", 0, 1, 'L', 1)
+    pdf.set_text_color(0, 0, 0)
+    pdf.ln(2)
+    try:
+        fcf_img = report.get("fcf_chart_path")
+        if fcf_img:
+            pdf.image(fcf_img, x=10, y=None, w=180)
+        else:
+            fcf_img = make_fcf_chart_image(df_annual_dash_local, currency_mode_local)
+            pdf.image(fcf_img, x=10, y=None, w=180)
+            os.remove(fcf_img)
+    except Exception as e:
+        pdf.set_font("Arial", '', 10)
+        pdf.cell(0, 6, f"(Could not render FCF chart: {e})", 0, 1)
+    pdf.ln(5)
+
+    # 5. Simulation Matrix - IRR Sensitivity
+    if sim_df_local is not None and not sim_df_local.empty:
+        pdf.set_fill_color(14, 47, 68)
+        pdf.set_text_color(255, 255, 255)
+        pdf.cell(
+            0, 10,
+            "5. Simulation Matrix - Equity IRR Sensitivity for Client Asset Buy-Back",
+            0, 1, 'L', 1
+        )
+        pdf.set_text_color(0, 0, 0)
+        pdf.ln(2)
+        try:
+            sim_img = make_sim_heatmap_image(sim_df_local, T_local, currency_mode_local)
+            if sim_img:
+                pdf.image(sim_img, x=10, y=None, w=180)
+        except Exception as e:
+            pdf.set_font("Arial", '', 10)
+            pdf.cell(0, 6, f"(Could not render sensitivity heatmap: {e})", 0, 1)
+        pdf.ln(5)
+
+        # 5a. Simulation Table (excerpt)
+        pdf.set_fill_color(14, 47, 68)
+        pdf.set_text_color(255, 255, 255)
+        pdf.cell(0, 10, "5a. Simulation Table (Exit Year vs Asset Value)", 0, 1, 'L', 1)
+        pdf.set_text_color(0, 0, 0)
+        pdf.ln(2)
+        pdf.set_font("Arial", size=9)
+
+        sim_tbl = sim_df_local.copy()
+
+        # Normalize column names regardless of language / history
+        if "ExitYear" in sim_tbl.columns and "ExitValue" in sim_tbl.columns:
+            pass
+        elif T_local["s5_year"] in sim_tbl.columns and T_local["s5_val"] in sim_tbl.columns:
+            sim_tbl = sim_tbl.rename(columns={
+                T_local["s5_year"]: "ExitYear",
+                T_local["s5_val"]: "ExitValue"
+            })
+        elif "Exit Year" in sim_tbl.columns and "Exit Value (M COP)" in sim_tbl.columns:
+            sim_tbl = sim_tbl.rename(columns={
+                "Exit Year": "ExitYear",
+                "Exit Value (M COP)": "ExitValue"
+            })
+        else:
+            year_col = next(
+                (c for c in sim_tbl.columns if "Year" in c or "Año" in c),
+                None
+            )
+            val_col = next(
+                (c for c in sim_tbl.columns if c not in ("IRR", year_col)),
+                None
+            )
+            if year_col and val_col:
+                sim_tbl = sim_tbl.rename(columns={
+                    year_col: "ExitYear",
+                    val_col: "ExitValue"
+                })
+            else:
+                return _pdf_bytes(pdf) if standalone else None
+
+        sim_tbl = sim_tbl.sort_values(["ExitYear", "ExitValue"])
+        sim_tbl = sim_tbl[["ExitYear", "ExitValue", "IRR"]].head(25)
+
+        headers_sim = ["Exit Year", "Exit Value (M COP)", "IRR %"]
+        widths_sim = [25, 55, 25]
+
+        pdf.set_fill_color(220, 220, 220)
+        for w, h in zip(widths_sim, headers_sim):
+            pdf.cell(w, 7, h, 1, 0, 'C', 1)
+        pdf.ln()
+
+        for _, row in sim_tbl.iterrows():
+            pdf.cell(widths_sim[0], 6, f"{int(row['ExitYear'])}", 1, 0, 'C')
+            pdf.cell(widths_sim[1], 6, f"{row['ExitValue']:,.1f}", 1, 0, 'R')
+            pdf.cell(widths_sim[2], 6, f"{row['IRR']:,.1f}", 1, 0, 'R')
+            pdf.ln()
+
+        pdf.ln(5)
+
+    # 6. Alternatives Matching Base IRR
+    if close_df_local is not None and not close_df_local.empty:
+        pdf.set_fill_color(14, 47, 68)
+        pdf.set_text_color(255, 255, 255)
+        pdf.cell(0, 10, "6. Alternatives with IRR Close to Base Case", 0, 1, 'L', 1)
+        pdf.set_text_color(0, 0, 0)
+        pdf.ln(2)
+        pdf.set_font("Arial", size=9)
+
+        close_pdf = close_df_local.head(10).copy()
+        headers = ["Exit Year", "Exit Value (M COP)", "IRR %", "Delta IRR vs Base"]
+        widths = [25, 55, 25, 30]
+        pdf.set_fill_color(220, 220, 220)
+        for w, h in zip(widths, headers):
+            pdf.cell(w, 7, h, 1, 0, 'C', 1)
+        pdf.ln()
+
+        for _, row in close_pdf.iterrows():
+            pdf.cell(widths[0], 6, f"{int(row['Exit Year'])}", 1, 0, 'C')
+            pdf.cell(widths[1], 6, f"{row['Exit Value (M COP)']:,.1f}", 1, 0, 'R')
+            pdf.cell(widths[2], 6, f"{row['IRR']:,.1f}", 1, 0, 'R')
+            pdf.cell(widths[3], 6, f"{row['ΔIRR_vs_Base']:+.1f}", 1, 0, 'R')
+            pdf.ln()
+
+    return _pdf_bytes(pdf) if standalone else None
+
+
+def report_context(params, outputs, proj_name, cli_name, loc):
+    """Everything create_pdf needs from the model parameters and stage outputs."""
+    currency_mode = params["currency_mode"]
+    kpis = outputs["kpis"]
+    metrics = None
+    if "engine" in outputs and "exit" in outputs:
+        metrics = {
+            key: float(values[0])
+            for key, values in financial_metrics(
+                outputs["engine"], outputs["exit"], params["investor_disc_rate"]
+            ).items()
+        }
+    return {
+        "proj_name": proj_name,
+        "cli_name": cli_name,
+        "loc": loc,
+        "curr_sym": "$" if "USD" in currency_mode else "",
+        "currency_mode": currency_mode,
+        "fx_rate_current": params["fx_rate_current"],
+        "start_year": params["start_year"],
+        "start_q_str": f"Q{params['start_q_num']}",
+        "ppa_term_years": params["ppa_term_years"],
+        "current_tariff": params["current_tariff"],
+        "discount_rate": params["discount_rate"],
+        "initial_gen_mwh_annual": params["initial_gen_mwh_annual"],
+        "capex_million_cop": params["capex_million_cop"],
+        # Sized leverage when the engine sized the debt (Target DSCR)
+        "debt_ratio": (
+            outputs["engine"].params["debt_ratio"] if "engine" in outputs else params["debt_ratio"]
+        ),
+        "inv_conv": kpis["inv_conv"],
+        "equity_inv_disp": kpis["equity_inv_disp"],
+        "irr_levered": kpis["irr_levered"],
+        "npv_equity": kpis["npv_equity"],
+        "moic_levered": kpis["moic_levered"],
+        # Coverage / payback KPIs (None when the engine output is not passed)
+        "metrics": metrics,
+        "df_annual_dash": outputs["aggregation"]["df_annual_dash"],
+    }
+
+
+# ------------------------------------------------------
+# BATCH REPORT BOOKS
+# ------------------------------------------------------
+def scenario_inputs(project_inputs, scenario):
+    """
+    Inputs of a saved scenario: its own snapshot when it has one, otherwise
+    (KPI-only scenarios saved by older versions) the project inputs with the
+    scenario's PPA term and exit assumptions applied.
+    """
+    if scenario.get("inputs"):
+        return dict(scenario["inputs"])
+    inputs = dict(project_inputs)
+    if scenario.get("PPA_Years") is not None:
+        inputs["ppa_term"] = scenario["PPA_Years"]
+    if scenario.get("Exit_Year") is not None:
+        inputs["exit_yr"] = scenario["Exit_Year"]
+    if scenario.get("Exit_Value_M_COP") is not None:
+        # The saved exit value already reflects the scenario's exit method
+        inputs["exit_method"] = "Fixed Asset Value"
+        inputs["exit_asset_val"] = scenario["Exit_Value_M_COP"]
+    return inputs
+
+
+def report_jobs(projects, project_names, include_scenarios=True):
+    """One report job per selected project (current inputs) and per saved scenario."""
+    jobs = []
+    for name in project_names:
+        pdata = projects.get(name, {})
+        inputs = dict(pdata.get("inputs", {}))
+        jobs.append({"project": name, "scenario": None, "inputs": inputs})
+        if include_scenarios:
+            for scen_name, scen in pdata.get("scenarios", {}).items():
+                jobs.append({
+                    "project": name,
+                    "scenario": scen_name,
+                    "inputs": scenario_inputs(inputs, scen),
+                })
+    return jobs
+
+
+def _file_label(name, default):
+    # Whitespace, path separators and characters Windows rejects become "_"
+    label = re.sub(r'[\s/\\:*?"<>|\x00-\x1f]+', "_", (name or "").strip()).strip("._")
+    return label or default
+
+
+def report_file_name(job, ext="pdf", taken=None):
+    """
+    File name of a job's memo. Pass the same `taken` set for every entry of
+    an archive: a name already in it (compared case-insensitively, as
+    Windows extracts them) gets an index suffix, and the name is added.
+    """
+    stem = f"{_file_label(job['project'], 'Project')}__{_file_label(job['scenario'], 'memo')}"
+    name = f"{stem}.{ext}"
+    if taken is not None:
+        index = 2
+        while name.lower() in taken:
+            name = f"{stem}_{index}.{ext}"
+            index += 1
+        taken.add(name.lower())
+    return name
+
+
+def _render_job(job, T_local, currency_mode, us_inflation_annual, merged):
+    """Worker: run the model for one job and render its memo (or its report context)."""
+    inputs = job["inputs"]
+    params = model_params_from_inputs(inputs, currency_mode, us_inflation_annual)
+    params = apply_profile(params, job["project"], ProfileStore())
+    params = apply_actuals(params, job["project"], ActualsStore())
+    report = report_context(
+        params, run_model(params),
+        inputs.get("project_name") or job["project"],
+        inputs.get("client_name", ""),
+        inputs.get("project_loc", ""),
+    )
+    if job["scenario"]:
+        report["proj_name"] = f"{report['proj_name']} - {job['scenario']}"
+    if merged:
+        # The chart is the expensive part; render it here and let the parent
+        # process lay the pages out into one document.
+        report["fcf_chart_path"] = make_fcf_chart_image(report["df_annual_dash"], currency_mode)
+        return report
+    return create_pdf(report, T_local)
+
+
+def build_report_book(jobs, T_local, currency_mode=DEFAULT_CURRENCY_MODE,
+                      us_inflation_annual=DEFAULT_US_INFLATION, fmt="ZIP",
+                      max_workers=None, output=None, on_progress=None):
+    """
+    Render one memo per job across a process pool.
+
+    Memos are streamed into `output` (a binary file object, BytesIO by
+    default) as they complete, either as entries of a ZIP archive or as
+    pages of one merged PDF, in job order. Returns the bytes when no
+    `output` is given.
+    """
+    merged = fmt == "Merged PDF"
+    target = output if output is not None else io.BytesIO()
+    render = partial(
+        _render_job, T_local=T_local, currency_mode=currency_mode,
+        us_inflation_annual=us_inflation_annual, merged=merged,
+    )
+
+    workers = max_workers or os.cpu_count() or 1
+    workers = max(1, min(workers, len(jobs)))
+    pool = None
+    if workers > 1:
+        # spawn: workers must not inherit the server's threads and sockets
+        pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+        results = pool.map(render, jobs, chunksize=max(1, len(jobs) // (workers * 4)))
+    else:
+        results = map(render, jobs)
+
+    try:
+        if merged:
+            book = PDF()
+            for done, report in enumerate(results, start=1):
+                try:
+                    create_pdf(report, T_local, pdf=book)
+                finally:
+                    os.remove(report["fcf_chart_path"])
+                if on_progress:
+                    on_progress(done, len(jobs))
+            target.write(_pdf_bytes(book))
+        else:
+            with zipfile.ZipFile(target, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+                names = set()
+                for done, (job, pdf_bytes) in enumerate(zip(jobs, results), start=1):
+                    zf.writestr(report_file_name(job, taken=names), pdf_bytes)
+                    if on_progress:
+                        on_progress(done, len(jobs))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    if output is None:
+        return target.getvalue()
+    return None
@@ -0,0 +1,183 @@
+"""
+Saved scenarios for the Pharos app.
+
+Besides its headline KPIs, a scenario stores the full input snapshot it was
+run with and its quarterly cash-flow arrays (M COP, up to the exit quarter,
+exit inflows included). The arrays are zlib-compressed and base64-encoded so
+they round-trip through pharos_projects.json; comparison tables, cash-flow
+overlays and scenario deltas are built from them without re-running the
+engine.
+"""
+import base64
+import zlib
+
+import numpy as np
+import pandas as pd
+
+
+# Quarterly arrays persisted per scenario (engine columns, M COP)
+SCENARIO_ARRAY_COLUMNS = [
+    "Calendar_Year", "Quarter",
+    "UFCF_M_COP", "LFCF_M_COP",
+    "Interest_M_COP", "Principal_M_COP", "Debt_Balance_M_COP",
+    "Tax_M_COP",
+]
+# Keys holding the snapshot/arrays rather than headline KPIs
+SCENARIO_DETAIL_KEYS = ("inputs", "arrays", "exit")
+
+SCENARIO_KPI_COLUMNS = [
+    "PPA_Years",
+    "Equity_Investment",
+    "IRR_Levered_%",
+    "MOIC_x",
+    "Exit_Method",
+    "Exit_Year",
+    "Exit_Value_M_COP",
+    "PPA_Year1_$perkWh",
+    "Client_Tariff_$perkWh",
+]
+
+OVERLAY_SERIES = {
+    "Levered FCF (cumulative)": ("LFCF_M_COP", True),
+    "Unlevered FCF (cumulative)": ("UFCF_M_COP", True),
+    "Levered FCF": ("LFCF_M_COP", False),
+    "Debt Balance": ("Debt_Balance_M_COP", False),
+    "Taxes": ("Tax_M_COP", False),
+}
+
+
+# ------------------------------------------------------
+# ARRAY PACKING
+# ------------------------------------------------------
+def pack_arrays(arrays, dtype="float64"):
+    """Compress equal-length 1-D arrays into a JSON-serializable dict."""
+    columns = list(arrays)
+    block = np.ascontiguousarray(
+        np.vstack([np.asarray(arrays[c], dtype=dtype) for c in columns])
+    )
+    return {
+        "columns": columns,
+        "dtype": dtype,
+        "shape": list(block.shape),
+        "data": base64.b64encode(zlib.compress(block.tobytes(), 6)).decode("ascii"),
+    }
+
+
+def unpack_arrays(packed):
+    """Inverse of `pack_arrays`: dict of column -> read-only ndarray."""
+    raw = zlib.decompress(base64.b64decode(packed["data"]))
+    block = np.frombuffer(raw, dtype=packed["dtype"]).reshape(packed["shape"])
+    return dict(zip(packed["columns"], block))
+
+
+# ------------------------------------------------------
+# SCENARIO RECORDS
+# ------------------------------------------------------
+def build_scenario(kpis, inputs, engine, exit_info):
+    """
+    Scenario record: headline `kpis` plus the input snapshot and compressed
+    quarterly arrays of `engine` up to the exit quarter (exit inflows added).
+    """
+    n = exit_info["dash_exit_q"]
+    arrays = {col: np.array(engine[col][:n], dtype=np.float64) for col in SCENARIO_ARRAY_COLUMNS}
+    arrays["UFCF_M_COP"][n - 1] += exit_info["exit_inflow_unlevered_cop"]
+    arrays["LFCF_M_COP"][n - 1] += exit_info["exit_inflow_levered_cop"]
+
+    record = dict(kpis)
+    record["inputs"] = dict(inputs)
+    record["arrays"] = pack_arrays(arrays)
+    record["exit"] = {
+        "quarter": int(n),
+        "inflow_unlevered_cop": float(exit_info["exit_inflow_unlevered_cop"]),
+        "inflow_levered_cop": float(exit_info["exit_inflow_levered_cop"]),
+    }
+    return record
+
+
+def scenario_summary(scenario):
+    """Headline KPIs only (drops snapshot and arrays), for tables and Excel."""
+    return {k: v for k, v in scenario.items() if k not in SCENARIO_DETAIL_KEYS}
+
+
+def has_snapshot(scenario):
+    return "inputs" in scenario and "arrays" in scenario
+
+
+def scenario_table(scenarios):
+    """Comparison table (one row per scenario, SCENARIO_KPI_COLUMNS order)."""
+    df = pd.DataFrame.from_dict(
+        {name: scenario_summary(s) for name, s in scenarios.items()},
+        orient="index"
+    )
+    for col in SCENARIO_KPI_COLUMNS:
+        if col not in df.columns:
+            df[col] = np.nan
+
+    # Backward compatibility: if old Tariff_$perkWh exists, map to PPA_Year1
+    if "Tariff_$perkWh" in df.columns:
+        df["PPA_Year1_$perkWh"] = df["PPA_Year1_$perkWh"].fillna(df["Tariff_$perkWh"])
+
+    df = df[SCENARIO_KPI_COLUMNS]
+    df.index.name = "Scenario"
+    return df.reset_index()
+
+
+def scenario_quarterly(scenario):
+    """Quarterly arrays of a saved scenario as a DataFrame (None for KPI-only scenarios)."""
+    if not has_snapshot(scenario):
+        return None
+    df = pd.DataFrame(unpack_arrays(scenario["arrays"]))
+    df["Calendar_Year"] = df["Calendar_Year"].astype(np.int64)
+    df["Quarter"] = df["Quarter"].astype(np.int64)
+    df.insert(0, "Period", df["Calendar_Year"] + (df["Quarter"] - 1) / 4)
+    return df
+
+
+def scenario_overlay(scenarios, series="Levered FCF (cumulative)"):
+    """Long-format (Scenario, Period, Value) frame for an overlay chart."""
+    col, cumulative = OVERLAY_SERIES[series]
+    frames = []
+    for name, scen in scenarios.items():
+        df = scenario_quarterly(scen)
+        if df is None:
+            continue
+        values = df[col].cumsum() if cumulative else df[col]
+        frames.append(pd.DataFrame({"Scenario": name, "Period": df["Period"], "Value": values}))
+    if not frames:
+        return pd.DataFrame(columns=["Scenario", "Period", "Value"])
+    return pd.concat(frames, ignore_index=True)
+
+
+def scenario_delta(scen_a, scen_b):
+    """
+    Differences between two saved scenarios (B - A).
+
+    Returns (kpis, inputs, annual): headline KPIs side by side, the inputs
+    whose snapshot values differ, and annual LFCF/UFCF/tax by calendar year.
+    `inputs` and `annual` are None when either scenario has no snapshot.
+    """
+    kpi_rows = []
+    for col in SCENARIO_KPI_COLUMNS:
+        a, b = scen_a.get(col), scen_b.get(col)
+        numeric = all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in (a, b))
+        kpi_rows.append({"Metric": col, "A": a, "B": b, "Delta": b - a if numeric else None})
+    kpis = pd.DataFrame(kpi_rows)
+
+    if not (has_snapshot(scen_a) and has_snapshot(scen_b)):
+        return kpis, None, None
+
+    in_a, in_b = scen_a["inputs"], scen_b["inputs"]
+    inputs = pd.DataFrame(
+        [{"Input": k, "A": in_a.get(k), "B": in_b.get(k)}
+         for k in list(dict.fromkeys([*in_a, *in_b]))
+         if in_a.get(k) != in_b.get(k)],
+        columns=["Input", "A", "B"]
+    )
+
+    cols = ["UFCF_M_COP", "LFCF_M_COP", "Tax_M_COP"]
+    annual_a = scenario_quarterly(scen_a).groupby("Calendar_Year")[cols].sum()
+    annual_b = scenario_quarterly(scen_b).groupby("Calendar_Year")[cols].sum()
+    annual = annual_a.join(annual_b, how="outer", lsuffix="_A", rsuffix="_B").fillna(0.0)
+    for col in cols:
+        annual[f"{col}_Delta"] = annual[f"{col}_B"] - annual[f"{col}_A"]
+    return kpis, inputs, annual.reset_index()